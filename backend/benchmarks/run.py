@@ -0,0 +1,257 @@
+"""
+Benchmarks every route against a seeded question bank.
+
+    python -m benchmarks.run --database sqlite:////tmp/trivia_bench.db --size 100k \\
+        --output results.json --compare baseline.json
+
+Each route is driven twice: in-process through the Flask test client
+(latency of the app alone) and through a threaded WSGI server by
+concurrent HTTP clients (latency and throughput under load). Results are
+written as JSON so runs can be compared.
+"""
+import argparse
+import http.client
+import json
+import platform
+import random
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from flaskr import create_app
+from models import db, Question
+from .seed import WORDS, parse_size, seed
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+"""
+build_scenarios(total, categories, generator)
+    the requests sent to each route, as (name, method, path, body) makers.
+    Every call returns a fresh request so pages, ids and terms vary.
+"""
+def build_scenarios(total, categories, generator):
+    last_page = max(total // 10, 1)
+
+    def quiz_turn():
+        previous = [generator.randint(1, total) for _ in range(5)]
+        category = generator.choice([0] + categories)
+        return {'previous_questions': previous,
+                'quiz_category': {'id': category, 'type': 'bench'}}
+
+    return {
+        'GET /categories': lambda: ('GET', '/categories', None),
+        'GET /questions': lambda: (
+            'GET', f'/questions?page={generator.randint(1, min(last_page, 50))}', None),
+        'GET /questions deep page': lambda: (
+            'GET', f'/questions?page={generator.randint(last_page // 2, last_page)}', None),
+        'GET /questions after_id': lambda: (
+            'GET', f'/questions?after_id={generator.randint(1, total)}', None),
+        'GET /categories/<id>/questions': lambda: (
+            'GET', f'/categories/{generator.choice(categories)}/questions'
+                   f'?page={generator.randint(1, 5)}', None),
+        'POST /questions/search': lambda: (
+            'POST', '/questions/search',
+            {'searchTerm': ' '.join(generator.sample(WORDS, 2))}),
+        'POST /quiz': lambda: ('POST', '/quiz', quiz_turn()),
+        'POST /quiz/round': lambda: ('POST', '/quiz/round',
+                                     dict(quiz_turn(), count=5)),
+    }
+
+
+def percentile(sorted_values, fraction):
+    # nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def failed_status(status):
+    # the app answers its own failures with 4xx codes (a failed query is a
+    # 422), anything but a success or a 304 is counted
+    return not (200 <= status < 300 or status == 304)
+
+
+def run_test_client(app, make_request, requests):
+    client = app.test_client()
+    latencies = []
+    errors = 0
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        method, path, body = make_request()
+        request_started = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        latencies.append(time.perf_counter() - request_started)
+        if failed_status(response.status_code):
+            errors += 1
+
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def run_wsgi(port, make_request, requests, concurrency):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    per_worker = max(requests // concurrency, 1)
+
+    def worker():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        for _ in range(per_worker):
+            with lock:
+                method, path, body = make_request()
+            payload = json.dumps(body) if body is not None else None
+            headers = {'Content-Type': 'application/json'} if body else {}
+
+            request_started = time.perf_counter()
+            try:
+                connection.request(method, path, body=payload, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                failed = failed_status(response.status)
+            except (OSError, http.client.HTTPException):
+                failed = True
+            latency = time.perf_counter() - request_started
+
+            # the wsgiref server closes the connection after each request
+            connection.close()
+
+            with lock:
+                latencies.append(latency)
+                if failed:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+def compare(results, baseline):
+    # p95 and rps change of every route present in both runs
+    lines = []
+    for mode, routes in results['results'].items():
+        for route, current in routes.items():
+            previous = baseline.get('results', {}).get(mode, {}).get(route)
+            if not previous:
+                continue
+            p95_change = ((current['p95_ms'] - previous['p95_ms']) /
+                          previous['p95_ms'] * 100) if previous['p95_ms'] else 0.0
+            rps_change = ((current['rps'] - previous['rps']) /
+                          previous['rps'] * 100) if previous['rps'] else 0.0
+            lines.append(f"{mode:8} {route:34} p95 {previous['p95_ms']:9.3f} -> "
+                         f"{current['p95_ms']:9.3f} ms ({p95_change:+6.1f}%)  "
+                         f"rps {rps_change:+6.1f}%")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', required=True,
+                        help='SQLAlchemy URL, e.g. sqlite:////tmp/trivia_bench.db')
+    parser.add_argument('--size', default='1k',
+                        help='questions to seed: 1k, 10k, 100k, 1m or a number')
+    parser.add_argument('--no-seed', action='store_true',
+                        help='reuse the data already in the database')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per route and mode')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='concurrent clients for the WSGI load test')
+    parser.add_argument('--mode', choices=['client', 'wsgi', 'both'],
+                        default='both')
+    parser.add_argument('--routes', help='comma separated subset of routes')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--compare', help='JSON results of a previous run')
+    args = parser.parse_args()
+
+    if args.no_seed:
+        app = create_app({'DATABASE_PATH': args.database,
+                          'INSTRUMENTATION_ENABLED': False})
+    else:
+        app = seed(args.database, parse_size(args.size))
+
+    with app.app_context():
+        total = Question.query.count()
+        categories = sorted(app.extensions['category_cache'].get().categories)
+        db.session.remove()
+
+    generator = random.Random(1)
+    scenarios = build_scenarios(total, categories, generator)
+    if args.routes:
+        wanted = {route.strip() for route in args.routes.split(',')}
+        scenarios = {name: make for name, make in scenarios.items()
+                     if name in wanted}
+
+    results = {
+        'meta': {
+            'database': app.config['SQLALCHEMY_DATABASE_URI'].split('@')[-1],
+            'questions': total,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'python': platform.python_version(),
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': {},
+    }
+
+    if args.mode in ('client', 'both'):
+        results['results']['client'] = {
+            name: run_test_client(app, make, args.requests)
+            for name, make in scenarios.items()
+        }
+
+    if args.mode in ('wsgi', 'both'):
+        server = make_server('127.0.0.1', 0, app,
+                             server_class=ThreadingWSGIServer,
+                             handler_class=QuietHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            results['results']['wsgi'] = {
+                name: run_wsgi(server.server_port, make, args.requests,
+                               args.concurrency)
+                for name, make in scenarios.items()
+            }
+        finally:
+            server.shutdown()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            print(compare(results, json.load(baseline_file)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
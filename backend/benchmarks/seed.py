@@ -0,0 +1,126 @@
+"""
+Seeds a synthetic question bank for the benchmarks.
+
+    python -m benchmarks.seed --database sqlite:////tmp/trivia_bench.db --size 100k
+"""
+import argparse
+import random
+import time
+import warnings
+
+from sqlalchemy import MetaData, create_engine
+from sqlalchemy.exc import SAWarning
+
+import migrations
+from flaskr import create_app
+from flaskr.bulk import insert_batch
+from models import db, Question, Category
+
+# tables of the app, dropped before seeding
+TABLES = ('quiz_results', 'question_stats', 'questions', 'categories',
+          'question_version', 'schema_version')
+
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment',
+              'Sports']
+
+# words the synthetic questions are made of, so searches have hits
+WORDS = ['capital', 'river', 'painter', 'album', 'element', 'war', 'king',
+         'planet', 'mountain', 'novel', 'movie', 'team', 'ocean', 'treaty',
+         'composer', 'island', 'language', 'invention', 'empire', 'record',
+         'title', 'country', 'city', 'author', 'season', 'medal', 'sculpture',
+         'theory', 'currency', 'desert']
+
+SIZES = {
+    '1k': 1000,
+    '10k': 10000,
+    '100k': 100000,
+    '1m': 1000000,
+}
+
+
+def parse_size(size):
+    size = str(size).lower()
+    return SIZES[size] if size in SIZES else int(size)
+
+
+def synthetic_rows(count, seed=0):
+    generator = random.Random(seed)
+    for number in range(count):
+        words = generator.sample(WORDS, 5)
+        yield {
+            'question': f"Which {words[0]} {words[1]} {words[2]} is number {number}?",
+            'answer': f"{words[3]} {words[4]}",
+            'category': generator.randint(1, len(CATEGORIES)),
+            'difficulty': generator.randint(1, 5),
+        }
+
+
+def reset_schema(database_path):
+    # drop_all orders the drops by foreign key, then the migrations build
+    # the schema the app expects
+    engine = create_engine(database_path)
+    metadata = MetaData()
+    with warnings.catch_warnings():
+        # the search index is an expression SQLAlchemy does not reflect
+        warnings.simplefilter('ignore', SAWarning)
+        metadata.reflect(bind=engine, only=lambda name, _: name in TABLES)
+    metadata.drop_all(bind=engine)
+    migrations.upgrade(engine)
+    engine.dispose()
+
+
+"""
+seed(database_path, size)
+    recreates the tables of the app with the migrations and fills them
+    with the categories and size synthetic questions, batch_size rows per
+    transaction. Returns the app bound to the database.
+"""
+def seed(database_path, size, batch_size=5000, seed=0):
+    reset_schema(database_path)
+    app = create_app({'DATABASE_PATH': database_path,
+                      'INSTRUMENTATION_ENABLED': False})
+
+    with app.app_context():
+        # the starter content of the migrations is replaced
+        db.session.execute(Question.__table__.delete())
+        db.session.execute(Category.__table__.delete())
+        db.session.execute(Category.__table__.insert(),
+                           [{'id': category_id, 'type': category}
+                            for category_id, category in
+                            enumerate(CATEGORIES, start=1)])
+        db.session.commit()
+
+        use_copy = db.engine.dialect.name == 'postgresql'
+        batch = []
+        for row in synthetic_rows(size, seed):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                insert_batch(batch, use_copy)
+                batch = []
+        if batch:
+            insert_batch(batch, use_copy)
+
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute('ANALYZE questions')
+            db.session.commit()
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', required=True,
+                        help='SQLAlchemy URL, e.g. sqlite:////tmp/trivia_bench.db')
+    parser.add_argument('--size', default='1k',
+                        help='number of questions: 1k, 10k, 100k, 1m or a number')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    seed(args.database, parse_size(args.size), args.batch_size)
+    print(f"seeded {parse_size(args.size)} questions in "
+          f"{time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import time
+from threading import Lock
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+"""
+PoolMetrics
+    counters for one connection pool: checkouts, checkins, new and
+    invalidated connections, the time spent waiting for a connection,
+    checkout timeouts and the highest overflow reached.
+"""
+class PoolMetrics:
+
+    def __init__(self):
+        self._lock = Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.overflow_max = 0
+
+    def record_checkout(self, wait_time, overflow):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+            self.overflow_max = max(self.overflow_max, overflow)
+
+    def record_timeout(self, wait_time):
+        with self._lock:
+            self.timeouts += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def increment(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self, pool=None):
+        with self._lock:
+            metrics = {
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_time_total_ms': round(self.wait_time_total * 1000, 3),
+                'wait_time_max_ms': round(self.wait_time_max * 1000, 3),
+                'wait_time_avg_ms': round(
+                    self.wait_time_total * 1000 / self.checkouts, 3)
+                    if self.checkouts else 0.0,
+                'overflow_max': self.overflow_max,
+            }
+
+        # current state, only queue pools have a size and an overflow
+        if isinstance(pool, QueuePool):
+            metrics.update({
+                'size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow(),
+            })
+        elif pool is not None:
+            metrics['status'] = pool.status()
+
+        return metrics
+
+
+"""
+instrumented_pool_class(metrics)
+    returns a QueuePool subclass reporting to metrics. The class carries the
+    metrics so pools recreated by engine.dispose() keep reporting.
+"""
+def instrumented_pool_class(metrics):
+
+    class InstrumentedQueuePool(QueuePool):
+        pool_metrics = metrics
+
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except exc.TimeoutError:
+                self.pool_metrics.record_timeout(time.perf_counter() - start)
+                raise
+
+            self.pool_metrics.record_checkout(time.perf_counter() - start,
+                                              max(self.overflow(), 0))
+            return connection
+
+        def _do_return_conn(self, conn):
+            self.pool_metrics.increment('checkins')
+            super()._do_return_conn(conn)
+
+    event.listen(InstrumentedQueuePool, 'connect',
+                 lambda dbapi_connection, record: metrics.increment('connects'))
+    event.listen(InstrumentedQueuePool, 'invalidate',
+                 lambda dbapi_connection, record, exception:
+                 metrics.increment('invalidations'))
+
+    return InstrumentedQueuePool
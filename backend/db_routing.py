@@ -0,0 +1,178 @@
+import functools
+import itertools
+import time
+from threading import Lock
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, event, orm, text
+from sqlalchemy.sql.expression import UpdateBase
+
+# cookie holding the end of a client's read-your-writes window
+PRIMARY_COOKIE = 'db_primary_until'
+
+
+"""
+Replica
+    one read replica: its engine, whether the last health check passed and
+    the number of reads routed to it. A disconnect seen on any of its
+    connections takes it out until the next check.
+"""
+class Replica:
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.healthy = True
+        self.checked_at = None
+        self.reads = 0
+        self.failures = 0
+        event.listen(engine, 'handle_error', self.on_error)
+
+    def check(self):
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            self.healthy = True
+        except Exception:
+            self.healthy = False
+            self.failures += 1
+        self.checked_at = time.monotonic()
+
+    def on_error(self, context):
+        if context.is_disconnect:
+            self.healthy = False
+            self.failures += 1
+
+    def status(self):
+        return {
+            'healthy': self.healthy,
+            'reads': self.reads,
+            'failures': self.failures,
+        }
+
+
+"""
+ReplicaRouter
+    picks the engine of each read routed away from the primary: the
+    replicas are taken in turn, skipping those whose health check failed,
+    and every replica is checked again (SELECT 1) once check_interval
+    seconds have passed since its last check. With no healthy replica the
+    reads go to the primary.
+
+    A client that wrote is sent to the primary for window seconds after
+    its write (a cookie carries the deadline, so every worker honours it),
+    so it reads its own write even while the replicas lag.
+"""
+class ReplicaRouter:
+
+    def __init__(self, engines, check_interval=10, window=5):
+        self.replicas = [Replica(engine) for engine in engines]
+        self.check_interval = check_interval
+        self.window = window
+        self._turns = itertools.cycle(range(len(self.replicas)))
+        self._lock = Lock()
+
+    def next_replica(self):
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = self.replicas[next(self._turns)]
+
+            if (replica.checked_at is None or
+                    time.monotonic() - replica.checked_at > self.check_interval):
+                replica.check()
+            if replica.healthy:
+                replica.reads += 1
+                return replica
+        return None
+
+    def in_write_window(self):
+        try:
+            return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    """
+    read_engine()
+        the replica engine for the reads of the current request, or None
+        for the primary: outside of reads_from_replica views, after a
+        write and during the client's read-your-writes window. A request
+        keeps the replica it was given for all of its reads.
+    """
+    def read_engine(self):
+        if (not self.replicas or not has_request_context() or
+                not g.get('db_read_only') or g.get('db_wrote')):
+            return None
+
+        if 'db_replica' not in g:
+            g.db_replica = (None if self.in_write_window()
+                            else self.next_replica())
+        return g.db_replica.engine if g.db_replica is not None else None
+
+    def record_write(self):
+        if has_request_context():
+            g.db_wrote = True
+
+    def after_request(self, response):
+        # starts, or extends, the client's read-your-writes window
+        if self.replicas and g.get('db_wrote'):
+            response.set_cookie(PRIMARY_COOKIE, str(time.time() + self.window),
+                                max_age=self.window, httponly=True)
+        return response
+
+    def init_app(self, app):
+        app.extensions['db_router'] = self
+        app.after_request(self.after_request)
+
+    def status(self):
+        return [replica.status() for replica in self.replicas]
+
+
+"""
+reads_from_replica(view)
+    marks a view as read only, its queries may be answered by a replica.
+"""
+def reads_from_replica(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+"""
+create_replica_engines(urls, engine_options)
+    one engine per replica URL with the options of the primary, each with
+    a plain pool of its own (the instrumented one reports the primary).
+"""
+def create_replica_engines(urls, engine_options):
+    options = dict(engine_options)
+    options.pop('poolclass', None)
+    return [create_engine(url, **options) for url in urls]
+
+
+"""
+RoutingSession
+    a session that sends the reads of replica views to the router's
+    replica and everything else to the primary. Flushes (the ORM writes of
+    insert, update and delete) and Core insert/update/delete statements
+    always use the primary, and mark the request as having written.
+"""
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        router = self.app.extensions.get('db_router')
+        if router is not None:
+            if self._flushing or isinstance(clause, UpdateBase):
+                router.record_write()
+            else:
+                engine = router.read_engine()
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
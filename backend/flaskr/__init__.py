@@ -1,35 +1,299 @@
 from crypt import methods
+import math
 import os
 import sys
 # from tracemalloc import start
-from flask import Flask, flash, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
+import click
+from flask import (Flask, Response, current_app, flash, g, request, abort,
+                   jsonify, stream_with_context)
 from flask_cors import CORS
-import random
+from sqlalchemy import create_engine
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import HTTPException
 
-from models import setup_db, Question, Category
+import settings
+import migrations
+from db_routing import reads_from_replica
+from models import (setup_db, add_question_listener, notify_question_listeners,
+                    bump_question_version, db, database_path, Question,
+                    QuestionStat)
+from .bulk import (READERS, EXPORT_FORMATS, ImportFailed, check_difficulty,
+                   export_questions, import_questions, mutate_questions,
+                   validate_mutation, validate_row)
+from .cache import CategoryCache, LRUCacheBackend, ResponseCache
+from .compression import Compressor
+from .diagnostics import (SlowQueryLog, StartupTimer, StatementTimeouts,
+                          is_statement_timeout)
+from .instrumentation import Instrumentation
+from .pagination import (CountCache, category_count_key, page_of_question,
+                         paginate_questions)
+from .quiz import MappedQuestionIndex, QuestionIndex, question_count
+from .ratelimit import RateLimiter
+from .results import Leaderboard, ResultRecorder, validate_result
+from .search import create_search_backend
+from .serializers import create_serializer, encode_page
+from .sessions import MemoryQuizSessionStore, resume_quiz_session
+from .shared_store import SharedQuestionStore
+from .statistics import (STATISTICS_COUNT_KEY, question_statistics,
+                         statistics_query)
+from .store import QuestionStore
 
-# define db
-db = SQLAlchemy()
+# largest batch accepted by POST /questions/batch, and the most ids a
+# batch delete or update may list
+MAX_BATCH_SIZE = 1000
 
-QUESTIONS_PER_PAGE = 10
+# messages of the JSON error responses, shared with the async app
+ERROR_MESSAGES = {
+    400: "bad request",
+    404: "resource not found",
+    422: "unprocessable",
+    429: "too many requests",
+    500: "internal server error",
+    503: "service unavailable",
+}
+
+def error_body(code):
+    return {
+        "success": False,
+        "error": code,
+        "message": ERROR_MESSAGES[code]
+    }
+
+# page size from ?per_page=, 400 outside 1..MAX_QUESTIONS_PER_PAGE
+def get_per_page(request):
+    per_page = request.args.get('per_page',
+                                current_app.config['QUESTIONS_PER_PAGE'],
+                                type=int)
+    if not 1 <= per_page <= current_app.config['MAX_QUESTIONS_PER_PAGE']:
+        abort(400)
+    return per_page
 
 # pagination handler
-def do_paginate_questions(request, all_questions):
+def do_paginate_questions(request, selection, order_by=None):
     page = request.args.get('page', 1, type=int) # get the page default index
-    start_paginate_index = (page - 1) * QUESTIONS_PER_PAGE
-    end_paginate_index =  start_paginate_index + QUESTIONS_PER_PAGE
-    questions = [question.format() for question in all_questions]
-    
-    # retrieve the current set of questions
-    current_questions = questions[start_paginate_index:end_paginate_index]
-    
+    after_id = request.args.get('after_id', None, type=int) # keyset cursor
+
+    # retrieve the current set of questions, only one page is loaded
+    current_questions = paginate_questions(selection, page=page,
+                                           per_page=get_per_page(request),
+                                           after_id=after_id,
+                                           order_by=order_by)
+
     return current_questions
 
+# pagination from the in-memory question store, as encoded JSON fragments
+def do_paginate_snapshot(request, snapshot, serializer, category=None):
+    page = request.args.get('page', 1, type=int)
+    after_id = request.args.get('after_id', None, type=int)
+
+    return [snapshot.fragment(position, serializer) for position in
+            snapshot.page_positions(category, page=page,
+                                    per_page=get_per_page(request),
+                                    after_id=after_id)]
+
 def create_app(test_config=None):
+    # time spent in each phase of the startup, on /diagnostics/startup
+    startup_timer = StartupTimer()
+
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    app.config.from_mapping(
+        QUIZ_SESSION_TTL=settings.QUIZ_SESSION_TTL,
+        QUIZ_SESSION_MAX=settings.QUIZ_SESSION_MAX,
+        QUIZ_SESSION_STORE=None,
+        CATEGORY_CACHE_TTL=settings.CATEGORY_CACHE_TTL,
+        SEARCH_BACKEND=settings.SEARCH_BACKEND,
+        RESPONSE_CACHE_SIZE=settings.RESPONSE_CACHE_SIZE,
+        RESPONSE_CACHE_TTL=settings.RESPONSE_CACHE_TTL,
+        RESPONSE_CACHE_BACKEND=None,
+        INSTRUMENTATION_ENABLED=settings.INSTRUMENTATION_ENABLED,
+        QUESTION_STORE_ENABLED=settings.QUESTION_STORE_ENABLED,
+        QUESTION_STORE_SHARED_DIR=settings.QUESTION_STORE_SHARED_DIR,
+        JSON_SERIALIZER=settings.JSON_SERIALIZER,
+        RESPONSE_COMPRESSION=settings.RESPONSE_COMPRESSION,
+        RESPONSE_COMPRESSION_MIN_SIZE=settings.RESPONSE_COMPRESSION_MIN_SIZE,
+        RESPONSE_COMPRESSION_LEVEL=settings.RESPONSE_COMPRESSION_LEVEL,
+        QUESTIONS_PER_PAGE=settings.QUESTIONS_PER_PAGE,
+        MAX_QUESTIONS_PER_PAGE=settings.MAX_QUESTIONS_PER_PAGE,
+        QUIZ_ROUND_SIZE=settings.QUIZ_ROUND_SIZE,
+        QUIZ_ROUND_MAX=settings.QUIZ_ROUND_MAX,
+        DATABASE_REPLICAS=settings.DB_REPLICA_URLS,
+        RATE_LIMIT_ENABLED=settings.RATE_LIMIT_ENABLED,
+        RATE_LIMIT_BACKEND=None,
+        RATE_LIMIT_RATE=settings.RATE_LIMIT_RATE,
+        RATE_LIMIT_BURST=settings.RATE_LIMIT_BURST,
+        RATE_LIMIT_MAX_CONCURRENT=settings.RATE_LIMIT_MAX_CONCURRENT,
+        RATE_LIMIT_MAX_QUEUE=settings.RATE_LIMIT_MAX_QUEUE,
+        RATE_LIMIT_QUEUE_TIMEOUT=settings.RATE_LIMIT_QUEUE_TIMEOUT,
+        STATEMENT_TIMEOUT=settings.STATEMENT_TIMEOUT,
+        STATEMENT_TIMEOUTS=settings.STATEMENT_TIMEOUTS,
+        SLOW_QUERY_THRESHOLD=settings.SLOW_QUERY_THRESHOLD,
+        SLOW_QUERY_LOG_SIZE=settings.SLOW_QUERY_LOG_SIZE,
+        SLOW_QUERY_EXPLAIN=settings.SLOW_QUERY_EXPLAIN,
+        DATABASE_ENGINE_OPTIONS=None,
+        DATABASE_AUTO_UPGRADE=settings.DB_AUTO_UPGRADE,
+        RESULTS_FLUSH_SIZE=settings.RESULTS_FLUSH_SIZE,
+        RESULTS_FLUSH_INTERVAL=settings.RESULTS_FLUSH_INTERVAL,
+        RESULTS_MAX_PENDING=settings.RESULTS_MAX_PENDING,
+        LEADERBOARD_SIZE=settings.LEADERBOARD_SIZE,
+    )
+    if test_config is not None:
+        app.config.update(test_config)
+    startup_timer.mark('config')
+
+    setup_db(app, app.config.get('DATABASE_PATH', database_path),
+             replica_paths=app.config['DATABASE_REPLICAS'],
+             engine_options=app.config['DATABASE_ENGINE_OPTIONS'],
+             upgrade_schema=app.config['DATABASE_AUTO_UPGRADE'])
+    db_router = app.extensions['db_router']
+    startup_timer.mark('database')
+
+    # cached GET responses, any CacheBackend works. Every write to the
+    # questions clears it, and a client reading its own writes skips it
+    response_cache = ResponseCache(
+        app.config['RESPONSE_CACHE_BACKEND'] or LRUCacheBackend(
+            max_size=app.config['RESPONSE_CACHE_SIZE'],
+            ttl=app.config['RESPONSE_CACHE_TTL']),
+        bypass=db_router.in_write_window)
+    add_question_listener(app, response_cache.invalidate)
+
+    # cached COUNT(*) results for the list endpoints, the total under 'all'
+    # and each category under category_count_key(id), and the counts per
+    # (category, difficulty) of the statistics under STATISTICS_COUNT_KEY
+    count_cache = CountCache()
+
+    def update_counts(action, questions):
+        # inserts and deletes move the totals, anything else is recounted
+        if action in ('insert', 'delete'):
+            delta = 1 if action == 'insert' else -1
+            count_cache.adjust('all', delta * len(questions))
+            for question in questions:
+                count_cache.adjust(category_count_key(question.category), delta)
+                count_cache.adjust(STATISTICS_COUNT_KEY, delta,
+                                   (question.category, question.difficulty))
+        else:
+            count_cache.invalidate()
+
+    add_question_listener(app, update_counts)
+
+    # encodes the question pages and exports
+    serializer = create_serializer(app.config['JSON_SERIALIZER'])
+    app.extensions['serializer'] = serializer
+
+    # JSON body of a question page, the questions are encoded fragments
+    def page_response(fragments, **fields):
+        return app.response_class(encode_page(serializer, fragments, fields),
+                                  mimetype='application/json')
+
+    # another worker published a new question image, drop what was derived
+    # from the old one
+    def question_image_changed():
+        category_cache.invalidate()
+        count_cache.invalidate()
+        question_index.on_questions_changed('reload', [])
+
+    # optional columnar copy of the questions, reads skip SQL and the ORM.
+    # With a shared directory every worker maps the same image, which also
+    # holds the categories and feeds the quiz index
+    question_store = shared_store = None
+    if app.config['QUESTION_STORE_SHARED_DIR']:
+        question_store = shared_store = SharedQuestionStore(
+            app.config['QUESTION_STORE_SHARED_DIR'], serializer,
+            db.get_engine(app), on_remap=question_image_changed,
+            logger=app.logger)
+    elif app.config['QUESTION_STORE_ENABLED']:
+        question_store = QuestionStore()
+    if question_store is not None:
+        add_question_listener(app, question_store.on_questions_changed)
+        app.extensions['question_store'] = question_store
+
+    # categories rarely change, serve them from memory. Code that changes
+    # the categories table calls app.extensions['category_cache'].invalidate()
+    category_cache = CategoryCache(
+        ttl=app.config['CATEGORY_CACHE_TTL'],
+        on_invalidate=response_cache.invalidate,
+        load=(lambda: shared_store.snapshot().category_types)
+        if shared_store is not None else None)
+    app.extensions['category_cache'] = category_cache
+
+    # question ids per category, used to draw quiz questions; a shared
+    # image is drawn from in place
+    question_index = (MappedQuestionIndex(shared_store)
+                      if shared_store is not None else QuestionIndex())
+    add_question_listener(app, question_index.on_questions_changed)
+    app.extensions['question_index'] = question_index
+
+    # ranked question search, kept current on inserts and deletes
+    search_backend = create_search_backend(db.get_engine(app),
+                                           app.config['SEARCH_BACKEND'])
+    add_question_listener(app, search_backend.on_questions_changed)
+    app.extensions['search_backend'] = search_backend
+
+    # questions already asked in each quiz game, any QuizSessionStore works
+    quiz_sessions = app.config['QUIZ_SESSION_STORE'] or MemoryQuizSessionStore(
+        ttl=app.config['QUIZ_SESSION_TTL'],
+        max_size=app.config['QUIZ_SESSION_MAX'])
+    app.extensions['quiz_sessions'] = quiz_sessions
+
+    # finished quiz games and per-question answer counts, written behind
+    # in batches; the best results are kept in memory for the leaderboard
+    leaderboard = Leaderboard(size=app.config['LEADERBOARD_SIZE'])
+    result_recorder = ResultRecorder(
+        db.get_engine(app),
+        flush_size=app.config['RESULTS_FLUSH_SIZE'],
+        flush_interval=app.config['RESULTS_FLUSH_INTERVAL'],
+        max_pending=app.config['RESULTS_MAX_PENDING'],
+        on_flush=leaderboard.add,
+        logger=app.logger)
+    app.extensions['result_recorder'] = result_recorder
+
+    # token buckets and a concurrency cap in front of the expensive routes,
+    # any RateLimitBackend works for the buckets
+    rate_limiter = None
+    if app.config['RATE_LIMIT_ENABLED']:
+        rate_limiter = RateLimiter(
+            app.config['RATE_LIMIT_BACKEND'],
+            rate=app.config['RATE_LIMIT_RATE'],
+            burst=app.config['RATE_LIMIT_BURST'],
+            max_concurrent=app.config['RATE_LIMIT_MAX_CONCURRENT'],
+            max_queue=app.config['RATE_LIMIT_MAX_QUEUE'],
+            queue_timeout=app.config['RATE_LIMIT_QUEUE_TIMEOUT'])
+        app.extensions['rate_limiter'] = rate_limiter
+
+    def limited(view):
+        return rate_limiter.limit(view) if rate_limiter is not None else view
+
+    # statement timeouts per route, and the slow queries with their plans,
+    # on the primary and on the replicas
+    engines = [db.get_engine(app)] + [replica.engine
+                                      for replica in db_router.replicas]
+    statement_timeouts = StatementTimeouts(app.config['STATEMENT_TIMEOUT'],
+                                           app.config['STATEMENT_TIMEOUTS'])
+    slow_queries = None
+    if app.config['SLOW_QUERY_LOG_SIZE']:
+        slow_queries = SlowQueryLog(threshold=app.config['SLOW_QUERY_THRESHOLD'],
+                                    size=app.config['SLOW_QUERY_LOG_SIZE'],
+                                    explain=app.config['SLOW_QUERY_EXPLAIN'])
+        app.extensions['slow_queries'] = slow_queries
+    for engine in engines:
+        statement_timeouts.init_engine(engine)
+        if slow_queries is not None:
+            slow_queries.init_engine(engine)
+
+    # ends a failed request: the cause is logged, a query cancelled by its
+    # statement timeout answers 503 and anything else the route's code
+    def request_failed(code):
+        error = sys.exc_info()[1]
+        if isinstance(error, HTTPException):
+            abort(code)
+
+        # a failed statement leaves the transaction to roll back
+        if isinstance(error, SQLAlchemyError):
+            db.session.rollback()
+        app.logger.exception('%s %s failed', request.method, request.path)
+        abort(503 if is_statement_timeout(error) else code)
+
+    startup_timer.mark('extensions')
  
     # Setting up CORS for * origins
     # cors = CORS(app, resources={r"/api/v1.0/*": {"origins":"*"}})
@@ -60,39 +324,174 @@ def create_app(test_config=None):
     
     # Route to handle GET requests for all available categories, GET by default
     @app.route('/categories', methods=['GET'])
+    @reads_from_replica
+    @response_cache.cached
     def get_categories():
         
-        # retrieve all categories 
-        categories = Category.query.all()
-        
-        available_categories = {}
-        
-        # format the categories data
-        for category in categories:
-            available_categories[category.id] = category.type
+        # retrieve all categories, already serialized
+        cached_categories = category_cache.get()
 
         # If no categories, abort the request
-        if (len(available_categories) == 0):
+        if (len(cached_categories.categories) == 0):
             abort(404)
 
-        # return category response object to frontend
+        # return category response object to frontend, 304 if the client
+        # already has this version
+        response = app.response_class(cached_categories.body,
+                                      mimetype='application/json')
+        response.set_etag(cached_categories.etag)
+        return response.make_conditional(request)
+
+
+    # Question counts per category and difficulty, from the count cache
+    @app.route('/categories/statistics')
+    @reads_from_replica
+    @response_cache.cached
+    def get_category_statistics():
+        try:
+            statistics = question_statistics(
+                count_cache.get_grouped(STATISTICS_COUNT_KEY,
+                                        statistics_query()),
+                category_cache.get().categories)
+            return jsonify(dict(statistics, success=True))
+        except Exception:
+            request_failed(422)
+
+
+    # Connection pool counters and current state, to size the pool
+    @app.route('/metrics/pool')
+    def get_pool_metrics():
+        pool = db.get_engine(app).pool
+
+        return jsonify({
+            'success': True,
+            'pool': app.extensions['pool_metrics'].snapshot(pool),
+            'replicas': db_router.status()
+        })
+
+
+    # Response cache counters
+    @app.route('/metrics/cache')
+    def get_cache_metrics():
+        return jsonify({
+            'success': True,
+            'cache': response_cache.stats()
+        })
+
+
+    # Admitted and rejected requests of the rate limited routes
+    @app.route('/metrics/ratelimit')
+    def get_rate_limit_metrics():
+        return jsonify({
+            'success': True,
+            'enabled': rate_limiter is not None,
+            'ratelimit': rate_limiter.stats() if rate_limiter is not None else None
+        })
+
+
+    # Write-behind counters of the quiz results
+    @app.route('/metrics/results')
+    def get_result_metrics():
+        return jsonify({
+            'success': True,
+            'results': result_recorder.stats()
+        })
+
+
+    # The latest slow queries, newest first, with their plans
+    @app.route('/diagnostics/slow-queries')
+    def get_slow_queries():
+        if slow_queries is None:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'threshold_ms': slow_queries.threshold,
+            'slow_queries': slow_queries.snapshot()
+        })
+
+
+    # Startup phases, and the schema version found at startup
+    @app.route('/diagnostics/startup')
+    def get_startup_report():
         return jsonify({
             'success': True,
-            'categories': available_categories
+            'startup': startup_timer.report(),
+            'schema': app.extensions['schema']
         })
 
 
+    # Per-route latency, SQL and response size metrics, Prometheus format
+    if app.config['INSTRUMENTATION_ENABLED']:
+        instrumentation = Instrumentation()
+        instrumentation.init_app(app, db.get_engine(app))
+
+        def collect_pool_and_cache_metrics():
+            pool = app.extensions['pool_metrics'].snapshot()
+            cache = response_cache.stats()
+            metrics = [
+                ('trivia_db_pool_checkouts_total', 'counter',
+                 'Connections checked out of the pool.', pool['checkouts']),
+                ('trivia_db_pool_wait_seconds_total', 'counter',
+                 'Time spent waiting for a pooled connection.',
+                 pool['wait_time_total_ms'] / 1000),
+                ('trivia_db_pool_timeouts_total', 'counter',
+                 'Pool checkouts that timed out.', pool['timeouts']),
+                ('trivia_response_cache_hits_total', 'counter',
+                 'Response cache hits.', cache['hits']),
+                ('trivia_response_cache_misses_total', 'counter',
+                 'Response cache misses.', cache['misses']),
+            ]
+            if rate_limiter is not None:
+                limits = rate_limiter.stats()
+                metrics += [
+                    ('trivia_rate_limited_total', 'counter',
+                     'Requests rejected with 429.', limits['rate_limited']),
+                    ('trivia_load_shed_total', 'counter',
+                     'Requests rejected with 503.', limits['shed']),
+                    ('trivia_expensive_requests_waiting', 'gauge',
+                     'Requests queued for a concurrency slot.', limits['waiting']),
+                ]
+            return metrics
+
+        instrumentation.add_metrics(collect_pool_and_cache_metrics)
+
+        @app.route('/metrics')
+        def get_metrics():
+            return app.response_class(instrumentation.render(),
+                                      mimetype='text/plain; version=0.0.4')
+
+    # gzip/brotli for the larger responses, RESPONSE_COMPRESSION lists the
+    # encodings in order of preference, empty turns it off
+    compressor = Compressor(
+        encodings=[encoding.strip() for encoding in
+                   app.config['RESPONSE_COMPRESSION'].split(',') if encoding.strip()],
+        min_size=app.config['RESPONSE_COMPRESSION_MIN_SIZE'],
+        level=app.config['RESPONSE_COMPRESSION_LEVEL'])
+    compressor.init_app(app)
+
+
     # Retrieve(GET) the questions using the pagination value 
     @app.route('/questions')
+    @reads_from_replica
+    @response_cache.cached
     def get_questions():
-        # Retrieve questions and paginate
-        all_questions = Question.query.all()
-        
-        # get the count of questions
-        total_questions = len(all_questions)
-        
-        # get current questions
-        get_current_questions = do_paginate_questions(request, all_questions)
+        if question_store is not None:
+            # slice the in-memory snapshot
+            snapshot = question_store.snapshot()
+            total_questions = snapshot.count()
+            get_current_questions = do_paginate_snapshot(request, snapshot,
+                                                         serializer)
+        else:
+            # Retrieve questions and paginate
+            all_questions = Question.query
+
+            # get the count of questions
+            total_questions = count_cache.get('all', all_questions)
+
+            # get current questions
+            get_current_questions = [serializer.dumps(question) for question
+                                     in do_paginate_questions(request, all_questions)]
 
         # If no questions, abort the request
         if (len(get_current_questions) == 0):
@@ -102,25 +501,15 @@ def create_app(test_config=None):
         # Handle possible errors
         try:
             # get categories
-            categories = Category.query.all()
-            
-            categories_collection = {}
-            
-            # format the categories data
-            for category in categories:
-                categories_collection[category.id] = category.type
+            categories_collection = category_cache.get().categories
 
             # return reponse object to frontend
-            return jsonify({
-                'success': True,
-                'questions': get_current_questions,
-                'total_questions': total_questions,
-                'categories': categories_collection
-            })
-        except:
-            db.session.rollback()
-            print(sys.exc_info())
-            abort(422)
+            return page_response(get_current_questions,
+                                 success=True,
+                                 total_questions=total_questions,
+                                 categories=categories_collection)
+        except Exception:
+            request_failed(422)
         finally:
             db.session.close() # close the db
     
@@ -140,7 +529,7 @@ def create_app(test_config=None):
     def delete_question_by_id(question_id):
         try:
             # get answer by id, suing one_or_none()
-            question = Question.query.filter_by(id=id).one_or_none()
+            question = Question.query.filter_by(id=question_id).one_or_none()
 
             # if question not found abort operation
             if question is None:
@@ -152,14 +541,14 @@ def create_app(test_config=None):
             # return success message to frontend
             return jsonify({
                 'success': True,
-                'deleted': id
+                'deleted': question_id
             })
             
             
-        except:
+        except Exception:
             
             #  if there's a problem deleting the question abort operation
-            abort(422)
+            request_failed(422)
     
     """
     
@@ -188,29 +577,134 @@ def create_app(test_config=None):
                 (get_difficulty is None) or (get_category is None)):
             flash("Make sure all fields are filled")
             abort(422)
+
+        # difficulty is 1 to 5, the category one of the known ones
+        try:
+            check_difficulty(int(get_difficulty))
+            if int(get_category) not in category_cache.get().categories:
+                abort(422)
+        except (TypeError, ValueError):
+            abort(422)
             
         try: 
             # Create a new question
             new_question = Question(question=get_question, answer=get_answer,
-                                difficulty=get_difficulty,
-                                category=get_category)
+                                difficulty=int(get_difficulty),
+                                category=int(get_category))
             # insert the record
             new_question.insert()
 
-            # get all questions and paginate
-            get_selection = Question.query.order_by(Question.id).all()
-            current_questions = do_paginate_questions(request, get_selection)
-
-            # return a response object
-            return jsonify({
+            # return the created question and the maintained total
+            response = {
                 'success': True,
                 'created': new_question.id,
                 'question_created': new_question.question,
-                'questions': current_questions,
-                'total_questions': len(Question.query.all())
-            })
-        except:
-               abort(422)
+                'question': new_question.format(),
+                'total_questions': count_cache.get('all', Question.query)
+            }
+
+            # ?include_page=true adds the page holding the new question
+            if request.args.get('include_page', 'false').lower() in ('1', 'true'):
+                per_page = get_per_page(request)
+                page = page_of_question(new_question.id, per_page)
+                response['page'] = page
+                response['questions'] = paginate_questions(Question.query,
+                                                           page=page,
+                                                           per_page=per_page)
+
+            return jsonify(response)
+        except Exception:
+            request_failed(422)
+
+    # Create many questions in one transaction, all or nothing
+    @app.route('/questions/batch', methods=['POST'])
+    def create_questions_in_batch():
+        body = request.get_json()
+        rows = body.get('questions') if isinstance(body, dict) else None
+
+        # a non empty list within the batch limit is required
+        if not isinstance(rows, list) or not 0 < len(rows) <= MAX_BATCH_SIZE:
+            abort(422)
+
+        # validate every row before writing any of them
+        category_ids = set(category_cache.get().categories)
+        new_questions = []
+        errors = []
+        for position, row in enumerate(rows):
+            try:
+                new_questions.append(Question(**validate_row(row, category_ids)))
+            except ValueError as e:
+                errors.append({'index': position, 'message': str(e)})
+
+        if errors:
+            return jsonify({
+                'success': False,
+                'error': 422,
+                'message': 'unprocessable',
+                'errors': errors
+            }), 422
+
+        try:
+            db.session.add_all(new_questions)
+            bump_question_version()
+            db.session.commit()
+        except Exception:
+            request_failed(422)
+
+        # one notification for the whole batch
+        notify_question_listeners('insert', new_questions)
+
+        return jsonify({
+            'success': True,
+            'created': [question.id for question in new_questions],
+            'total_questions': count_cache.get('all', Question.query)
+        })
+    
+    # Delete, or update, many questions in one transaction: by ids, with a
+    # result per id, or by a category/difficulty filter
+    @app.route('/questions/batch', methods=['PATCH', 'DELETE'])
+    def mutate_questions_in_batch():
+        action = 'delete' if request.method == 'DELETE' else 'update'
+
+        try:
+            ids, filters, values = validate_mutation(
+                request.get_json(silent=True), action,
+                set(category_cache.get().categories), MAX_BATCH_SIZE)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': 422,
+                'message': 'unprocessable',
+                'errors': [{'message': str(e)}]
+            }), 422
+
+        try:
+            changed = mutate_questions(action, ids, filters, values,
+                                       max_rows=MAX_BATCH_SIZE)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': 422,
+                'message': 'unprocessable',
+                'errors': [{'message': str(e)}]
+            }), 422
+        except Exception:
+            request_failed(422)
+
+        status = 'deleted' if action == 'delete' else 'updated'
+        changed_ids = {question.id for question in changed}
+        if ids is None:
+            ids = sorted(changed_ids)
+
+        return jsonify({
+            'success': True,
+            status: sorted(changed_ids),
+            'results': [{'id': question_id,
+                         'status': status if question_id in changed_ids
+                                   else 'not_found'}
+                        for question_id in ids],
+            'total_questions': count_cache.get('all', Question.query)
+        })
     
     """
     TEST: When you submit a question on the "Add" tab,
@@ -219,8 +713,113 @@ def create_app(test_config=None):
     """
 
 
+    # Bulk import of questions, streamed as JSON Lines or CSV
+    @app.route('/questions/import', methods=['POST'])
+    def import_questions_in_bulk():
+        
+        # format from the query string, or from the content type
+        import_format = request.args.get('format')
+        if import_format is None:
+            import_format = 'csv' if request.mimetype == 'text/csv' else 'jsonl'
+        if import_format not in READERS:
+            abort(422)
+
+        try:
+            # rows are read from the request stream as they are inserted
+            result = import_questions(READERS[import_format](request.stream))
+        except ImportFailed as e:
+            # the batches committed before the error stay, say how many
+            db.session.rollback()
+            app.logger.exception('%s %s failed', request.method, request.path)
+            code = 503 if is_statement_timeout(e.__cause__) else 422
+            return jsonify({
+                'success': False,
+                'error': code,
+                'message': ('service unavailable' if code == 503
+                            else 'unprocessable'),
+                'inserted': e.result['inserted'],
+                'rejected': e.result['rejected'],
+                'errors': e.result['errors']
+            }), code
+        except Exception:
+            request_failed(422)
+
+        return jsonify({
+            'success': True,
+            'inserted': result['inserted'],
+            'rejected': result['rejected'],
+            'errors': result['errors']
+        })
+
+
+    # Bulk export of questions, streamed as JSON Lines or CSV
+    @app.route('/questions/export')
+    @reads_from_replica
+    def export_questions_in_bulk():
+        export_format = request.args.get('format', 'jsonl')
+        if export_format not in EXPORT_FORMATS:
+            abort(422)
+
+        mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+        return Response(stream_with_context(export_questions(
+                            export_format, serializer=serializer)),
+                        mimetype=mimetype)
+
+
+    # flask db-upgrade / flask db-version, --database picks another database
+    def migration_engine(database):
+        return create_engine(database) if database else db.get_engine(app)
+
+    @app.cli.command('db-upgrade')
+    @click.option('--database', default=None, help='SQLAlchemy URL')
+    @click.option('--target', type=int, default=None)
+    def db_upgrade_command(database, target):
+        """Apply the pending schema migrations."""
+        version = migrations.upgrade(migration_engine(database), target)
+        click.echo(f"schema at version {version}")
+
+    @app.cli.command('db-version')
+    @click.option('--database', default=None, help='SQLAlchemy URL')
+    def db_version_command(database):
+        """Show the schema version of the database."""
+        with migration_engine(database).connect() as connection:
+            version = migrations.current_version(connection)
+        click.echo(f"schema at version {version}, "
+                   f"latest is {migrations.LATEST_VERSION}")
+
+
+    # flask import-questions FILE / flask export-questions FILE
+    @app.cli.command('import-questions')
+    @click.argument('source', type=click.File('rb'))
+    @click.option('--format', 'import_format', type=click.Choice(sorted(READERS)),
+                  default='jsonl')
+    @click.option('--batch-size', default=1000)
+    def import_questions_command(source, import_format, batch_size):
+        """Import questions from a JSON Lines or CSV file."""
+        try:
+            result = import_questions(READERS[import_format](source),
+                                      batch_size=batch_size)
+        except ImportFailed as e:
+            raise click.ClickException(
+                f"{e.__cause__}, inserted {e.result['inserted']} before the error")
+        click.echo(f"inserted {result['inserted']}, rejected {result['rejected']}")
+        for error in result['errors']:
+            click.echo(f"line {error['line']}: {error['message']}", err=True)
+
+    @app.cli.command('export-questions')
+    @click.argument('target', type=click.File('w'), default='-')
+    @click.option('--format', 'export_format',
+                  type=click.Choice(sorted(EXPORT_FORMATS)), default='jsonl')
+    def export_questions_command(target, export_format):
+        """Export all questions as JSON Lines or CSV."""
+        for chunk in export_questions(export_format, serializer=serializer):
+            target.write(chunk)
+
+
     # Search Questions
     @app.route('/questions/search', methods=['POST'])
+    @reads_from_replica
+    @limited
     def search_for_questions():
         
         # Retrieve user input
@@ -228,24 +827,26 @@ def create_app(test_config=None):
         
         #Retrieve search string
         request_search_term = request_body.get('searchTerm', None)
+        per_page = get_per_page(request)
 
         # Using a search term provided to search and filter out the results
         try:
-            if request_search_term:
-                get_selection = Question.query.filter(Question.question.ilike
-                                                  (f'%{request_search_term}%')).all()
+            if not request_search_term:
+                abort(404)
 
-            # Retrieve paginated results
-            get_paginated_results = do_paginate_questions(request, get_selection)
+            # Retrieve the ranked, paginated results
+            page = request.args.get('page', 1, type=int)
+            get_paginated_results, total_questions = search_backend.search(
+                request_search_term, page=page, per_page=per_page)
 
             return jsonify({
                 'success': True,
                 'questions':  get_paginated_results,
-                'total_questions': len(get_selection),
+                'total_questions': total_questions,
                 'current_category': None
             })
-        except:
-            abort(404)
+        except Exception:
+            request_failed(404)
     
     
     
@@ -259,26 +860,40 @@ def create_app(test_config=None):
     # GET QUESTIONS BASED ON CATEGORIES
     
     @app.route('/categories/<int:id>/questions')
+    @reads_from_replica
+    @response_cache.cached
     def get_questions_by_categories(id):
         
-        # Get category by id, try get questions from matching category
-        get_category = Category.query.filter_by(id=id).one_or_none()
+        # Get category by id from the cached map, try get questions from
+        # matching category
+        category_type = category_cache.get().categories.get(id)
 
         try:
-            # Retrieve questions matching the category
-            get_selection = Question.query.filter_by(category=get_category.id).all()
+            if category_type is None:
+                abort(400)
+
+            if question_store is not None:
+                # slice the category ids of the in-memory snapshot
+                snapshot = question_store.snapshot()
+                get_paginated = do_paginate_snapshot(request, snapshot,
+                                                     serializer, id)
+                total_questions = snapshot.count(id)
+            else:
+                # Retrieve questions matching the category
+                get_selection = Question.query.filter_by(category=id)
 
-            # Return paginated results
-            get_paginated = do_paginate_questions(request, get_selection)
+                # Return paginated results
+                get_paginated = [serializer.dumps(question) for question
+                                 in do_paginate_questions(request, get_selection)]
+                total_questions = count_cache.get(
+                    category_count_key(id), get_selection)
 
-            return jsonify({
-                'success': True,
-                'questions': get_paginated,
-                'total_questions': len(Question.query.all()),
-                'current_category': get_category.type
-            })
-        except:
-            abort(400)
+            return page_response(get_paginated,
+                                 success=True,
+                                 total_questions=total_questions,
+                                 current_category=category_type)
+        except Exception:
+            request_failed(400)
 
     """
     TEST: In the "List" tab / main screen, clicking on one of the
@@ -286,48 +901,180 @@ def create_app(test_config=None):
     category to be shown.
     """
 
+    # formatted questions by primary key, one query (or the store)
+    def fetch_questions(question_ids):
+        if question_store is not None:
+            snapshot = question_store.snapshot()
+            rows = (snapshot.get(question_id) for question_id in question_ids)
+            return {row['id']: row for row in rows if row is not None}
+
+        return {question.id: question.format() for question in
+                Question.query.filter(Question.id.in_(question_ids))}
+
+    # draw up to count unseen questions from the in-memory index, 'ALL' is
+    # id 0, and mark them as seen
+    def draw_questions(category, count, seen, difficulty=None):
+        questions = []
+        while len(questions) < count:
+            question_ids = question_index.draw_many(
+                category, count - len(questions), seen, difficulty)
+            if not question_ids:
+                break
+
+            fetched = fetch_questions(question_ids)
+            for question_id in question_ids:
+                if question_id in fetched:
+                    questions.append(fetched[question_id])
+                    seen.add(question_id)
+                else:
+                    # deleted by another worker, drop it from the index
+                    question_index.discard(question_id)
+
+        return questions
+
+    # number of questions asked for in the body, 400 outside the bounds
+    def get_question_count(request_body, name, default, minimum):
+        try:
+            return question_count(request_body, name, default, minimum,
+                                  app.config['QUIZ_ROUND_MAX'])
+        except ValueError:
+            abort(400)
+
     # Quiz route based on Category, return a randomized value
     @app.route('/quiz', methods=['POST'])
+    @reads_from_replica
+    @limited
     def get_quiz():
-        try:
-            
-            # get an instance of request body
-            request_body = request.get_json()
+        # get an instance of request body
+        request_body = request.get_json(silent=True) or {}
+
+        # ?prefetch: also return the next questions, so the client can
+        # play them without asking
+        prefetch = get_question_count(request_body, 'prefetch', 0, 0)
 
+        try:
             # get category and proevious questions from request body
             get_quiz_category = request_body.get('quiz_category')
             get_previous_question = request_body.get('previous_questions')
+            difficulty = request_body.get('difficulty')
 
-            # Filter available Questions when 'ALL' categories is 'clicked', 
-            if get_quiz_category['id'] == 0:
-                available_questions = Question.query.all()
-                
-            # Filter available questions by chosen category & unused questions
-            else:
-                available_questions = Question.query.filter_by(
-                    category=get_quiz_category['id']).filter(
-                        Question.id.notin_((get_previous_question))).all()
+            quiz_session = resume_quiz_session(quiz_sessions, request_body,
+                                               question_index.known)
+
+            # the question, and the prefetched ones, are fetched in one query
+            drawn = draw_questions(get_quiz_category['id'], 1 + prefetch,
+                                   quiz_session.seen, difficulty)
+            quiz_sessions.save(quiz_session)
 
-            # randomly get the next question from available the questions
-            get_new_question = available_questions[random.randrange(
-                0, len(available_questions)-1)].format() if len(
-                    available_questions) > 0 else None
+            response = {
+                'success': True,
+                'question': drawn[0] if drawn else None,
+                  'previousQuestion': get_previous_question,
+                  'quiz_session': quiz_session.id
+            }
+            if prefetch:
+                response['next_questions'] = drawn[1:]
+
+            return jsonify(response)
+        except Exception:
+            request_failed(422)
+
+    # Quiz round: count distinct random questions in one call
+    @app.route('/quiz/round', methods=['POST'])
+    @reads_from_replica
+    @limited
+    def get_quiz_round():
+        request_body = request.get_json(silent=True) or {}
+        count = get_question_count(request_body, 'count',
+                                   app.config['QUIZ_ROUND_SIZE'], 1)
+
+        try:
+            get_quiz_category = request_body.get('quiz_category')
+            difficulty = request_body.get('difficulty')
+
+            quiz_session = resume_quiz_session(quiz_sessions, request_body,
+                                               question_index.known)
+            questions = draw_questions(get_quiz_category['id'], count,
+                                       quiz_session.seen, difficulty)
+            quiz_sessions.save(quiz_session)
 
             return jsonify({
                 'success': True,
-                'question': {
-                     "answer": get_new_question.answer,
-                        "category": get_new_question.category,
-                        "difficulty": get_new_question.difficulty,
-                        "id": get_new_question.id,
-                        "question": get_new_question.question
-                },
-                  'previousQuestion': get_previous_question
+                'questions': questions,
+                'quiz_session': quiz_session.id
             })
-        except Exception as e:
-            print(e)
-            abort(422)
+        except Exception:
+            request_failed(422)
             
+    # Finished quiz: the player's answers, queued to be written in a batch
+    @app.route('/quiz/results', methods=['POST'])
+    @limited
+    def record_quiz_result():
+        try:
+            result, answers = validate_result(request.get_json(silent=True),
+                                              app.config['QUIZ_ROUND_MAX'])
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': 422,
+                'message': 'unprocessable',
+                'errors': [{'message': str(e)}]
+            }), 422
+
+        # the queue is full, the writes fell behind
+        if not result_recorder.record(result, answers):
+            g.retry_after = max(1, math.ceil(app.config['RESULTS_FLUSH_INTERVAL']))
+            abort(503)
+
+        return jsonify({
+            'success': True,
+            'score': result['score'],
+            'questions': result['questions']
+        }), 202
+
+    # Best results first, from the in-memory top of the leaderboard
+    @app.route('/leaderboard')
+    @reads_from_replica
+    def get_leaderboard():
+        limit = request.args.get('limit', 10, type=int)
+        if not 0 < limit <= leaderboard.size:
+            abort(400)
+
+        try:
+            return jsonify({
+                'success': True,
+                'leaderboard': leaderboard.top(limit)
+            })
+        except Exception:
+            request_failed(422)
+
+    # How often a question was answered in quizzes, and answered right
+    @app.route('/questions/<int:question_id>/stats')
+    @reads_from_replica
+    def get_question_stats(question_id):
+        try:
+            if Question.query.filter_by(id=question_id).one_or_none() is None:
+                abort(404)
+
+            stat = QuestionStat.query.filter_by(question_id=question_id).one_or_none()
+            answered, correct = (stat.answered, stat.correct) if stat else (0, 0)
+
+            # answers still waiting to be written count as well
+            pending_answered, pending_correct = result_recorder.pending_stats(
+                question_id)
+            answered += pending_answered
+            correct += pending_correct
+
+            return jsonify({
+                'success': True,
+                'question_id': question_id,
+                'answered': answered,
+                'correct': correct,
+                'correct_ratio': round(correct / answered, 3) if answered else None
+            })
+        except Exception:
+            request_failed(404)
+
     """
     TEST: In the "Play" tab, after a user selects "All" or a category,
     one question at a time is displayed, the user is allowed to answer
@@ -337,35 +1084,36 @@ def create_app(test_config=None):
     # Handle errors
     @app.errorhandler(400)
     def bad_request_error(error):
-        return jsonify({
-            "success": False,
-            "error": 400,
-            "message": "bad request"
-        }), 400
+        return jsonify(error_body(400)), 400
 
     @app.errorhandler(404)
     def not_found(error):
-        return jsonify({
-            "success": False,
-            "error": 404,
-            "message": "resource not found"
-        }), 404
+        return jsonify(error_body(404)), 404
 
     @app.errorhandler(422)
     def unprocessable(error):
-        return jsonify({
-            "success": False,
-            "error": 422,
-            "message": "unprocessable"
-        }), 422
+        return jsonify(error_body(422)), 422
+
+    # rejected by the rate limiter, Retry-After says when to come back
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        return (jsonify(error_body(429)), 429,
+                {'Retry-After': str(g.get('retry_after', 1))})
+
+    # shed by the rate limiter, or a query over its statement timeout
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return (jsonify(error_body(503)), 503,
+                {'Retry-After': str(g.get('retry_after', 1))})
 
     @app.errorhandler(500)
     def internal_server_error(error):
-        return jsonify({
-            "success": False,
-            "error": 500,
-            "message": "internal server error"
-        }), 422
+        return jsonify(error_body(500)), 422
+
+    startup_timer.mark('routes')
+    app.logger.info('started in %.1f ms (%s)', startup_timer.report()['total_ms'],
+                    ', '.join(f'{name} {duration:.1f} ms'
+                              for name, duration in startup_timer.phases))
 
     return app
 
@@ -0,0 +1,224 @@
+"""
+Async serving mode.
+
+    pip install -r requirements-async.txt
+    uvicorn --factory flaskr.asgi:create_asgi_app --workers 2
+
+POST /quiz and POST /quiz/round are served natively on the event loop:
+the questions are drawn from the in-memory index and their rows are
+fetched, in one query, through an async connection pool (the databases
+package running SQLAlchemy Core queries on asyncpg or aiosqlite), so a
+waiting quiz turn holds no thread. Every
+other route is answered by the Flask app from create_app(), mounted
+behind it and run in a thread pool, so all routes keep the same JSON
+contracts. The Flask app also owns the quiz index and the quiz sessions,
+both modes share them, and so do the rate limiter's token buckets; the
+async pool's size bounds the concurrent queries of the async routes.
+"""
+import math
+
+from databases import Database
+from sqlalchemy import select
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import settings
+from models import db, Question
+from . import create_app, error_body
+from .quiz import question_count
+from .sessions import resume_quiz_session
+
+questions = Question.__table__
+
+# same headers the Flask app adds to every response
+CORS_HEADERS = {
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, true',
+    'Access-Control-Allow-Methods': 'GET, POST, PATCH, DELETE, OPTIONS',
+}
+
+
+def error_response(code, status=None):
+    return JSONResponse(error_body(code), status_code=status or code,
+                        headers=CORS_HEADERS)
+
+
+async def read_body(request):
+    # like get_json(silent=True): a body that isn't JSON reads as empty
+    try:
+        return await request.json() or {}
+    except ValueError:
+        return {}
+
+
+def create_database(url):
+    # asyncpg keeps its own pool, sized like the synchronous one
+    if url.startswith(('postgres://', 'postgresql://')):
+        return Database(url, min_size=1,
+                        max_size=settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW)
+    return Database(url)
+
+
+"""
+create_asgi_app(test_config)
+    builds the Flask app with create_app(test_config) and serves it
+    behind a Starlette app holding the async routes. The async pool is
+    opened on startup, when the quiz index is loaded as well.
+"""
+def create_asgi_app(test_config=None):
+    flask_app = create_app(test_config)
+    database = create_database(flask_app.config['SQLALCHEMY_DATABASE_URI'])
+    question_index = flask_app.extensions['question_index']
+    quiz_sessions = flask_app.extensions['quiz_sessions']
+    rate_limiter = flask_app.extensions.get('rate_limiter')
+
+    def load_question_index():
+        # the index loads through the Flask-SQLAlchemy session
+        with flask_app.app_context():
+            question_index.ensure_loaded()
+            db.session.remove()
+
+    async def startup():
+        await database.connect()
+        await run_in_threadpool(load_question_index)
+
+    async def shutdown():
+        await database.disconnect()
+
+    async def fetch_questions(question_ids):
+        rows = await database.fetch_all(
+            select([questions]).where(questions.c.id.in_(question_ids)))
+
+        fetched = {}
+        for row in rows:
+            question = Question(question=row['question'], answer=row['answer'],
+                                category=row['category'],
+                                difficulty=row['difficulty'])
+            question.id = row['id']
+            fetched[question.id] = question.format()
+        return fetched
+
+    # reloads of the index query the database, keep them off the loop
+    async def ensure_question_index():
+        if question_index.is_stale():
+            await run_in_threadpool(load_question_index)
+
+    # same drawing as the Flask app, the rows come from the async pool
+    async def draw_questions(category, count, seen, difficulty=None):
+        await ensure_question_index()
+
+        drawn = []
+        while len(drawn) < count:
+            question_ids = question_index.draw_many(
+                category, count - len(drawn), seen, difficulty)
+            if not question_ids:
+                break
+
+            fetched = await fetch_questions(question_ids)
+            for question_id in question_ids:
+                if question_id in fetched:
+                    drawn.append(fetched[question_id])
+                    seen.add(question_id)
+                else:
+                    question_index.discard(question_id)
+
+        return drawn
+
+    # a 429 response once the client's token bucket for route is empty
+    def rate_limited(request, route):
+        if rate_limiter is None:
+            return None
+
+        client = request.client.host if request.client else 'unknown'
+        retry_after = rate_limiter.check(client, route)
+        if not retry_after:
+            return None
+
+        response = error_response(429)
+        response.headers['Retry-After'] = str(math.ceil(retry_after))
+        return response
+
+    def count_of(request_body, name, default, minimum):
+        return question_count(request_body, name, default, minimum,
+                              flask_app.config['QUIZ_ROUND_MAX'])
+
+    # Quiz route, same contract as the Flask one
+    async def get_quiz(request):
+        rejected = rate_limited(request, '/quiz')
+        if rejected is not None:
+            return rejected
+
+        request_body = await read_body(request)
+        try:
+            prefetch = count_of(request_body, 'prefetch', 0, 0)
+        except ValueError:
+            return error_response(400)
+
+        try:
+            get_quiz_category = request_body.get('quiz_category')
+            get_previous_question = request_body.get('previous_questions')
+
+            await ensure_question_index()
+            quiz_session = resume_quiz_session(quiz_sessions, request_body,
+                                               question_index.known)
+            drawn = await draw_questions(get_quiz_category['id'], 1 + prefetch,
+                                         quiz_session.seen,
+                                         request_body.get('difficulty'))
+            quiz_sessions.save(quiz_session)
+
+            response = {
+                'success': True,
+                'question': drawn[0] if drawn else None,
+                'previousQuestion': get_previous_question,
+                'quiz_session': quiz_session.id
+            }
+            if prefetch:
+                response['next_questions'] = drawn[1:]
+
+            return JSONResponse(response, headers=CORS_HEADERS)
+        except Exception:
+            flask_app.logger.exception('POST %s failed', request.url.path)
+            return error_response(422)
+
+    # Quiz round route, same contract as the Flask one
+    async def get_quiz_round(request):
+        rejected = rate_limited(request, '/quiz/round')
+        if rejected is not None:
+            return rejected
+
+        request_body = await read_body(request)
+        try:
+            count = count_of(request_body, 'count',
+                             flask_app.config['QUIZ_ROUND_SIZE'], 1)
+        except ValueError:
+            return error_response(400)
+
+        try:
+            await ensure_question_index()
+            quiz_session = resume_quiz_session(quiz_sessions, request_body,
+                                               question_index.known)
+            drawn = await draw_questions(request_body['quiz_category']['id'],
+                                         count, quiz_session.seen,
+                                         request_body.get('difficulty'))
+            quiz_sessions.save(quiz_session)
+
+            return JSONResponse({
+                'success': True,
+                'questions': drawn,
+                'quiz_session': quiz_session.id
+            }, headers=CORS_HEADERS)
+        except Exception:
+            flask_app.logger.exception('POST %s failed', request.url.path)
+            return error_response(422)
+
+    return Starlette(
+        routes=[
+            Route('/quiz', get_quiz, methods=['POST']),
+            Route('/quiz/round', get_quiz_round, methods=['POST']),
+            Mount('/', app=WSGIMiddleware(flask_app)),
+        ],
+        on_startup=[startup],
+        on_shutdown=[shutdown],
+    )
@@ -0,0 +1,329 @@
+import csv
+import io
+import json
+
+from sqlalchemy import and_, select
+
+from models import (db, bump_question_version, notify_question_listeners,
+                    Question, Category)
+from .serializers import JSONSerializer
+
+# rows written per transaction
+BATCH_SIZE = 1000
+
+# rejected rows reported back, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+# columns a batch update may set, and a batch filter may match
+MUTABLE_COLUMNS = ('category', 'difficulty')
+
+COLUMNS = ('question', 'answer', 'category', 'difficulty')
+
+# difficulties a question may have
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+
+
+def read_jsonl(stream):
+    # one JSON object per line, blank lines are skipped and lines that
+    # are not JSON come out as None so they get rejected like other rows
+    for line in io.TextIOWrapper(stream, encoding='utf-8'):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def read_csv(stream):
+    # the header row names the columns
+    yield from csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8',
+                                               newline=''))
+
+
+READERS = {
+    'jsonl': read_jsonl,
+    'csv': read_csv,
+}
+
+
+def check_difficulty(difficulty):
+    if not MIN_DIFFICULTY <= difficulty <= MAX_DIFFICULTY:
+        raise ValueError(f'difficulty must be {MIN_DIFFICULTY} to {MAX_DIFFICULTY}')
+    return difficulty
+
+
+def validate_row(row, category_ids):
+    if not isinstance(row, dict):
+        raise ValueError('row is not a JSON object')
+
+    question = row.get('question') or ''
+    answer = row.get('answer') or ''
+    if not isinstance(question, str) or not isinstance(answer, str):
+        raise ValueError('question and answer must be strings')
+    question, answer = question.strip(), answer.strip()
+    if not question or not answer:
+        raise ValueError('question and answer are required')
+
+    try:
+        category = int(row.get('category'))
+        difficulty = int(row.get('difficulty'))
+    except (TypeError, ValueError):
+        raise ValueError('category and difficulty must be integers')
+
+    if category not in category_ids:
+        raise ValueError(f'unknown category {category}')
+    check_difficulty(difficulty)
+
+    return {
+        'question': question,
+        'answer': answer,
+        'category': category,
+        'difficulty': difficulty,
+    }
+
+
+def insert_batch(batch, use_copy):
+    if use_copy:
+        # COPY is the fastest path into PostgreSQL
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in batch:
+            writer.writerow([row[column] for column in COLUMNS])
+        buffer.seek(0)
+
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(f"COPY questions ({', '.join(COLUMNS)}) "
+                           "FROM STDIN WITH CSV", buffer)
+    else:
+        # a single executemany for the whole batch
+        db.session.execute(Question.__table__.insert(), batch)
+
+    bump_question_version()
+    db.session.commit()
+
+
+"""
+ImportFailed
+    raised when an import stops on an error other than an invalid row;
+    result holds the counts so far, the rows of the batches committed
+    before the error stay inserted. The error is the __cause__.
+"""
+class ImportFailed(Exception):
+
+    def __init__(self, result):
+        super().__init__(f"import stopped after {result['inserted']} rows")
+        self.result = result
+
+
+"""
+import_questions(rows, batch_size)
+    validates the rows as they are read and inserts the valid ones in
+    batched transactions, so memory stays flat whatever the size of the
+    import. Returns the number of inserted rows, the number of rejected
+    rows and the first errors with their line numbers. Raises ImportFailed
+    when a batch cannot be written or the rows cannot be read.
+"""
+def import_questions(rows, batch_size=BATCH_SIZE):
+    category_ids = {category_id for category_id,
+                    in db.session.query(Category.id)}
+    use_copy = db.session.get_bind().dialect.name == 'postgresql'
+
+    inserted = 0
+    rejected = 0
+    errors = []
+    batch = []
+
+    try:
+        for line, row in enumerate(rows, start=1):
+            try:
+                batch.append(validate_row(row, category_ids))
+            except ValueError as e:
+                rejected += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'line': line, 'message': str(e)})
+                continue
+
+            if len(batch) >= batch_size:
+                insert_batch(batch, use_copy)
+                inserted += len(batch)
+                batch = []
+
+        if batch:
+            insert_batch(batch, use_copy)
+            inserted += len(batch)
+    except Exception as e:
+        raise ImportFailed({
+            'inserted': inserted,
+            'rejected': rejected,
+            'errors': errors,
+        }) from e
+    finally:
+        # in-memory indexes are rebuilt rather than updated row by row
+        if inserted:
+            notify_question_listeners('reload', [])
+
+    return {
+        'inserted': inserted,
+        'rejected': rejected,
+        'errors': errors,
+    }
+
+
+def integer_columns(mapping, name):
+    if (not isinstance(mapping, dict) or not mapping or
+            not set(mapping) <= set(MUTABLE_COLUMNS)):
+        raise ValueError(f"{name} takes {' and/or '.join(MUTABLE_COLUMNS)}")
+
+    try:
+        return {column: int(value) for column, value in mapping.items()}
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} values must be integers')
+
+
+"""
+validate_mutation(body, action, category_ids, max_ids)
+    checks the body of a batch delete or update: either ids, a list of
+    at most max_ids question ids, or a filter on category and/or
+    difficulty, plus for an update the values to set. Returns the ids (in
+    request order, without duplicates) or None, the filter or None, and
+    the values. Raises ValueError with the reason.
+"""
+def validate_mutation(body, action, category_ids, max_ids):
+    if not isinstance(body, dict):
+        raise ValueError('body is not a JSON object')
+
+    ids = body.get('ids')
+    filters = body.get('filter')
+    if (ids is None) == (filters is None):
+        raise ValueError('give either ids or filter')
+
+    if ids is not None:
+        if not isinstance(ids, list) or not 0 < len(ids) <= max_ids:
+            raise ValueError(f'ids must be a list of 1 to {max_ids} ids')
+        try:
+            ids = list(dict.fromkeys(int(question_id) for question_id in ids))
+        except (TypeError, ValueError):
+            raise ValueError('ids must be integers')
+    else:
+        filters = integer_columns(filters, 'filter')
+
+    values = {}
+    if action == 'update':
+        values = integer_columns(body.get('values'), 'values')
+        if 'category' in values and values['category'] not in category_ids:
+            raise ValueError(f"unknown category {values['category']}")
+        if 'difficulty' in values:
+            check_difficulty(values['difficulty'])
+
+    return ids, filters, values
+
+
+"""
+mutate_questions(action, ids, filters, values, max_rows)
+    deletes, or updates with values, the questions with the given ids or
+    matching filters, in one transaction: the rows are read (and locked
+    on PostgreSQL) once, then changed by a single DELETE or UPDATE. The
+    listeners are notified once for all of them, or told to reload past
+    BATCH_SIZE rows. Returns the affected questions, updated. A filter
+    matching more than max_rows questions raises ValueError before
+    anything is written; at most max_rows + 1 rows are read and locked.
+"""
+def mutate_questions(action, ids=None, filters=None, values=None,
+                     max_rows=None):
+    questions = Question.__table__
+    if ids is not None:
+        where = questions.c.id.in_(ids)
+    else:
+        where = and_(*(questions.c[column] == value
+                       for column, value in filters.items()))
+
+    selection = select([questions]).where(where)
+    if ids is None and max_rows is not None:
+        selection = selection.order_by(questions.c.id).limit(max_rows + 1)
+    rows = db.session.execute(selection.with_for_update()).fetchall()
+    if ids is None and max_rows is not None and len(rows) > max_rows:
+        db.session.rollback()
+        raise ValueError(f'the filter matches more than {max_rows} questions')
+
+    if action == 'delete':
+        db.session.execute(questions.delete().where(where))
+    else:
+        db.session.execute(questions.update().where(where).values(**values))
+    if rows:
+        bump_question_version()
+    db.session.commit()
+
+    # detached copies for the listeners, as they are now
+    changed = []
+    for row in rows:
+        question = Question(question=row['question'], answer=row['answer'],
+                            category=row['category'],
+                            difficulty=row['difficulty'])
+        question.id = row['id']
+        for column, value in (values or {}).items():
+            setattr(question, column, value)
+        changed.append(question)
+
+    if len(changed) > BATCH_SIZE:
+        notify_question_listeners('reload', [])
+    elif changed:
+        notify_question_listeners(action, changed)
+
+    return changed
+
+
+class Echo:
+    # file-like object handing back what csv.writer writes
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, serializer=None):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('id',) + COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(rows, serializer=None):
+    serializer = serializer or JSONSerializer()
+    for question_id, question, answer, category, difficulty in rows:
+        yield serializer.dumps({
+            'id': question_id,
+            'question': question,
+            'answer': answer,
+            'category': category,
+            'difficulty': difficulty
+        }).decode('utf-8') + '\n'
+
+
+EXPORT_FORMATS = {
+    'jsonl': jsonl_lines,
+    'csv': csv_lines,
+}
+
+
+"""
+export_questions(format, batch_size, serializer)
+    yields the questions table as JSON Lines or CSV, in chunks of
+    batch_size rows; JSON Lines are encoded with serializer. Rows are
+    streamed with a server-side cursor (yield_per) so the export is never
+    built in memory.
+"""
+def export_questions(format='jsonl', batch_size=BATCH_SIZE, serializer=None):
+    rows = db.session.query(Question.id, Question.question, Question.answer,
+                            Question.category, Question.difficulty).order_by(
+                                Question.id).yield_per(batch_size)
+
+    chunk = []
+    for line in EXPORT_FORMATS[format](rows, serializer):
+        chunk.append(line)
+        if len(chunk) >= batch_size:
+            yield ''.join(chunk)
+            chunk = []
+
+    if chunk:
+        yield ''.join(chunk)
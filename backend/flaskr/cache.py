@@ -0,0 +1,228 @@
+import functools
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app, json, request
+
+from models import db, Category
+
+
+def make_etag(body):
+    # strong validator built from the serialized response body
+    return hashlib.sha1(body).hexdigest()
+
+
+"""
+CachedCategories
+    one snapshot of the categories table: the {id: type} map, the
+    serialized GET /categories body and its ETag.
+"""
+class CachedCategories:
+
+    __slots__ = ('categories', 'body', 'etag', 'expires_at')
+
+    def __init__(self, categories, body, expires_at):
+        self.categories = categories
+        self.body = body
+        self.etag = make_etag(body)
+        self.expires_at = expires_at
+
+
+"""
+CategoryCache
+    serves the category map from memory. The map is loaded again after
+    ttl seconds, or right away once invalidate() has been called by
+    whatever changed the categories. load() returns the {id: type} map,
+    read from the table unless another source is given.
+"""
+class CategoryCache:
+
+    def __init__(self, ttl=300, on_invalidate=None, load=None):
+        self.ttl = ttl
+        self.on_invalidate = on_invalidate
+        self.load = load if load is not None else self.load_categories
+        self._cached = None
+        self._lock = Lock()
+
+    def load_categories(self):
+        # format the categories data
+        categories = {}
+        for category_id, category_type in db.session.query(
+                Category.id, Category.type).order_by(Category.id):
+            categories[category_id] = category_type
+        return categories
+
+    def get(self):
+        cached = self._cached
+        if cached is not None and cached.expires_at > time.monotonic():
+            return cached
+
+        categories = self.load()
+
+        body = json.dumps({
+            'success': True,
+            'categories': categories
+        }).encode('utf-8')
+
+        cached = CachedCategories(categories, body,
+                                  time.monotonic() + self.ttl)
+        with self._lock:
+            self._cached = cached
+
+        return cached
+
+    def invalidate(self):
+        with self._lock:
+            self._cached = None
+
+        if self.on_invalidate is not None:
+            self.on_invalidate()
+
+
+"""
+CacheBackend
+    interface of the response cache storage. A shared backend (Redis,
+    memcached) implements it to share cached responses and invalidations
+    between workers; values are CachedResponse objects, which hold only
+    bytes and strings.
+"""
+class CacheBackend:
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+"""
+LRUCacheBackend
+    in-process backend: at most max_size entries, each kept for ttl
+    seconds, the least recently used evicted first.
+"""
+class LRUCacheBackend(CacheBackend):
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CachedResponse:
+
+    __slots__ = ('body', 'mimetype', 'etag')
+
+    def __init__(self, body, mimetype, etag):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = etag
+
+
+"""
+ResponseCache
+    caches successful GET responses keyed by path and query arguments.
+    Every response carries an ETag and If-None-Match is answered with 304,
+    on hits and misses alike. Writes call invalidate(), which clears the
+    whole cache: list pages overlap, so one new question can change any of
+    them. Requests for which bypass() is true skip the cache both ways.
+"""
+class ResponseCache:
+
+    def __init__(self, backend=None, bypass=None):
+        self.backend = backend if backend is not None else LRUCacheBackend()
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = Lock()
+
+    def key(self):
+        arguments = sorted(request.args.items(multi=True))
+        return request.path + '?' + '&'.join(
+            f'{name}={value}' for name, value in arguments)
+
+    def respond(self, cached):
+        response = current_app.response_class(cached.body,
+                                              mimetype=cached.mimetype)
+        response.set_etag(cached.etag)
+        return response.make_conditional(request)
+
+    def cached(self, view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if self.bypass is not None and self.bypass():
+                return view(*args, **kwargs)
+
+            key = self.key()
+
+            cached = self.backend.get(key)
+            if cached is not None:
+                self.count('hits')
+                return self.respond(cached)
+
+            self.count('misses')
+            response = current_app.make_response(view(*args, **kwargs))
+
+            # only complete 200 responses are kept
+            if response.status_code != 200 or response.is_streamed:
+                return response
+
+            body = response.get_data()
+            cached = CachedResponse(body, response.mimetype, make_etag(body))
+            self.backend.set(key, cached)
+
+            return self.respond(cached)
+
+        return wrapper
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def invalidate(self, *args):
+        # usable as a question listener, the arguments are not needed
+        self.backend.clear()
+        self.count('invalidations')
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
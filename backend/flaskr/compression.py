@@ -0,0 +1,71 @@
+import gzip
+
+from flask import request
+
+# bodies worth compressing, anything else (e.g. images) is left alone
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson',
+                          'text/plain', 'text/csv', 'text/html')
+
+
+def gzip_compress(data, level):
+    return gzip.compress(data, compresslevel=level)
+
+
+def brotli_compress(data, level):
+    import brotli
+    # brotli qualities run to 11, gzip levels to 9
+    return brotli.compress(data, quality=min(level, 11))
+
+
+def available_encodings():
+    encodings = {'gzip': gzip_compress}
+    try:
+        import brotli
+        encodings['br'] = brotli_compress
+    except ImportError:
+        pass
+    return encodings
+
+
+"""
+Compressor
+    compresses complete responses of at least min_size bytes with the
+    first of encodings ('br', 'gzip') the client accepts. Brotli needs the
+    brotli package and is skipped without it. Compressed responses get a
+    weak ETag, so If-None-Match keeps matching the uncompressed one.
+"""
+class Compressor:
+
+    def __init__(self, encodings=('br', 'gzip'), min_size=1024, level=6):
+        available = available_encodings()
+        self.encodings = [name for name in encodings if name in available]
+        self.compressors = available
+        self.min_size = min_size
+        self.level = level
+
+    def init_app(self, app):
+        if self.encodings:
+            app.after_request(self.compress)
+
+    def compress(self, response):
+        if (response.status_code != 200 or response.direct_passthrough or
+                response.is_streamed or
+                'Content-Encoding' in response.headers or
+                response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        encoding = request.accept_encodings.best_match(self.encodings)
+        data = response.get_data()
+        if encoding is None or len(data) < self.min_size:
+            return response
+
+        response.set_data(self.compressors[encoding](data, self.level))
+        response.headers['Content-Encoding'] = encoding
+
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+        return response
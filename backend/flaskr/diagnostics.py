@@ -0,0 +1,261 @@
+import time
+from collections import OrderedDict, deque
+from threading import Lock
+
+from flask import has_request_context, request
+from sqlalchemy import event, exc
+
+# SQLSTATE of a statement cancelled by statement_timeout
+QUERY_CANCELED = '57014'
+
+# longest bound parameter value kept in the slow query log
+MAX_PARAMETER_LENGTH = 200
+
+
+def current_route():
+    if has_request_context() and request.url_rule is not None:
+        return request.url_rule.rule
+    return None
+
+
+"""
+StartupTimer
+    wall time of the phases of create_app(), in milliseconds. mark(name)
+    ends the phase called name, which started at the previous mark.
+"""
+class StartupTimer:
+
+    def __init__(self):
+        self.started = self.marked = time.perf_counter()
+        self.phases = []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, (now - self.marked) * 1000))
+        self.marked = now
+
+    def report(self):
+        return {
+            'total_ms': round((self.marked - self.started) * 1000, 3),
+            'phases': [{'name': name, 'duration_ms': round(duration, 3)}
+                       for name, duration in self.phases],
+        }
+
+
+"""
+is_statement_timeout(error)
+    whether error is a query cancelled by its statement timeout, on
+    PostgreSQL or SQLite.
+"""
+def is_statement_timeout(error):
+    if not isinstance(error, exc.OperationalError):
+        return False
+    return (getattr(error.orig, 'pgcode', None) == QUERY_CANCELED or
+            str(error.orig) == 'interrupted')
+
+
+"""
+StatementTimeouts
+    cancels queries running longer than the timeout of their route, in
+    milliseconds: routes maps route rules to timeouts, the others get
+    default, 0 meaning no limit. Queries run outside of a request (the
+    CLI, startup) are not limited. PostgreSQL gets statement_timeout, set
+    on a connection only when it changes; SQLite interrupts the query from
+    a progress handler.
+"""
+class StatementTimeouts:
+
+    def __init__(self, default=0, routes=None):
+        self.default = default
+        self.routes = routes or {}
+
+    def timeout(self):
+        if not has_request_context():
+            return 0
+        return self.routes.get(current_route(), self.default)
+
+    def init_engine(self, engine):
+        if engine.dialect.name == 'postgresql':
+            event.listen(engine, 'before_cursor_execute', self.set_statement_timeout)
+            # a rolled back SET is undone, the next query sets it again
+            event.listen(engine, 'rollback',
+                         lambda conn: conn.info.pop('statement_timeout', None))
+            event.listen(engine.pool, 'reset',
+                         lambda dbapi_connection, record:
+                         record.info.pop('statement_timeout', None))
+        elif engine.dialect.name == 'sqlite':
+            event.listen(engine, 'before_cursor_execute', self.set_deadline)
+            event.listen(engine, 'after_cursor_execute',
+                         lambda conn, *args: conn.info.pop('deadline', None))
+
+    def set_statement_timeout(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        timeout = int(self.timeout())
+        if conn.info.get('statement_timeout', 0) != timeout:
+            cursor.execute(f'SET statement_timeout = {timeout}')
+            conn.info['statement_timeout'] = timeout
+
+    def set_deadline(self, conn, cursor, statement, parameters, context,
+                     executemany):
+        timeout = self.timeout()
+        if not timeout:
+            conn.info.pop('deadline', None)
+            return
+
+        info = conn.info
+        if not info.get('progress_handler'):
+            # checked every 1000 SQLite VM instructions, non zero interrupts
+            conn.connection.connection.set_progress_handler(
+                lambda: info.get('deadline', float('inf')) < time.monotonic(),
+                1000)
+            info['progress_handler'] = True
+        info['deadline'] = time.monotonic() + timeout / 1000
+
+
+def loggable_parameters(parameters):
+    def loggable(value):
+        if isinstance(value, str) and len(value) > MAX_PARAMETER_LENGTH:
+            return value[:MAX_PARAMETER_LENGTH] + '...'
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        return repr(value)
+
+    if isinstance(parameters, dict):
+        return {name: loggable(value) for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [loggable(value) for value in parameters]
+    return loggable(parameters)
+
+
+# statements a plan is taken of, by their first keyword
+EXPLAINED_STATEMENTS = ('select', 'insert', 'update', 'delete')
+
+
+"""
+SlowQueryLog
+    keeps the last size queries that took threshold milliseconds or more,
+    or failed after that long, with their route, bound parameters and
+    query plan (EXPLAIN on PostgreSQL, EXPLAIN QUERY PLAN on SQLite, run
+    on the same connection right after the query). Only SELECT, INSERT,
+    UPDATE and DELETE are explained; on PostgreSQL the EXPLAIN runs in a
+    savepoint, so its failure leaves the transaction usable. Plans are
+    kept per statement, so a statement that is often slow is explained
+    once.
+"""
+class SlowQueryLog:
+
+    def __init__(self, threshold=250, size=100, explain=True):
+        self.threshold = threshold
+        self.explain = explain
+        self.entries = deque(maxlen=size)
+        self._plans = OrderedDict()
+        self._max_plans = size
+        self._lock = Lock()
+
+    def init_engine(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+        event.listen(engine, 'handle_error', self.handle_error)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters,
+                             context, executemany):
+        duration = self.elapsed(conn)
+        if duration is None or duration < self.threshold:
+            return
+
+        plan = None
+        if self.explain and not executemany:
+            plan = self.plan(conn, cursor, statement, parameters)
+        self.record(statement, parameters, duration, plan=plan)
+
+    def handle_error(self, context):
+        if context.connection is None:
+            return
+
+        duration = self.elapsed(context.connection)
+        if duration is not None and (
+                duration >= self.threshold or
+                is_statement_timeout(context.sqlalchemy_exception)):
+            # the transaction may be aborted, no plan is taken
+            self.record(context.statement, context.parameters, duration,
+                        error=str(context.original_exception).strip())
+
+    def elapsed(self, conn):
+        started = conn.info.get('query_started')
+        if not started:
+            return None
+        return (time.perf_counter() - started.pop()) * 1000
+
+    def plan(self, conn, cursor, statement, parameters):
+        with self._lock:
+            if statement in self._plans:
+                return self._plans[statement]
+
+        keyword = statement.lstrip().split(None, 1)[:1]
+        if not keyword or keyword[0].lower() not in EXPLAINED_STATEMENTS:
+            return None
+
+        dialect = conn.dialect.name
+        if dialect == 'postgresql':
+            prefix = 'EXPLAIN '
+        elif dialect == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        else:
+            return None
+
+        # a failed statement aborts a PostgreSQL transaction, up to the
+        # savepoint; outside of autocommit the query just run opened one
+        savepoint = (dialect == 'postgresql' and
+                     not conn.connection.connection.autocommit)
+        try:
+            explain_cursor = conn.connection.cursor()
+            try:
+                if savepoint:
+                    explain_cursor.execute('SAVEPOINT slow_query_plan')
+                try:
+                    explain_cursor.execute(prefix + statement, parameters)
+                    plan = [str(row[-1]) for row in explain_cursor.fetchall()]
+                except Exception:
+                    if savepoint:
+                        explain_cursor.execute(
+                            'ROLLBACK TO SAVEPOINT slow_query_plan')
+                    raise
+                finally:
+                    if savepoint:
+                        explain_cursor.execute('RELEASE SAVEPOINT slow_query_plan')
+            finally:
+                explain_cursor.close()
+        except Exception as e:
+            plan = [f'no plan: {e}']
+
+        with self._lock:
+            self._plans[statement] = plan
+            while len(self._plans) > self._max_plans:
+                self._plans.popitem(last=False)
+        return plan
+
+    def record(self, statement, parameters, duration, plan=None, error=None):
+        entry = {
+            'time': time.time(),
+            'route': current_route(),
+            'duration_ms': round(duration, 3),
+            'statement': statement,
+            'parameters': loggable_parameters(parameters),
+            'plan': plan,
+            'error': error,
+        }
+        with self._lock:
+            self.entries.append(entry)
+
+    def snapshot(self):
+        # newest first
+        with self._lock:
+            return list(reversed(self.entries))
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
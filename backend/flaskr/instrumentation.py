@@ -0,0 +1,186 @@
+import time
+from threading import Lock
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+# upper bounds of the latency histogram, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# upper bounds of the response size histogram, in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Histogram:
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        # Prometheus buckets count every observation up to their bound
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class RouteMetrics:
+
+    __slots__ = ('latency', 'size', 'sql_queries', 'sql_time', 'statuses')
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.sql_queries = 0
+        self.sql_time = 0.0
+        self.statuses = {}
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+"""
+Instrumentation
+    records, per route: a latency histogram, the SQL queries run and the
+    time spent in them (from SQLAlchemy cursor events), response sizes and
+    status codes. Each response gets a Server-Timing header splitting the
+    request time into sql and app (ORM hydration, formatting and JSON
+    encoding). Nothing is hooked into the app or the engine unless
+    init_app() is called, so a disabled instrumentation costs nothing.
+"""
+class Instrumentation:
+
+    def __init__(self):
+        self.routes = {}
+        self.extra_metrics = []
+        self._lock = Lock()
+
+    def init_app(self, app, engine):
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        self.instrument_engine(engine)
+        app.extensions['instrumentation'] = self
+
+    def instrument_engine(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def start_request(self):
+        g.request_started = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_time = 0.0
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        if has_request_context():
+            g.sql_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters,
+                             context, executemany):
+        if has_request_context() and 'sql_started' in g:
+            g.sql_time = g.get('sql_time', 0.0) + (
+                time.perf_counter() - g.pop('sql_started'))
+            g.sql_queries = g.get('sql_queries', 0) + 1
+
+    def finish_request(self, response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+
+        duration = time.perf_counter() - started
+        sql_time = g.get('sql_time', 0.0)
+        sql_queries = g.get('sql_queries', 0)
+        size = response.calculate_content_length() or 0
+
+        response.headers['Server-Timing'] = (
+            f'sql;dur={sql_time * 1000:.2f};desc="{sql_queries} queries", '
+            f'app;dur={max(duration - sql_time, 0) * 1000:.2f}, '
+            f'total;dur={duration * 1000:.2f}')
+
+        key = (request.method, request.url_rule.rule
+               if request.url_rule else 'unmatched')
+        with self._lock:
+            metrics = self.routes.get(key)
+            if metrics is None:
+                metrics = self.routes[key] = RouteMetrics()
+            metrics.latency.observe(duration)
+            metrics.size.observe(size)
+            metrics.sql_queries += sql_queries
+            metrics.sql_time += sql_time
+            metrics.statuses[response.status_code] = (
+                metrics.statuses.get(response.status_code, 0) + 1)
+
+        return response
+
+    def add_metrics(self, collect):
+        # collect() returns (name, type, help, value) tuples for /metrics
+        self.extra_metrics.append(collect)
+
+    def render(self):
+        lines = []
+
+        with self._lock:
+            routes = sorted(self.routes.items())
+
+            lines.append('# HELP trivia_request_duration_seconds Request latency.')
+            lines.append('# TYPE trivia_request_duration_seconds histogram')
+            for (method, rule), metrics in routes:
+                labels = f'method="{method}",route="{escape_label(rule)}"'
+                self.render_histogram(lines, 'trivia_request_duration_seconds',
+                                      labels, metrics.latency)
+
+            lines.append('# HELP trivia_response_size_bytes Response body size.')
+            lines.append('# TYPE trivia_response_size_bytes histogram')
+            for (method, rule), metrics in routes:
+                labels = f'method="{method}",route="{escape_label(rule)}"'
+                self.render_histogram(lines, 'trivia_response_size_bytes',
+                                      labels, metrics.size)
+
+            lines.append('# HELP trivia_sql_queries_total SQL queries run by requests.')
+            lines.append('# TYPE trivia_sql_queries_total counter')
+            for (method, rule), metrics in routes:
+                lines.append(f'trivia_sql_queries_total{{method="{method}",'
+                             f'route="{escape_label(rule)}"}} {metrics.sql_queries}')
+
+            lines.append('# HELP trivia_sql_seconds_total Time spent in SQL by requests.')
+            lines.append('# TYPE trivia_sql_seconds_total counter')
+            for (method, rule), metrics in routes:
+                lines.append(f'trivia_sql_seconds_total{{method="{method}",'
+                             f'route="{escape_label(rule)}"}} {metrics.sql_time:.6f}')
+
+            lines.append('# HELP trivia_requests_total Requests by status code.')
+            lines.append('# TYPE trivia_requests_total counter')
+            for (method, rule), metrics in routes:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append(f'trivia_requests_total{{method="{method}",'
+                                 f'route="{escape_label(rule)}",'
+                                 f'status="{status}"}} {count}')
+
+        for collect in self.extra_metrics:
+            for name, metric_type, help_text, value in collect():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def render_histogram(self, lines, name, labels, histogram):
+        for bound, count in histogram.cumulative():
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f'{name}_sum{{{labels}}} {histogram.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {histogram.count}')
@@ -0,0 +1,75 @@
+import time
+from threading import Lock, RLock
+
+
+"""
+LazyLoaded
+    base of the in-memory copies of a table: loaded on first use, kept
+    current by the writes of this worker and loaded again after max_age
+    seconds to pick up the writes of other workers. Subclasses implement
+    load(), which reads the rows and swaps its copy in under self._lock,
+    then calls loaded(). Writes go through update(change), which applies
+    change() under the same lock once there is a copy to keep current.
+
+    A write made while a load reads its rows may be missing from them, so
+    the changes that arrive during reload() are recorded and applied again
+    to the new copy once it is swapped in. A change must therefore leave
+    the copy as it is when applied twice (remove, then add). An
+    invalidate() during a load leaves the new copy stale.
+"""
+class LazyLoaded:
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._loaded_at = None
+        self._pending = None
+        self._invalidated = False
+        self._lock = RLock()
+        self._load_lock = Lock()
+
+    def load(self):
+        raise NotImplementedError
+
+    def loaded(self):
+        # called by load() under self._lock, right after the swap
+        for change in self._pending or ():
+            change()
+        self._pending = None
+        if not self._invalidated:
+            self._loaded_at = time.monotonic()
+
+    def reload(self):
+        with self._lock:
+            self._pending = []
+            self._invalidated = False
+        try:
+            self.load()
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def is_stale(self):
+        return (self._loaded_at is None or
+                time.monotonic() - self._loaded_at > self.max_age)
+
+    def ensure_loaded(self):
+        if not self.is_stale():
+            return
+
+        # one thread loads, concurrent callers wait for its result
+        with self._load_lock:
+            if self.is_stale():
+                self.reload()
+
+    def invalidate(self):
+        # load again on next use
+        with self._lock:
+            self._loaded_at = None
+            self._invalidated = self._pending is not None
+
+    def update(self, change):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(change)
+            if self._loaded_at is not None:
+                change()
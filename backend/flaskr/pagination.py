@@ -0,0 +1,131 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from models import Question
+
+QUESTIONS_PER_PAGE = 10
+
+
+"""
+paginate_questions(query, page, per_page, after_id)
+    pushes the pagination into SQL (LIMIT/OFFSET) so only one page of rows
+    is loaded and formatted. When after_id is given the keyset mode is used
+    instead: rows with an id greater than the cursor, which stays cheap on
+    deep pages because the database can seek straight into the primary key.
+"""
+def paginate_questions(query, page=1, per_page=QUESTIONS_PER_PAGE,
+                       after_id=None, order_by=None):
+    # keyset (cursor) mode, always ordered by id
+    if after_id is not None:
+        rows = query.filter(Question.id > after_id).order_by(
+            Question.id).limit(per_page).all()
+        return [row.format() for row in rows]
+
+    # pages start at 1, anything below has no rows
+    if page < 1:
+        return []
+
+    # offset mode, ordered by id unless the caller ranks the rows itself
+    if order_by is None:
+        order_by = [Question.id]
+    rows = query.order_by(*order_by).limit(per_page).offset(
+        (page - 1) * per_page).all()
+
+    return [row.format() for row in rows]
+
+
+"""
+page_of_question(question_id, per_page)
+    the page, in id order, that holds the question. Counted in SQL with the
+    primary key index: COUNT(*) of the rows with an id up to question_id.
+"""
+def page_of_question(question_id, per_page=QUESTIONS_PER_PAGE):
+    position = Question.query.filter(Question.id <= question_id).count()
+    return max(position - 1, 0) // per_page + 1
+
+
+def category_count_key(category):
+    return f'category:{category}'
+
+
+"""
+CountCache
+    keeps the result of COUNT(*) queries for a short time, keyed by a
+    string such as 'all' or 'category:1', so list endpoints don't count the
+    table on every request. get_grouped() keeps the counts of a GROUP BY
+    query the same way, as a {group: count} map. Inserts and deletes call
+    adjust() on the keys (and groups) they change, so a cached total stays
+    exact without a recount; other writes should call invalidate(). The
+    oldest keys are dropped once max_size is reached (search terms are
+    unbounded).
+"""
+class CountCache:
+
+    def __init__(self, ttl=30, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._counts = OrderedDict()
+        self._lock = Lock()
+
+    def _cached(self, key):
+        with self._lock:
+            cached = self._counts.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        return None
+
+    def _store(self, key, count):
+        with self._lock:
+            self._counts[key] = (count, time.monotonic() + self.ttl)
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.max_size:
+                self._counts.popitem(last=False)
+
+    def get(self, key, query):
+        # serve the cached count while it is fresh
+        count = self._cached(key)
+        if count is not None:
+            return count
+
+        # count in SQL, ordering is useless for a count so drop it
+        count = query.order_by(None).count()
+        self._store(key, count)
+        return count
+
+    """
+    get_grouped(key, query)
+        the counts of a GROUP BY query whose last column is the count,
+        keyed by the other columns. A copy is returned.
+    """
+    def get_grouped(self, key, query):
+        counts = self._cached(key)
+        if counts is None:
+            counts = {tuple(row[:-1]): row[-1] for row in query.all()}
+            self._store(key, counts)
+        with self._lock:
+            return dict(counts)
+
+    def adjust(self, key, delta, group=None):
+        # keep a cached count current after a write instead of recounting
+        with self._lock:
+            cached = self._counts.get(key)
+            if cached is None:
+                return
+            if group is None:
+                self._counts[key] = (cached[0] + delta, cached[1])
+                return
+
+            counts = cached[0]
+            count = counts.get(group, 0) + delta
+            if count > 0:
+                counts[group] = count
+            else:
+                counts.pop(group, None)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._counts.clear()
+            else:
+                self._counts.pop(key, None)
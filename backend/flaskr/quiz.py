@@ -0,0 +1,243 @@
+import random
+from threading import Lock
+
+from models import db, Question
+from .lazy import LazyLoaded
+
+# category id used by the frontend for "ALL"
+ALL_CATEGORIES = 0
+
+
+def category_key(category):
+    # quiz requests send the category id as an int or a string
+    try:
+        return int(category)
+    except (TypeError, ValueError):
+        return category
+
+
+def index_key(category, difficulty=None):
+    # ids are listed per category and per (category, difficulty)
+    if difficulty is None:
+        return category_key(category)
+    return (category_key(category), int(difficulty))
+
+
+"""
+QuestionIndex
+    keeps the question ids of every category, and of every category and
+    difficulty, in memory so a quiz turn can pick its question without
+    scanning the table. Each key holds a list of ids plus a position map,
+    which makes add and remove O(1) (swap with the last id). The index is
+    a LazyLoaded copy read with a single id/category/difficulty query.
+"""
+class QuestionIndex(LazyLoaded):
+
+    def __init__(self, max_age=300, max_attempts=16):
+        super().__init__(max_age)
+        self.max_attempts = max_attempts
+        self._ids = {}
+        self._positions = {}
+
+    def load(self):
+        rows = db.session.query(Question.id, Question.category,
+                                Question.difficulty).all()
+
+        with self._lock:
+            self._ids = {}
+            self._positions = {}
+            for question_id, category, difficulty in rows:
+                self._add(question_id, category, difficulty)
+            self.loaded()
+
+    def _add(self, question_id, category, difficulty):
+        keys = [ALL_CATEGORIES, category_key(category)]
+        if difficulty is not None:
+            keys += [index_key(ALL_CATEGORIES, difficulty),
+                     index_key(category, difficulty)]
+
+        for key in keys:
+            ids = self._ids.setdefault(key, [])
+            positions = self._positions.setdefault(key, {})
+            if question_id not in positions:
+                positions[question_id] = len(ids)
+                ids.append(question_id)
+
+    def _remove(self, question_id):
+        for key, positions in self._positions.items():
+            position = positions.pop(question_id, None)
+            if position is None:
+                continue
+
+            # move the last id into the hole so the list stays dense
+            ids = self._ids[key]
+            last_id = ids.pop()
+            if last_id != question_id:
+                ids[position] = last_id
+                positions[last_id] = position
+
+    def on_questions_changed(self, action, questions):
+        # bulk writes, load the index again on next use
+        if action == 'reload':
+            self.invalidate()
+            return
+
+        def change():
+            for question in questions:
+                self._remove(question.id)
+                if action != 'delete':
+                    self._add(question.id, question.category,
+                              question.difficulty)
+
+        self.update(change)
+
+    def known(self, question_id):
+        # whether question_id is a question of the index
+        self.ensure_loaded()
+        return question_id in self._positions.get(ALL_CATEGORIES, ())
+
+    def discard(self, question_id):
+        with self._lock:
+            self._remove(question_id)
+
+    def size(self, category=ALL_CATEGORIES, difficulty=None):
+        self.ensure_loaded()
+        return len(self._ids.get(index_key(category, difficulty), ()))
+
+    """
+    draw_many(category, count, seen, difficulty)
+        returns up to count distinct random question ids of the category
+        (and difficulty, when given) that are not in seen; fewer once the
+        category is used up. Random probes are tried first, which costs
+        O(1) per id while most of the category is unseen; only a nearly
+        finished category falls back to a scan of its ids.
+    """
+    def draw_many(self, category, count, seen=(), difficulty=None):
+        self.ensure_loaded()
+
+        with self._lock:
+            ids = self._ids.get(index_key(category, difficulty))
+            if not ids or count < 1:
+                return []
+
+            drawn = []
+            for _ in range(self.max_attempts * count):
+                question_id = ids[random.randrange(len(ids))]
+                if question_id not in seen and question_id not in drawn:
+                    drawn.append(question_id)
+                    if len(drawn) == count:
+                        return drawn
+
+            remaining = [question_id for question_id in ids
+                         if question_id not in seen and question_id not in drawn]
+
+        return drawn + random.sample(remaining,
+                                     min(count - len(drawn), len(remaining)))
+
+    def draw(self, category, seen=(), difficulty=None):
+        drawn = self.draw_many(category, 1, seen, difficulty)
+        return drawn[0] if drawn else None
+
+
+"""
+MappedQuestionIndex
+    the quiz index of a SharedQuestionStore: questions are drawn straight
+    from the rows of each category in the mapped image, so nothing is
+    copied per worker. A difficulty is checked on the drawn rows. Ids
+    deleted since the image was built are skipped until the next image
+    is mapped; new questions are drawn once it is.
+"""
+class MappedQuestionIndex:
+
+    def __init__(self, store, max_attempts=16):
+        self.store = store
+        self.max_attempts = max_attempts
+        self._snapshot = None
+        self._discarded = set()
+        self._lock = Lock()
+
+    def is_stale(self):
+        return self.store.needs_check()
+
+    def ensure_loaded(self):
+        self.store.snapshot()
+
+    def _current(self):
+        # the mapped image and the ids discarded from it
+        snapshot = self.store.snapshot()
+        with self._lock:
+            if snapshot is not self._snapshot:
+                self._snapshot, self._discarded = snapshot, set()
+            return snapshot, self._discarded
+
+    def positions(self, snapshot, category):
+        category = category_key(category)
+        if category == ALL_CATEGORIES:
+            return snapshot.positions()
+        if not isinstance(category, int):
+            return range(0)
+        return snapshot.positions(category)
+
+    def on_questions_changed(self, action, questions):
+        if action == 'delete':
+            for question in questions:
+                self.discard(question.id)
+
+    def known(self, question_id):
+        snapshot, discarded = self._current()
+        return (snapshot.position(question_id) is not None and
+                question_id not in discarded)
+
+    def discard(self, question_id):
+        _, discarded = self._current()
+        with self._lock:
+            discarded.add(question_id)
+
+    def size(self, category=ALL_CATEGORIES, difficulty=None):
+        snapshot, _ = self._current()
+        positions = self.positions(snapshot, category)
+        if difficulty is None:
+            return len(positions)
+        return sum(1 for position in positions
+                   if snapshot.difficulties[position] == int(difficulty))
+
+    # same drawing as QuestionIndex.draw_many()
+    def draw_many(self, category, count, seen=(), difficulty=None):
+        snapshot, discarded = self._current()
+        positions = self.positions(snapshot, category)
+        if not positions or count < 1:
+            return []
+
+        ids, difficulties = snapshot.ids, snapshot.difficulties
+        difficulty = int(difficulty) if difficulty is not None else None
+        drawn = []
+
+        def unseen(position):
+            question_id = ids[position]
+            return ((difficulty is None or difficulties[position] == difficulty)
+                    and question_id not in seen and question_id not in drawn
+                    and question_id not in discarded)
+
+        for _ in range(self.max_attempts * count):
+            position = positions[random.randrange(len(positions))]
+            if unseen(position):
+                drawn.append(ids[position])
+                if len(drawn) == count:
+                    return drawn
+
+        remaining = [ids[position] for position in positions if unseen(position)]
+        return drawn + random.sample(remaining,
+                                     min(count - len(drawn), len(remaining)))
+
+    def draw(self, category, seen=(), difficulty=None):
+        drawn = self.draw_many(category, 1, seen, difficulty)
+        return drawn[0] if drawn else None
+
+
+def question_count(request_body, name, default, minimum, maximum):
+    # a count from a quiz request body, ValueError outside the bounds
+    count = request_body.get(name, default)
+    if (not isinstance(count, int) or isinstance(count, bool) or
+            not minimum <= count <= maximum):
+        raise ValueError(f'{name} must be between {minimum} and {maximum}')
+    return count
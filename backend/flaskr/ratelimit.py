@@ -0,0 +1,181 @@
+import functools
+import math
+import time
+from collections import OrderedDict
+from threading import Condition, Lock
+
+from flask import abort, g, request
+
+
+"""
+RateLimitBackend
+    interface of the token bucket storage. consume(key, rate, burst)
+    takes one token from the bucket under key, which refills at rate
+    tokens per second up to burst, and returns 0 when a token was taken or
+    the seconds until one will be. A shared backend (e.g. a Redis script
+    keeping tokens and the last refill time per key) implements it to
+    enforce the limits across workers.
+"""
+class RateLimitBackend:
+
+    def consume(self, key, rate, burst):
+        raise NotImplementedError
+
+
+"""
+MemoryRateLimitBackend
+    in-process token buckets, one per key. Past max_keys buckets the
+    least recently used are dropped, a dropped bucket starts full again.
+"""
+class MemoryRateLimitBackend(RateLimitBackend):
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def consume(self, key, rate, burst):
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0
+            else:
+                retry_after = (1 - tokens) / rate
+
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return retry_after
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+"""
+ConcurrencyLimiter
+    admits at most limit requests at a time. Up to max_queue more wait,
+    each for queue_timeout seconds at most; acquire() returns False at
+    once when the queue is full, or when the wait runs out.
+"""
+class ConcurrencyLimiter:
+
+    def __init__(self, limit=5, max_queue=10, queue_timeout=2.0):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._condition = Condition()
+
+    def acquire(self):
+        with self._condition:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+
+            if self.waiting >= self.max_queue:
+                return False
+
+            self.waiting += 1
+            try:
+                admitted = self._condition.wait_for(
+                    lambda: self.active < self.limit, self.queue_timeout)
+            finally:
+                self.waiting -= 1
+
+            if admitted:
+                self.active += 1
+            return admitted
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+"""
+RateLimiter
+    admission control for the expensive routes. limit(view) gives each
+    client a token bucket per route (rate per second, up to burst) and
+    answers 429 with a Retry-After once it is empty, then runs the view
+    under a ConcurrencyLimiter, answering 503 when the queue is full or
+    the wait times out. Rejections are counted per route and reason.
+"""
+class RateLimiter:
+
+    def __init__(self, backend=None, rate=5, burst=20, max_concurrent=5,
+                 max_queue=10, queue_timeout=2.0):
+        self.backend = backend if backend is not None else MemoryRateLimitBackend()
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = ConcurrencyLimiter(max_concurrent, max_queue,
+                                              queue_timeout)
+        self.admitted = 0
+        self.rejections = {}
+        self._lock = Lock()
+
+    def client(self):
+        # behind a proxy, werkzeug's ProxyFix sets remote_addr from the
+        # forwarded headers
+        return request.remote_addr or 'unknown'
+
+    def check(self, client, route):
+        # seconds to wait before retrying, 0 when the request may go on
+        retry_after = self.backend.consume(f'{client}:{route}', self.rate,
+                                           self.burst)
+        if retry_after:
+            self.reject(route, 'rate_limited')
+        return retry_after
+
+    def reject(self, route, reason):
+        with self._lock:
+            key = (route, reason)
+            self.rejections[key] = self.rejections.get(key, 0) + 1
+
+    def limit(self, view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            route = request.url_rule.rule
+
+            retry_after = self.check(self.client(), route)
+            if retry_after:
+                g.retry_after = math.ceil(retry_after)
+                abort(429)
+
+            if not self.concurrency.acquire():
+                self.reject(route, 'shed')
+                g.retry_after = math.ceil(self.concurrency.queue_timeout)
+                abort(503)
+
+            try:
+                with self._lock:
+                    self.admitted += 1
+                return view(*args, **kwargs)
+            finally:
+                self.concurrency.release()
+
+        return wrapper
+
+    def stats(self):
+        with self._lock:
+            rejections = [{'route': route, 'reason': reason, 'count': count}
+                          for (route, reason), count in sorted(self.rejections.items())]
+            totals = {'rate_limited': 0, 'shed': 0}
+            for (_, reason), count in self.rejections.items():
+                totals[reason] += count
+
+        return {
+            'admitted': self.admitted,
+            'rate_limited': totals['rate_limited'],
+            'shed': totals['shed'],
+            'active': self.concurrency.active,
+            'waiting': self.concurrency.waiting,
+            'rejections': rejections,
+        }
@@ -0,0 +1,304 @@
+import atexit
+import bisect
+import datetime
+from threading import Condition, Lock, Thread
+
+from sqlalchemy import select, text
+
+from models import db, Question, QuizResult
+from .lazy import LazyLoaded
+
+# adds answer counts to a question's row, or creates it; PostgreSQL and
+# SQLite (3.24+) share the syntax
+UPSERT_STATS = text(
+    'INSERT INTO question_stats (question_id, answered, correct) '
+    'VALUES (:question_id, :answered, :correct) '
+    'ON CONFLICT (question_id) DO UPDATE SET '
+    'answered = question_stats.answered + excluded.answered, '
+    'correct = question_stats.correct + excluded.correct')
+
+# columns of a result shown on the leaderboard, the quiz session stays
+# private
+LEADERBOARD_COLUMNS = ('player', 'score', 'questions', 'category', 'created_at')
+
+# longest player name kept
+MAX_PLAYER_LENGTH = 64
+
+
+"""
+validate_result(body, max_questions)
+    checks the body of a finished quiz: the player's name, the answers as
+    a list of at most max_questions {question_id, correct} objects and
+    optionally the quiz_category and quiz_session. Returns the result row
+    (score counted from the answers) and the (question id, correct) pairs.
+    Raises ValueError with the reason.
+"""
+def validate_result(body, max_questions):
+    if not isinstance(body, dict):
+        raise ValueError('body is not a JSON object')
+
+    player = body.get('player')
+    if not isinstance(player, str) or not player.strip():
+        raise ValueError('player is required')
+
+    answers = body.get('answers')
+    if not isinstance(answers, list) or not 0 < len(answers) <= max_questions:
+        raise ValueError(f'answers must be a list of 1 to {max_questions} answers')
+
+    pairs = []
+    for answer in answers:
+        if (not isinstance(answer, dict) or
+                not isinstance(answer.get('correct'), bool)):
+            raise ValueError('each answer needs a question_id and correct')
+        try:
+            pairs.append((int(answer.get('question_id')), answer['correct']))
+        except (TypeError, ValueError):
+            raise ValueError('question_id must be an integer')
+
+    if len({question_id for question_id, _ in pairs}) != len(pairs):
+        raise ValueError('a question is answered once per game')
+
+    category = body.get('quiz_category')
+    if isinstance(category, dict):
+        category = category.get('id')
+    if category is not None:
+        try:
+            # 'ALL' is sent as id 0
+            category = int(category) or None
+        except (TypeError, ValueError):
+            raise ValueError('quiz_category must be a category id')
+
+    quiz_session = body.get('quiz_session')
+    result = {
+        'player': player.strip()[:MAX_PLAYER_LENGTH],
+        'score': sum(correct for _, correct in pairs),
+        'questions': len(pairs),
+        'category': category,
+        'quiz_session': quiz_session if isinstance(quiz_session, str) else None,
+        'created_at': datetime.datetime.utcnow(),
+    }
+    return result, pairs
+
+
+"""
+Leaderboard
+    the size best results in memory, best first: the higher score, then
+    the earlier game. It is loaded with one query reading the top of the
+    score index, kept current as the results are written. A LazyLoaded
+    copy, loaded again after max_age seconds to pick up the results
+    written by other workers.
+"""
+class Leaderboard(LazyLoaded):
+
+    def __init__(self, size=100, max_age=60):
+        super().__init__(max_age)
+        self.size = size
+        self._keys = []
+        self._entries = []
+
+    @staticmethod
+    def key(entry):
+        return (-entry['score'], entry['created_at'])
+
+    def load(self):
+        results = QuizResult.__table__
+        rows = db.session.execute(
+            select([results.c[column] for column in LEADERBOARD_COLUMNS]).order_by(
+                results.c.score.desc(), results.c.created_at).limit(self.size))
+        entries = [dict(zip(LEADERBOARD_COLUMNS, row)) for row in rows]
+
+        with self._lock:
+            self._entries = entries
+            self._keys = [self.key(entry) for entry in entries]
+            self.loaded()
+
+    def add(self, results):
+        def change():
+            for entry in results:
+                key = self.key(entry)
+                row = {column: entry[column] for column in LEADERBOARD_COLUMNS}
+
+                # a result written during a load may be read by it too
+                position = bisect.bisect_left(self._keys, key)
+                end = bisect.bisect_right(self._keys, key)
+                if row in self._entries[position:end]:
+                    continue
+
+                if end < self.size:
+                    self._keys.insert(end, key)
+                    self._entries.insert(end, row)
+            del self._keys[self.size:]
+            del self._entries[self.size:]
+
+        self.update(change)
+
+    def top(self, limit=10):
+        self.ensure_loaded()
+
+        with self._lock:
+            entries = self._entries[:limit]
+        return [dict(entry, created_at=entry['created_at'].isoformat())
+                for entry in entries]
+
+
+"""
+ResultRecorder
+    write-behind buffer of the quiz results. record() queues a result and
+    the answer counts of its questions, summed per question while they
+    wait, and returns at once. The queue is written in one transaction (a
+    multi-row insert of the results and one upsert per answered question)
+    once flush_size results wait or flush_interval seconds have passed, by
+    a background thread; with flush_interval 0 there is no thread and the
+    request that fills a batch writes it. At most max_pending results wait,
+    record() returns False when the queue is full. A failed write is put
+    back in the queue, as far as it has room. close() writes what is left
+    and stops the thread; it runs when the process exits.
+
+    on_flush(results) is called with the results once they are written.
+"""
+class ResultRecorder:
+
+    def __init__(self, engine, flush_size=100, flush_interval=2.0,
+                 max_pending=10000, on_flush=None, logger=None):
+        self.engine = engine
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.on_flush = on_flush
+        self.logger = logger
+        self.written = self.batches = self.failures = 0
+        self.rejected = self.dropped = 0
+        self._results = []
+        self._stats = {}
+        self._condition = Condition()
+        self._flush_lock = Lock()
+        self._thread = None
+        self._closed = False
+
+    def record(self, result, answers):
+        with self._condition:
+            if self._closed or len(self._results) >= self.max_pending:
+                self.rejected += 1
+                return False
+
+            self._results.append(result)
+            for question_id, correct in answers:
+                counts = self._stats.setdefault(question_id, [0, 0])
+                counts[0] += 1
+                counts[1] += int(correct)
+
+            batch_full = len(self._results) >= self.flush_size
+            if self.flush_interval:
+                self.start()
+                if batch_full:
+                    self._condition.notify()
+
+        if batch_full and not self.flush_interval:
+            self.flush()
+        return True
+
+    def start(self):
+        # the thread starts with the first result, called under _condition
+        if self._thread is None:
+            self._thread = Thread(target=self.run, name='result-recorder',
+                                  daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._closed or len(self._results) >= self.flush_size,
+                    self.flush_interval)
+                closed = self._closed
+
+            self.flush()
+            if closed:
+                return
+
+    def flush(self):
+        # one write at a time, results queued meanwhile wait for the next
+        with self._flush_lock:
+            with self._condition:
+                results, stats = self._results, self._stats
+                self._results, self._stats = [], {}
+
+            if not results and not stats:
+                return 0
+
+            try:
+                self.write(results, stats)
+            except Exception:
+                if self.logger is not None:
+                    self.logger.exception('writing %d quiz results failed',
+                                          len(results))
+                self.requeue(results, stats)
+                return 0
+
+            self.written += len(results)
+            self.batches += 1
+
+        if self.on_flush is not None:
+            self.on_flush(results)
+        return len(results)
+
+    def write(self, results, stats):
+        questions = Question.__table__
+        with self.engine.begin() as connection:
+            if results:
+                connection.execute(QuizResult.__table__.insert(), results)
+
+            if not stats:
+                return
+
+            # answers to questions deleted since are dropped
+            existing = {row[0] for row in connection.execute(
+                select([questions.c.id]).where(questions.c.id.in_(list(stats))))}
+            rows = [{'question_id': question_id, 'answered': answered,
+                     'correct': correct}
+                    for question_id, (answered, correct) in stats.items()
+                    if question_id in existing]
+            if rows:
+                connection.execute(UPSERT_STATS, rows)
+
+    def requeue(self, results, stats):
+        with self._condition:
+            self.failures += 1
+            kept = results[:max(self.max_pending - len(self._results), 0)]
+            self.dropped += len(results) - len(kept)
+            self._results[:0] = kept
+
+            for question_id, (answered, correct) in stats.items():
+                counts = self._stats.setdefault(question_id, [0, 0])
+                counts[0] += answered
+                counts[1] += correct
+
+    def pending_stats(self, question_id):
+        # (answered, correct) of the question not written yet
+        with self._condition:
+            return tuple(self._stats.get(question_id, (0, 0)))
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._condition:
+            pending = len(self._results)
+            pending_questions = len(self._stats)
+
+        return {
+            'pending': pending,
+            'pending_questions': pending_questions,
+            'written': self.written,
+            'batches': self.batches,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'dropped': self.dropped,
+        }
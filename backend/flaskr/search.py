@@ -0,0 +1,207 @@
+import bisect
+import math
+import re
+from sqlalchemy import func
+
+from models import db, Question
+from .lazy import LazyLoaded
+from .pagination import QUESTIONS_PER_PAGE, paginate_questions
+
+# words are runs of letters/digits, matching what the search box sends
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+# matches in the question count more than matches in the answer
+QUESTION_WEIGHT = 2
+ANSWER_WEIGHT = 1
+
+
+def tokenize(text):
+    return WORD_PATTERN.findall((text or '').lower())
+
+
+"""
+SearchBackend
+    interface of the question search implementations. search() returns one
+    page of formatted questions, best matches first, and the total number
+    of matches. Every word of the term must match the question or the
+    answer; the last word also matches as a prefix because searches are
+    sent while the user is still typing.
+"""
+class SearchBackend:
+
+    def search(self, term, page=1, per_page=QUESTIONS_PER_PAGE):
+        raise NotImplementedError
+
+    def on_questions_changed(self, action, questions):
+        pass
+
+
+"""
+PostgresSearchBackend
+    full-text search with tsvector/tsquery, ranked with ts_rank and paged
+    in SQL. The expression GIN index is built by migration v0004, outside
+    of any request; PostgreSQL maintains it on every insert and delete so
+    no listener work is needed.
+"""
+class PostgresSearchBackend(SearchBackend):
+
+    def __init__(self, config='english'):
+        self.config = config
+
+    def document(self):
+        return func.to_tsvector(
+            self.config,
+            func.coalesce(Question.question, '') + ' ' +
+            func.coalesce(Question.answer, ''))
+
+    def search(self, term, page=1, per_page=QUESTIONS_PER_PAGE):
+        words = tokenize(term)
+        if not words:
+            return [], 0
+
+        # every word must match, the last one as a prefix
+        words[-1] = words[-1] + ':*'
+        query = func.to_tsquery(self.config, ' & '.join(words))
+
+        document = self.document()
+        selection = Question.query.filter(document.op('@@')(query))
+        rank = func.ts_rank(document, query)
+
+        questions = paginate_questions(selection, page=page, per_page=per_page,
+                                       order_by=[rank.desc(), Question.id])
+        return questions, selection.count()
+
+
+"""
+InMemorySearchBackend
+    a pure-Python inverted index for databases without full-text search
+    (SQLite in tests and local setups). Postings map each word to the
+    weighted term frequency per question id, and a sorted vocabulary
+    answers prefix lookups with bisect. Results are ranked with tf-idf and
+    only the ids of the requested page are read from the database. The
+    index is a LazyLoaded copy: built on first use, updated through the
+    question listeners and built again after max_age seconds to pick up
+    the writes of other workers.
+"""
+class InMemorySearchBackend(LazyLoaded, SearchBackend):
+
+    def __init__(self, max_age=300):
+        super().__init__(max_age)
+        self._postings = {}
+        self._documents = {}
+        self._vocabulary = []
+
+    def load(self):
+        rows = db.session.query(Question.id, Question.question,
+                                Question.answer).all()
+
+        with self._lock:
+            self._postings = {}
+            self._documents = {}
+            self._vocabulary = []
+            for question_id, question, answer in rows:
+                self._add(question_id, question, answer)
+            self.loaded()
+
+    def _add(self, question_id, question, answer):
+        weights = {}
+        for word in tokenize(question):
+            weights[word] = weights.get(word, 0) + QUESTION_WEIGHT
+        for word in tokenize(answer):
+            weights[word] = weights.get(word, 0) + ANSWER_WEIGHT
+
+        for word, weight in weights.items():
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = {}
+                bisect.insort(self._vocabulary, word)
+            postings[question_id] = weight
+        self._documents[question_id] = tuple(weights)
+
+    def _remove(self, question_id):
+        for word in self._documents.pop(question_id, ()):
+            postings = self._postings[word]
+            postings.pop(question_id, None)
+            if not postings:
+                del self._postings[word]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+
+    def on_questions_changed(self, action, questions):
+        # bulk writes, build the index again on next use
+        if action == 'reload':
+            self.invalidate()
+            return
+
+        def change():
+            for question in questions:
+                self._remove(question.id)
+                if action != 'delete':
+                    self._add(question.id, question.question, question.answer)
+
+        self.update(change)
+
+    def _prefix_postings(self, prefix):
+        # merge the postings of every word starting with prefix
+        merged = {}
+        position = bisect.bisect_left(self._vocabulary, prefix)
+        while (position < len(self._vocabulary) and
+               self._vocabulary[position].startswith(prefix)):
+            for question_id, weight in self._postings[
+                    self._vocabulary[position]].items():
+                merged[question_id] = merged.get(question_id, 0) + weight
+            position += 1
+        return merged
+
+    def match(self, term):
+        words = tokenize(term)
+        if not words:
+            return []
+
+        self.ensure_loaded()
+
+        with self._lock:
+            total = max(len(self._documents), 1)
+            postings = [self._postings.get(word, {}) for word in words[:-1]]
+            postings.append(self._prefix_postings(words[-1]))
+
+            # intersect starting from the rarest word
+            postings.sort(key=len)
+            scores = {}
+            for question_id in postings[0]:
+                score = 0.0
+                for word_postings in postings:
+                    weight = word_postings.get(question_id)
+                    if weight is None:
+                        break
+                    idf = math.log(1 + total / len(word_postings))
+                    score += weight * idf
+                else:
+                    scores[question_id] = score
+
+        return sorted(scores, key=lambda question_id: (-scores[question_id],
+                                                       question_id))
+
+    def search(self, term, page=1, per_page=QUESTIONS_PER_PAGE):
+        matches = self.match(term)
+        if page < 1:
+            return [], len(matches)
+
+        start = (page - 1) * per_page
+        page_ids = matches[start:start + per_page]
+        if not page_ids:
+            return [], len(matches)
+
+        # read only this page, in ranking order
+        rows = {question.id: question for question in
+                Question.query.filter(Question.id.in_(page_ids)).all()}
+        questions = [rows[question_id].format() for question_id in page_ids
+                     if question_id in rows]
+
+        return questions, len(matches)
+
+
+def create_search_backend(engine, backend='auto'):
+    if backend == 'postgres' or (backend == 'auto' and
+                                 engine.dialect.name == 'postgresql'):
+        return PostgresSearchBackend()
+    return InMemorySearchBackend()
@@ -0,0 +1,68 @@
+import json
+
+
+"""
+JSONSerializer
+    encodes response payloads to UTF-8 JSON bytes with the standard
+    library, without the indentation and key sorting of jsonify.
+"""
+class JSONSerializer:
+
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':'),
+                          ensure_ascii=False).encode('utf-8')
+
+
+"""
+OrjsonSerializer
+    the same output through orjson, several times faster on the question
+    payloads. Needs the orjson package. Integer keys (the category map)
+    are written as strings, as the json module does.
+"""
+class OrjsonSerializer(JSONSerializer):
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._dumps = orjson.dumps
+        self._option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj):
+        return self._dumps(obj, option=self._option)
+
+
+SERIALIZERS = {
+    'json': JSONSerializer,
+    'orjson': OrjsonSerializer,
+}
+
+
+"""
+create_serializer(name)
+    'json', 'orjson', or 'auto' for orjson when it is installed and the
+    standard library otherwise.
+"""
+def create_serializer(name='auto'):
+    if name == 'auto':
+        try:
+            return OrjsonSerializer()
+        except ImportError:
+            return JSONSerializer()
+
+    if name not in SERIALIZERS:
+        raise ValueError(f'unknown JSON serializer {name!r}')
+    return SERIALIZERS[name]()
+
+
+"""
+encode_page(serializer, fragments, fields)
+    the JSON body of a question page: fields is encoded as an object and
+    the already encoded questions are joined into its 'questions' array,
+    so the questions are not encoded again.
+"""
+def encode_page(serializer, fragments, fields):
+    envelope = serializer.dumps(fields)
+    return b'{"questions":[' + b','.join(fragments) + b'],' + envelope[1:]
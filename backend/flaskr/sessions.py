@@ -0,0 +1,169 @@
+import bisect
+import secrets
+import time
+from array import array
+from collections import OrderedDict
+from threading import Lock
+
+# largest id a session keeps, ids are stored as unsigned 32-bit integers
+MAX_QUESTION_ID = 2 ** 32 - 1
+
+# most ids accepted in previous_questions
+MAX_PREVIOUS_QUESTIONS = 1000
+
+
+"""
+SeenQuestions
+    the compact set of question ids a quiz session has already been asked,
+    a sorted array of 32-bit ids: memory grows with the number of ids
+    seen, whatever their values, and lookups are a binary search.
+"""
+class SeenQuestions:
+
+    __slots__ = ('_ids',)
+
+    def __init__(self, question_ids=()):
+        self._ids = array('I')
+        for question_id in question_ids:
+            self.add(question_id)
+
+    def __contains__(self, question_id):
+        position = bisect.bisect_left(self._ids, question_id)
+        return position < len(self._ids) and self._ids[position] == question_id
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def add(self, question_id):
+        question_id = int(question_id)
+        if not 0 <= question_id <= MAX_QUESTION_ID:
+            return
+
+        position = bisect.bisect_left(self._ids, question_id)
+        if position == len(self._ids) or self._ids[position] != question_id:
+            self._ids.insert(position, question_id)
+
+    def dump(self):
+        return b'A' + self._ids.tobytes()
+
+    @classmethod
+    def load(cls, data):
+        seen = cls()
+        seen._ids.frombytes(data[1:])
+        return seen
+
+
+"""
+QuizSession
+    server-side state of one quiz game: the questions already asked.
+"""
+class QuizSession:
+
+    __slots__ = ('id', 'seen')
+
+    def __init__(self, id=None, seen=None):
+        self.id = id or secrets.token_urlsafe(16)
+        self.seen = seen if seen is not None else SeenQuestions()
+
+    def dump(self):
+        return self.seen.dump()
+
+    @classmethod
+    def load(cls, id, data):
+        return cls(id, SeenQuestions.load(data))
+
+
+"""
+QuizSessionStore
+    interface of the quiz session backends. A shared backend (Redis,
+    memcached, a database table) can implement it by storing
+    session.dump() under session.id with the store's ttl, and rebuilding
+    the session with QuizSession.load().
+"""
+class QuizSessionStore:
+
+    def get(self, session_id):
+        raise NotImplementedError
+
+    def save(self, session):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+
+"""
+MemoryQuizSessionStore
+    in-process LRU store. Sessions expire ttl seconds after their last
+    turn and the least recently used ones are evicted past max_size.
+"""
+class MemoryQuizSessionStore(QuizSessionStore):
+
+    def __init__(self, ttl=3600, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._sessions = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, session_id):
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+
+            session, expires_at = entry
+            if expires_at <= now:
+                del self._sessions[session_id]
+                return None
+
+            return session
+
+    def save(self, session):
+        now = time.monotonic()
+
+        with self._lock:
+            self._sessions[session.id] = (session, now + self.ttl)
+            self._sessions.move_to_end(session.id)
+
+            # evict expired sessions from the cold end, then the overflow
+            while self._sessions:
+                oldest_id, (_, expires_at) = next(iter(self._sessions.items()))
+                if expires_at > now and len(self._sessions) <= self.max_size:
+                    break
+                del self._sessions[oldest_id]
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+"""
+resume_quiz_session(store, request_body, known)
+    the quiz session named by the request body, or a new one. Ids sent
+    as previous_questions (by older clients) are marked as seen, up to
+    MAX_PREVIOUS_QUESTIONS of them, when known(id) says the question
+    exists; other ids are ignored. Raises ValueError on a longer list.
+"""
+def resume_quiz_session(store, request_body, known=None):
+    previous_questions = request_body.get('previous_questions') or []
+    if len(previous_questions) > MAX_PREVIOUS_QUESTIONS:
+        raise ValueError(f'at most {MAX_PREVIOUS_QUESTIONS} previous_questions')
+
+    quiz_session = None
+    if request_body.get('quiz_session'):
+        quiz_session = store.get(request_body['quiz_session'])
+    if quiz_session is None:
+        quiz_session = QuizSession()
+    for question_id in previous_questions:
+        question_id = int(question_id)
+        if known is None or known(question_id):
+            quiz_session.seen.add(question_id)
+    return quiz_session
@@ -0,0 +1,413 @@
+import bisect
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+from array import array
+from threading import Condition, Lock, Thread
+
+from sqlalchemy import select
+
+from models import Category, Question
+from .pagination import QUESTIONS_PER_PAGE
+from .store import compact
+
+MAGIC = b'TRIVSNAP'
+FORMAT_VERSION = 2
+
+# sections of the image, in file order
+SECTIONS = ('ids', 'categories', 'difficulties', 'offsets', 'fragments',
+            'category_ids', 'category_bounds', 'category_positions',
+            'category_types')
+
+# magic, format version, question count, then the offset and length of
+# every section. Native byte order: an image is only shared on one host
+HEADER = struct.Struct('=8sII' + 'QQ' * len(SECTIONS))
+
+# file naming the published image, replaced atomically
+POINTER = 'current'
+# taken by the worker building an image
+LOCK = 'lock'
+IMAGE_PREFIX = 'questions-'
+
+
+def align(size):
+    # sections start on 8 byte boundaries
+    return (size + 7) & ~7
+
+
+"""
+build_image(rows, categories, serializer)
+    the binary image of the question bank. rows are (id, question, answer,
+    category, difficulty) in id order, categories (id, type) pairs. Ids,
+    category ids and difficulties are fixed-width columns; each row is
+    stored as its encoded JSON (the Question.format() dict), located by an
+    offsets column. The positions of every category's rows follow, in id
+    order, then the category map as JSON.
+"""
+def build_image(rows, categories, serializer):
+    ids, category_column, difficulties = array('I'), array('i'), array('h')
+    offsets, fragments = array('Q', [0]), bytearray()
+    by_category = {}
+
+    for position, (question_id, question, answer, category,
+                   difficulty) in enumerate(rows):
+        ids.append(question_id)
+        category_column.append(compact(category))
+        difficulties.append(compact(difficulty))
+        fragments += serializer.dumps({
+            'id': question_id,
+            'question': question,
+            'answer': answer,
+            'category': category,
+            'difficulty': difficulty
+        })
+        offsets.append(len(fragments))
+        by_category.setdefault(compact(category), array('I')).append(position)
+
+    category_ids = array('i', sorted(by_category))
+    category_bounds, category_positions = array('I', [0]), array('I')
+    for category in category_ids:
+        category_positions.extend(by_category[category])
+        category_bounds.append(len(category_positions))
+
+    sections = {
+        'ids': ids,
+        'categories': category_column,
+        'difficulties': difficulties,
+        'offsets': offsets,
+        'fragments': fragments,
+        'category_ids': category_ids,
+        'category_bounds': category_bounds,
+        'category_positions': category_positions,
+        'category_types': json.dumps(list(categories)).encode('utf-8'),
+    }
+
+    start = align(HEADER.size)
+    body, layout = bytearray(), []
+    for name in SECTIONS:
+        data = bytes(sections[name])
+        layout += [start + len(body), len(data)]
+        body += data
+        body += bytes(align(len(body)) - len(body))
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(ids), *layout)
+    return header + bytes(start - HEADER.size) + body
+
+
+"""
+MappedQuestionSnapshot
+    a question image mapped read-only into memory. The columns are views
+    on the mapping, so every worker mapping the same file shares its pages
+    and nothing is copied. Reads as a QuestionSnapshot: count(),
+    page_positions(), fragment() and get(), plus the category map in
+    category_types.
+"""
+class MappedQuestionSnapshot:
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(self._mmap)
+        magic, format_version, _, *layout = HEADER.unpack_from(view)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a question image')
+
+        sections = {name: view[layout[2 * i]:layout[2 * i] + layout[2 * i + 1]]
+                    for i, name in enumerate(SECTIONS)}
+        self.ids = sections['ids'].cast('I')
+        self.categories = sections['categories'].cast('i')
+        self.difficulties = sections['difficulties'].cast('h')
+        self.offsets = sections['offsets'].cast('Q')
+        self.fragments = sections['fragments']
+        self.category_ids = sections['category_ids'].cast('i')
+        self.category_bounds = sections['category_bounds'].cast('I')
+        self.category_positions = sections['category_positions'].cast('I')
+        self.category_types = dict(json.loads(bytes(sections['category_types'])))
+
+    def position(self, question_id):
+        position = bisect.bisect_left(self.ids, question_id)
+        if position < len(self.ids) and self.ids[position] == question_id:
+            return position
+        return None
+
+    def positions(self, category=None):
+        # positions of the category's rows, in id order
+        if category is None:
+            return range(len(self.ids))
+
+        index = bisect.bisect_left(self.category_ids, compact(category))
+        if (index == len(self.category_ids) or
+                self.category_ids[index] != compact(category)):
+            return range(0)
+        return self.category_positions[self.category_bounds[index]:
+                                       self.category_bounds[index + 1]]
+
+    def fragment(self, position, serializer=None):
+        # encoded when the image was built, a view on the mapping
+        return self.fragments[self.offsets[position]:self.offsets[position + 1]]
+
+    def row(self, position):
+        # same dict as Question.format()
+        return json.loads(bytes(self.fragment(position)))
+
+    def get(self, question_id):
+        position = self.position(question_id)
+        return self.row(position) if position is not None else None
+
+    def count(self, category=None):
+        return len(self.positions(category))
+
+    """
+    page_positions(category, page, per_page, after_id)
+        the positions of one page of rows in id order, paged like
+        QuestionSnapshot.page_positions().
+    """
+    def page_positions(self, category=None, page=1, per_page=QUESTIONS_PER_PAGE,
+                       after_id=None):
+        positions = self.positions(category)
+
+        if after_id is not None:
+            # first row past the cursor, by binary search on the ids
+            start, end = 0, len(positions)
+            while start < end:
+                middle = (start + end) // 2
+                if self.ids[positions[middle]] <= after_id:
+                    start = middle + 1
+                else:
+                    end = middle
+        elif page < 1:
+            return []
+        else:
+            start = (page - 1) * per_page
+
+        return positions[start:start + per_page]
+
+    def page(self, category=None, page=1, per_page=QUESTIONS_PER_PAGE,
+             after_id=None):
+        return [self.row(position) for position in
+                self.page_positions(category, page, per_page, after_id)]
+
+    def version(self):
+        return (len(self.ids), self.ids[-1] if len(self.ids) else None)
+
+
+"""
+SharedQuestionStore
+    serves the questions from an image shared by every worker of the host
+    through directory (best on a tmpfs such as /dev/shm). An image is
+    written once per version of the table, named after the digest of its
+    content, and published by replacing the current pointer file; workers
+    map it with MappedQuestionSnapshot, so memory stays flat as workers are
+    added. A file lock lets one worker at a time build an image, reading
+    the table through engine.
+
+    Writes made through the models mark the image stale: a background
+    thread builds and publishes the next one rebuild_delay seconds later,
+    so a burst of writes shares one build and requests never wait for it.
+    Workers look at the pointer at most every check_interval seconds and
+    map the new image when it changed, calling on_remap so caches derived
+    from the old one are dropped; so does the worker mapping an image it
+    built itself. An image older than max_age seconds is
+    built again from the table, in the background as well once an image is
+    mapped, picking up writes made outside of the app.
+"""
+class SharedQuestionStore:
+
+    def __init__(self, directory, serializer, engine, max_age=300,
+                 check_interval=1, rebuild_delay=0.05, on_remap=None,
+                 logger=None):
+        self.directory = directory
+        self.serializer = serializer
+        self.engine = engine
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.rebuild_delay = rebuild_delay
+        self.on_remap = on_remap
+        self.logger = logger
+        self._snapshot = None
+        self._name = None
+        self._checked_at = None
+        self._lock = Lock()
+        self._condition = Condition()
+        self._pending = None
+        self._building = False
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def current(self):
+        # name and age in seconds of the published image, or (None, None)
+        try:
+            with open(self.path(POINTER)) as f:
+                name = f.read().strip()
+            return name, time.time() - os.stat(self.path(name)).st_mtime
+        except FileNotFoundError:
+            return None, None
+
+    def build(self):
+        questions, categories = Question.__table__, Category.__table__
+        with self.engine.connect() as connection:
+            rows = connection.execution_options(stream_results=True).execute(
+                select([questions.c.id, questions.c.question,
+                        questions.c.answer, questions.c.category,
+                        questions.c.difficulty]).order_by(questions.c.id))
+            category_rows = [tuple(row) for row in connection.execute(
+                select([categories.c.id, categories.c.type]).order_by(
+                    categories.c.id))]
+            return build_image(rows, category_rows, self.serializer)
+
+    """
+    publish(force)
+        builds an image from the table and makes it the current one,
+        returning its name. Unless force is set, an image another worker
+        published while this one waited for the lock is kept instead.
+    """
+    def publish(self, force=True):
+        with open(self.path(LOCK), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            if not force:
+                name, age = self.current()
+                if name is not None and age <= self.max_age:
+                    return name
+
+            image = self.build()
+            name = '{}{}.snap'.format(
+                IMAGE_PREFIX, hashlib.blake2b(image, digest_size=16).hexdigest())
+            if os.path.exists(self.path(name)):
+                # same content, its age starts over
+                os.utime(self.path(name))
+            else:
+                self._replace(name, image)
+            self._replace(POINTER, name.encode('utf-8'))
+
+            # workers still mapping an old image keep it until they re-map
+            for old in os.listdir(self.directory):
+                if old.startswith(IMAGE_PREFIX) and old != name:
+                    try:
+                        os.unlink(self.path(old))
+                    except FileNotFoundError:
+                        pass
+
+        return name
+
+    def _replace(self, name, data):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, self.path(name))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def map(self, name):
+        try:
+            snapshot = MappedQuestionSnapshot(self.path(name))
+        except FileNotFoundError:
+            # replaced and removed since the pointer was read
+            name = self.publish(force=False)
+            snapshot = MappedQuestionSnapshot(self.path(name))
+        except ValueError:
+            # written in another format by an older version of the app
+            name = self.publish()
+            snapshot = MappedQuestionSnapshot(self.path(name))
+
+        self._snapshot, self._name = snapshot, name
+        self._checked_at = time.monotonic()
+
+    def check(self):
+        name, age = self.current()
+        if name is None or (age > self.max_age and self._snapshot is None):
+            name = self.publish(force=False)
+        elif age > self.max_age:
+            # the mapped image keeps serving while the next one builds
+            self.rebuild(force=False)
+
+        if name == self._name:
+            self._checked_at = time.monotonic()
+            return
+
+        remapped = self._name is not None
+        self.map(name)
+        if remapped and self.on_remap is not None:
+            self.on_remap()
+
+    def needs_check(self):
+        return (self._snapshot is None or
+                time.monotonic() - self._checked_at > self.check_interval)
+
+    def snapshot(self):
+        if not self.needs_check():
+            return self._snapshot
+
+        # one thread checks the pointer, concurrent requests wait for it
+        with self._lock:
+            if self.needs_check():
+                self.check()
+
+        return self._snapshot
+
+    """
+    rebuild(force)
+        asks the background thread for a new image; force as in publish(),
+        a forced request wins over one that is not.
+    """
+    def rebuild(self, force=True):
+        with self._condition:
+            self._pending = bool(self._pending) or force
+            if self._thread is None:
+                self._thread = Thread(target=self.run, name='question-image',
+                                      daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None)
+            # writes arriving meanwhile are part of the same build
+            time.sleep(self.rebuild_delay)
+
+            with self._condition:
+                force, self._pending = self._pending, None
+                self._building = True
+            try:
+                name = self.publish(force)
+                with self._lock:
+                    changed = name != self._name
+                    if changed:
+                        self.map(name)
+                # responses cached while the old image was still mapped
+                # would outlive the write
+                if changed and self.on_remap is not None:
+                    self.on_remap()
+            except Exception:
+                if self.logger is not None:
+                    self.logger.exception('building the question image failed')
+            finally:
+                with self._condition:
+                    self._building = False
+                    self._condition.notify_all()
+
+    def wait(self, timeout=None):
+        # until no build is requested or running, False on timeout
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._pending is None and not self._building, timeout)
+
+    def on_questions_changed(self, action, questions):
+        # nothing to keep current until an image is first published
+        if self._snapshot is None and self.current()[0] is None:
+            return
+
+        # the write is committed, the image is built again from the table
+        self.rebuild()
@@ -0,0 +1,43 @@
+from sqlalchemy import func
+
+from models import db, Question
+
+# CountCache key of the counts per (category, difficulty)
+STATISTICS_COUNT_KEY = 'statistics'
+
+
+def statistics_query():
+    # one row per (category, difficulty) pair with its question count
+    return db.session.query(Question.category, Question.difficulty,
+                            func.count(Question.id)).group_by(
+        Question.category, Question.difficulty)
+
+
+"""
+question_statistics(counts, categories)
+    the counts per category of the {id: type} map, each with its total
+    and its counts per difficulty, plus the counts per difficulty and
+    the total over every question (uncategorized ones included). counts
+    maps (category, difficulty) to a number of questions, as cached by
+    CountCache.get_grouped(STATISTICS_COUNT_KEY, statistics_query()).
+"""
+def question_statistics(counts, categories):
+    per_category = {category_id: {'type': category_type, 'total': 0,
+                                  'difficulties': {}}
+                    for category_id, category_type in categories.items()}
+    difficulties = {}
+    for (category, difficulty), count in counts.items():
+        if difficulty is not None:
+            difficulties[difficulty] = difficulties.get(difficulty, 0) + count
+
+        entry = per_category.get(category)
+        if entry is not None:
+            entry['total'] += count
+            if difficulty is not None:
+                entry['difficulties'][difficulty] = count
+
+    return {
+        'total_questions': sum(counts.values()),
+        'difficulties': difficulties,
+        'categories': per_category,
+    }
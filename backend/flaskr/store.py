@@ -0,0 +1,285 @@
+import bisect
+import sys
+import time
+from array import array
+
+from models import db, current_question_version, Question
+from .lazy import LazyLoaded
+from .pagination import QUESTIONS_PER_PAGE
+
+# stored in the integer columns for a NULL category or difficulty
+NULL = -1
+
+
+def compact(value):
+    return NULL if value is None else value
+
+
+def expand(value):
+    return None if value == NULL else value
+
+
+"""
+CategoryRows
+    the rows of one category in columns, sorted by id: ids and
+    difficulties in arrays, question and answer texts in lists of interned
+    strings, and the encoded JSON of each row once a response needed it.
+"""
+class CategoryRows:
+
+    __slots__ = ('ids', 'difficulties', 'questions', 'answers', 'fragments')
+
+    def __init__(self, ids=None, difficulties=None, questions=None,
+                 answers=None, fragments=None):
+        self.ids = ids if ids is not None else array('I')
+        self.difficulties = difficulties if difficulties is not None else array('h')
+        self.questions = questions if questions is not None else []
+        self.answers = answers if answers is not None else []
+        self.fragments = fragments if fragments is not None else []
+
+    def copy(self):
+        return CategoryRows(array('I', self.ids), array('h', self.difficulties),
+                            list(self.questions), list(self.answers),
+                            list(self.fragments))
+
+    def position(self, question_id):
+        position = bisect.bisect_left(self.ids, question_id)
+        if position < len(self.ids) and self.ids[position] == question_id:
+            return position
+        return None
+
+    def append(self, question_id, question, answer, difficulty):
+        self.ids.append(question_id)
+        self.difficulties.append(compact(difficulty))
+        self.questions.append(sys.intern(question or ''))
+        self.answers.append(sys.intern(answer or ''))
+        self.fragments.append(None)
+
+    def insert(self, question):
+        position = bisect.bisect_left(self.ids, question.id)
+        self.ids.insert(position, question.id)
+        self.difficulties.insert(position, compact(question.difficulty))
+        self.questions.insert(position, sys.intern(question.question or ''))
+        self.answers.insert(position, sys.intern(question.answer or ''))
+        self.fragments.insert(position, None)
+
+    def remove(self, position):
+        for column in (self.ids, self.difficulties, self.questions,
+                       self.answers, self.fragments):
+            del column[position]
+
+
+"""
+QuestionSnapshot
+    an immutable copy of the questions table: the rows of every category
+    in CategoryRows, plus every id (sorted) with the category of its row.
+    Rows are found by binary search on the ids, and a page is a slice of
+    the ids, so reads run no query and hydrate no ORM object. A position
+    is a (category, index) pair. A write copies the two id columns, flat
+    arrays of integers, and the rows of the categories it touches only.
+"""
+class QuestionSnapshot:
+
+    __slots__ = ('ids', 'categories', 'by_category')
+
+    def __init__(self, ids=None, categories=None, by_category=None):
+        self.ids = ids if ids is not None else array('I')
+        self.categories = categories if categories is not None else array('i')
+        self.by_category = by_category if by_category is not None else {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        snapshot = cls()
+        for question_id, question, answer, category, difficulty in rows:
+            snapshot.ids.append(question_id)
+            snapshot.categories.append(compact(category))
+            rows = snapshot.by_category.get(compact(category))
+            if rows is None:
+                rows = snapshot.by_category[compact(category)] = CategoryRows()
+            rows.append(question_id, question, answer, difficulty)
+        return snapshot
+
+    def copy(self):
+        # the rows stay shared until changed, see _rows_to_change()
+        return QuestionSnapshot(array('I', self.ids), array('i', self.categories),
+                                dict(self.by_category))
+
+    def position(self, question_id):
+        position = bisect.bisect_left(self.ids, question_id)
+        if position < len(self.ids) and self.ids[position] == question_id:
+            category = self.categories[position]
+            return (category,
+                    self.by_category[category].position(question_id))
+        return None
+
+    def row(self, position):
+        # same dict as Question.format()
+        category, index = position
+        rows = self.by_category[category]
+        return {
+            'id': rows.ids[index],
+            'question': rows.questions[index],
+            'answer': rows.answers[index],
+            'category': expand(category),
+            'difficulty': expand(rows.difficulties[index])
+        }
+
+    def fragment(self, position, serializer):
+        # encoded once, a write to the category copies its rows and drops it
+        category, index = position
+        fragments = self.by_category[category].fragments
+        fragment = fragments[index]
+        if fragment is None:
+            fragment = fragments[index] = serializer.dumps(self.row(position))
+        return fragment
+
+    def get(self, question_id):
+        position = self.position(question_id)
+        return self.row(position) if position is not None else None
+
+    def count(self, category=None):
+        if category is None:
+            return len(self.ids)
+        rows = self.by_category.get(category)
+        return len(rows.ids) if rows is not None else 0
+
+    """
+    page_positions(category, page, per_page, after_id)
+        the positions of one page of rows in id order, paged like
+        paginate_questions(): by page number, or the rows after the
+        after_id cursor. category None pages through every question.
+    """
+    def page_positions(self, category=None, page=1, per_page=QUESTIONS_PER_PAGE,
+                       after_id=None):
+        if category is None:
+            ids = self.ids
+        else:
+            rows = self.by_category.get(category)
+            ids = rows.ids if rows is not None else ()
+
+        if after_id is not None:
+            start = bisect.bisect_right(ids, after_id)
+        elif page < 1:
+            return []
+        else:
+            start = (page - 1) * per_page
+
+        if category is None:
+            return [self.position(question_id)
+                    for question_id in ids[start:start + per_page]]
+        return [(category, index)
+                for index in range(start, min(start + per_page, len(ids)))]
+
+    def page(self, category=None, page=1, per_page=QUESTIONS_PER_PAGE,
+             after_id=None):
+        return [self.row(position) for position in
+                self.page_positions(category, page, per_page, after_id)]
+
+    def _rows_to_change(self, category, copied):
+        # the rows of a category are copied once per write, on first change
+        if category not in copied:
+            rows = self.by_category.get(category)
+            self.by_category[category] = (rows.copy() if rows is not None
+                                          else CategoryRows())
+            copied.add(category)
+        return self.by_category[category]
+
+    def _insert(self, question, copied):
+        category = compact(question.category)
+        position = bisect.bisect_left(self.ids, question.id)
+        self.ids.insert(position, question.id)
+        self.categories.insert(position, category)
+        self._rows_to_change(category, copied).insert(question)
+
+    def _remove(self, question_id, copied):
+        position = bisect.bisect_left(self.ids, question_id)
+        if position == len(self.ids) or self.ids[position] != question_id:
+            return
+
+        category = self.categories[position]
+        del self.ids[position]
+        del self.categories[position]
+        rows = self._rows_to_change(category, copied)
+        rows.remove(rows.position(question_id))
+        if not rows.ids:
+            del self.by_category[category]
+
+
+"""
+QuestionStore
+    serves the questions from an in-process QuestionSnapshot. Writes made
+    through the models are applied to a copy that then replaces the
+    snapshot, so readers never lock and never see a half-applied write.
+    Writes from other workers are picked up by comparing the question
+    version at most every check_interval seconds, and by a full reload
+    after max_age seconds (writes made outside of the app do not bump the
+    version). After its own write the store takes the new version when it
+    is the next one, that is when no other worker wrote meanwhile.
+"""
+class QuestionStore(LazyLoaded):
+
+    def __init__(self, max_age=300, check_interval=5):
+        super().__init__(max_age)
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._version = None
+        self._checked_at = None
+
+    def load(self):
+        # read before the rows: a write in between makes the next check
+        # load again rather than be missed
+        version = current_question_version()
+        rows = db.session.query(Question.id, Question.question,
+                                Question.answer, Question.category,
+                                Question.difficulty).order_by(
+            Question.id).yield_per(10000)
+        snapshot = QuestionSnapshot.from_rows(rows)
+
+        with self._lock:
+            self._snapshot = snapshot
+            self._version = version
+            self.loaded()
+            self._checked_at = self._loaded_at
+
+    def check_version(self):
+        version = current_question_version()
+        self._checked_at = time.monotonic()
+        return version == self._version
+
+    def needs_check(self):
+        return time.monotonic() - self._checked_at > self.check_interval
+
+    def snapshot(self):
+        if not self.is_stale() and not self.needs_check():
+            return self._snapshot
+
+        # one thread loads or checks, concurrent requests wait for it
+        with self._load_lock:
+            if self.is_stale():
+                self.reload()
+            elif self.needs_check() and not self.check_version():
+                self.reload()
+
+        return self._snapshot
+
+    def on_questions_changed(self, action, questions):
+        # bulk writes, load the store again on next use
+        if action == 'reload':
+            self.invalidate()
+            return
+
+        # the version after this write, taken when no other worker wrote
+        version = (current_question_version() if self._loaded_at is not None
+                   or self._pending is not None else None)
+
+        def change():
+            snapshot, copied = self._snapshot.copy(), set()
+            for question in questions:
+                snapshot._remove(question.id, copied)
+                if action != 'delete':
+                    snapshot._insert(question, copied)
+            self._snapshot = snapshot
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+
+        self.update(change)
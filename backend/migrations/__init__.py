@@ -0,0 +1,112 @@
+"""
+Versioned schema changes.
+
+Every migration is a module with a VERSION number, a DESCRIPTION and an
+upgrade(connection) function. Applied versions are recorded in the
+schema_version table; upgrade() runs the missing ones in order, each in
+its own transaction, or in autocommit mode on PostgreSQL for a module
+setting TRANSACTIONAL = False.
+"""
+import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, text
+
+from . import (v0001_initial_schema, v0002_category_foreign_key,
+               v0003_quiz_results, v0004_search_index,
+               v0005_question_version)
+
+MIGRATIONS = [
+    v0001_initial_schema,
+    v0002_category_foreign_key,
+    v0003_quiz_results,
+    v0004_search_index,
+    v0005_question_version,
+]
+
+LATEST_VERSION = MIGRATIONS[-1].VERSION
+
+# key of the advisory lock taken while migrating PostgreSQL
+LOCK_KEY = 7401
+
+metadata = MetaData()
+
+schema_version = Table(
+    'schema_version', metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String),
+    Column('applied_at', DateTime),
+)
+
+
+def current_version(connection):
+    if not connection.dialect.has_table(connection, 'schema_version'):
+        return 0
+
+    version = connection.execute(
+        text('SELECT MAX(version) FROM schema_version')).scalar()
+    return version or 0
+
+
+def apply(connection, migration):
+    if current_version(connection) >= migration.VERSION:
+        return
+
+    migration.upgrade(connection)
+    connection.execute(schema_version.insert().values(
+        version=migration.VERSION,
+        description=migration.DESCRIPTION,
+        applied_at=datetime.datetime.utcnow()))
+
+
+"""
+apply_outside_transaction(engine, migration)
+    applies a migration whose statements cannot run in a transaction,
+    such as CREATE INDEX CONCURRENTLY: on PostgreSQL in autocommit mode,
+    under a session advisory lock (released even when it fails), and in
+    a transaction elsewhere.
+"""
+def apply_outside_transaction(engine, migration):
+    if engine.dialect.name != 'postgresql':
+        with engine.begin() as connection:
+            apply(connection, migration)
+        return
+
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+        connection.execute(text('SELECT pg_advisory_lock(:key)'), key=LOCK_KEY)
+        try:
+            apply(connection, migration)
+        finally:
+            connection.execute(text('SELECT pg_advisory_unlock(:key)'),
+                               key=LOCK_KEY)
+
+
+"""
+upgrade(engine, target)
+    applies the migrations newer than the current version, up to target
+    (the latest by default), and returns the resulting version. On
+    PostgreSQL an advisory lock keeps workers booting together from
+    running the same migration twice.
+"""
+def upgrade(engine, target=None):
+    target = LATEST_VERSION if target is None else target
+
+    with engine.begin() as connection:
+        schema_version.create(connection, checkfirst=True)
+
+    for migration in MIGRATIONS:
+        if migration.VERSION > target:
+            break
+
+        if not getattr(migration, 'TRANSACTIONAL', True):
+            apply_outside_transaction(engine, migration)
+            continue
+
+        with engine.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                connection.execute(text('SELECT pg_advisory_xact_lock(:key)'),
+                                   key=LOCK_KEY)
+            apply(connection, migration)
+
+    with engine.connect() as connection:
+        return current_version(connection)
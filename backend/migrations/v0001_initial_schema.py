@@ -0,0 +1,102 @@
+"""
+The categories and questions tables with the starter content, as the
+trivia.psql dump used to create them. Databases that were bootstrapped
+from the dump, or by db.create_all(), already have the tables and keep
+their rows; empty tables get the starter content.
+"""
+from sqlalchemy import (Column, ForeignKey, Integer, MetaData, Table, Text,
+                        func, select, text)
+
+VERSION = 1
+DESCRIPTION = 'categories and questions tables with the starter content'
+
+metadata = MetaData()
+
+categories = Table(
+    'categories', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('type', Text),
+)
+
+questions = Table(
+    'questions', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('question', Text),
+    Column('answer', Text),
+    Column('difficulty', Integer),
+    Column('category', Integer,
+           ForeignKey('categories.id', name='category',
+                      onupdate='CASCADE', ondelete='SET NULL')),
+)
+
+CATEGORIES = [
+    (1, 'Science'),
+    (2, 'Art'),
+    (3, 'Geography'),
+    (4, 'History'),
+    (5, 'Entertainment'),
+    (6, 'Sports'),
+]
+
+# (id, question, answer, difficulty, category)
+QUESTIONS = [
+    (5, "Whose autobiography is entitled 'I Know Why the Caged Bird Sings'?",
+     'Maya Angelou', 2, 4),
+    (9, "What boxer's original name is Cassius Clay?", 'Muhammad Ali', 1, 4),
+    (2, 'What movie earned Tom Hanks his third straight Oscar nomination, '
+        'in 1996?', 'Apollo 13', 4, 5),
+    (4, 'What actor did author Anne Rice first denounce, then praise in the '
+        'role of her beloved Lestat?', 'Tom Cruise', 4, 5),
+    (6, 'What was the title of the 1990 fantasy directed by Tim Burton about '
+        'a young man with multi-bladed appendages?', 'Edward Scissorhands',
+     3, 5),
+    (10, 'Which is the only team to play in every soccer World Cup '
+         'tournament?', 'Brazil', 3, 6),
+    (11, 'Which country won the first ever soccer World Cup in 1930?',
+     'Uruguay', 4, 6),
+    (12, 'Who invented Peanut Butter?', 'George Washington Carver', 2, 4),
+    (13, 'What is the largest lake in Africa?', 'Lake Victoria', 2, 3),
+    (14, 'In which royal palace would you find the Hall of Mirrors?',
+     'The Palace of Versailles', 3, 3),
+    (15, 'The Taj Mahal is located in which Indian city?', 'Agra', 2, 3),
+    (16, 'Which Dutch graphic artist–initials M C was a creator of '
+         'optical illusions?', 'Escher', 1, 2),
+    (17, 'La Giaconda is better known as what?', 'Mona Lisa', 3, 2),
+    (18, 'How many paintings did Van Gogh sell in his lifetime?', 'One', 4, 2),
+    (19, 'Which American artist was a pioneer of Abstract Expressionism, and '
+         'a leading exponent of action painting?', 'Jackson Pollock', 2, 2),
+    (20, 'What is the heaviest organ in the human body?', 'The Liver', 4, 1),
+    (21, 'Who discovered penicillin?', 'Alexander Fleming', 3, 1),
+    (22, 'Hematology is a branch of medicine involving the study of what?',
+     'Blood', 4, 1),
+    (23, 'Which dung beetle was worshipped by the ancient Egyptians?',
+     'Scarab', 4, 4),
+]
+
+
+def is_empty(connection, table):
+    return connection.execute(
+        select([func.count()]).select_from(table)).scalar() == 0
+
+
+def upgrade(connection):
+    metadata.create_all(connection, checkfirst=True)
+
+    if is_empty(connection, categories):
+        connection.execute(categories.insert(), [
+            {'id': category_id, 'type': category_type}
+            for category_id, category_type in CATEGORIES])
+
+    if is_empty(connection, questions):
+        connection.execute(questions.insert(), [
+            {'id': question_id, 'question': question, 'answer': answer,
+             'difficulty': difficulty, 'category': category}
+            for question_id, question, answer, difficulty, category
+            in QUESTIONS])
+
+    # explicit ids leave the PostgreSQL sequences behind
+    if connection.dialect.name == 'postgresql':
+        for table in ('categories', 'questions'):
+            connection.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table}), 1))"))
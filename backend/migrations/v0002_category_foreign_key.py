@@ -0,0 +1,74 @@
+"""
+questions.category becomes an integer foreign key to categories.id, with
+composite indexes for the category filters: (category, difficulty) and
+(category, id). Databases created by db.create_all() had a varchar
+category compared against integer ids; those values are converted and
+rows pointing at a missing category are set to NULL.
+"""
+from sqlalchemy import Integer, inspect, text
+
+VERSION = 2
+DESCRIPTION = 'integer category foreign key and category indexes'
+
+INDEXES = {
+    'ix_questions_category_difficulty': '(category, difficulty)',
+    'ix_questions_category_id': '(category, id)',
+}
+
+
+def upgrade_postgresql(connection, inspector):
+    category = next(column for column in inspector.get_columns('questions')
+                    if column['name'] == 'category')
+
+    if not isinstance(category['type'], Integer):
+        connection.execute(text(
+            "ALTER TABLE questions ALTER COLUMN category TYPE integer "
+            "USING NULLIF(trim(category), '')::integer"))
+
+    if not inspector.get_foreign_keys('questions'):
+        connection.execute(text(
+            "UPDATE questions SET category = NULL WHERE category NOT IN "
+            "(SELECT id FROM categories)"))
+        connection.execute(text(
+            "ALTER TABLE questions ADD CONSTRAINT questions_category_fkey "
+            "FOREIGN KEY (category) REFERENCES categories (id) "
+            "ON UPDATE CASCADE ON DELETE SET NULL"))
+
+
+def upgrade_sqlite(connection, inspector):
+    category = next(column for column in inspector.get_columns('questions')
+                    if column['name'] == 'category')
+
+    if isinstance(category['type'], Integer) and \
+            inspector.get_foreign_keys('questions'):
+        return
+
+    # SQLite can't change a column type, so the table is rebuilt
+    connection.execute(text(
+        "CREATE TABLE questions_new ("
+        "id INTEGER NOT NULL PRIMARY KEY, "
+        "question TEXT, "
+        "answer TEXT, "
+        "difficulty INTEGER, "
+        "category INTEGER REFERENCES categories (id) "
+        "ON UPDATE CASCADE ON DELETE SET NULL)"))
+    connection.execute(text(
+        "INSERT INTO questions_new (id, question, answer, difficulty, category) "
+        "SELECT id, question, answer, difficulty, "
+        "CASE WHEN CAST(category AS INTEGER) IN (SELECT id FROM categories) "
+        "THEN CAST(category AS INTEGER) END FROM questions"))
+    connection.execute(text("DROP TABLE questions"))
+    connection.execute(text("ALTER TABLE questions_new RENAME TO questions"))
+
+
+def upgrade(connection):
+    inspector = inspect(connection)
+
+    if connection.dialect.name == 'postgresql':
+        upgrade_postgresql(connection, inspector)
+    elif connection.dialect.name == 'sqlite':
+        upgrade_sqlite(connection, inspector)
+
+    for name, columns in INDEXES.items():
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {name} ON questions {columns}"))
@@ -0,0 +1,43 @@
+"""
+The quiz_results table, one row per finished game, indexed on the score
+for the leaderboard, and question_stats, the answer counts of every
+question, dropped with the question.
+"""
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer,
+                        MetaData, String, Table)
+
+VERSION = 3
+DESCRIPTION = 'quiz results and per-question answer statistics'
+
+metadata = MetaData()
+
+# the questions table as far as the foreign key needs it
+Table('questions', metadata, Column('id', Integer, primary_key=True))
+
+quiz_results = Table(
+    'quiz_results', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('player', String, nullable=False),
+    Column('score', Integer, nullable=False),
+    Column('questions', Integer, nullable=False),
+    Column('category', Integer),
+    Column('quiz_session', String),
+    Column('created_at', DateTime, nullable=False),
+)
+
+# best scores first, the earlier game first among equal scores
+Index('ix_quiz_results_score', quiz_results.c.score.desc(),
+      quiz_results.c.created_at)
+
+question_stats = Table(
+    'question_stats', metadata,
+    Column('question_id', Integer,
+           ForeignKey('questions.id', ondelete='CASCADE'), primary_key=True),
+    Column('answered', Integer, nullable=False, default=0),
+    Column('correct', Integer, nullable=False, default=0),
+)
+
+
+def upgrade(connection):
+    quiz_results.create(connection, checkfirst=True)
+    question_stats.create(connection, checkfirst=True)
@@ -0,0 +1,33 @@
+"""
+The GIN expression index of the PostgreSQL full-text search, built with
+CREATE INDEX CONCURRENTLY so writes to questions go on while it builds.
+That statement cannot run in a transaction, so this migration runs in
+autocommit mode. Other databases search in memory and get no index.
+"""
+from sqlalchemy import text
+
+VERSION = 4
+DESCRIPTION = 'full-text search index on questions'
+TRANSACTIONAL = False
+
+INDEX_NAME = 'ix_questions_search'
+
+# the document PostgresSearchBackend searches, in its default config
+DOCUMENT = ("to_tsvector('english', "
+            "coalesce(question, '') || ' ' || coalesce(answer, ''))")
+
+
+def upgrade(connection):
+    if connection.dialect.name != 'postgresql':
+        return
+
+    # an interrupted concurrent build leaves an invalid index behind
+    invalid = connection.execute(text(
+        'SELECT NOT indisvalid FROM pg_index '
+        'WHERE indexrelid = to_regclass(:name)'), name=INDEX_NAME).scalar()
+    if invalid:
+        connection.execute(text(f'DROP INDEX CONCURRENTLY {INDEX_NAME}'))
+
+    connection.execute(text(
+        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME} '
+        f'ON questions USING GIN ({DOCUMENT})'))
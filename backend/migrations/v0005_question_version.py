@@ -0,0 +1,24 @@
+"""
+question_version, a single row counting the committed writes to the
+questions table. The write paths of the app bump it in the transaction of
+their write, so in-memory copies of the table notice the writes of other
+workers with one primary key lookup.
+"""
+from sqlalchemy import BigInteger, Column, Integer, MetaData, Table, select
+
+VERSION = 5
+DESCRIPTION = 'write counter of the questions table'
+
+metadata = MetaData()
+
+question_version = Table(
+    'question_version', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('version', BigInteger, nullable=False),
+)
+
+
+def upgrade(connection):
+    question_version.create(connection, checkfirst=True)
+    if connection.execute(select([question_version.c.id])).first() is None:
+        connection.execute(question_version.insert().values(id=1, version=0))
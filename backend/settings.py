@@ -3,4 +3,100 @@ import os
 load_dotenv()
 DB_NAME = os.environ.get("DB_NAME")
 DB_USER=os.environ.get("DB_USER")
-DB_PASSWORD = os.environ.get("DB_PASSWORD")
\ No newline at end of file
+DB_PASSWORD = os.environ.get("DB_PASSWORD")
+
+# database connection pool, sizes are per worker process
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# migrate an outdated schema when the app starts, a current one gets no DDL
+DB_AUTO_UPGRADE = os.environ.get("DB_AUTO_UPGRADE", "true").lower() in ("1", "true", "yes")
+
+# quiz sessions kept on the server, in seconds and number of sessions
+QUIZ_SESSION_TTL = int(os.environ.get("QUIZ_SESSION_TTL", 3600))
+QUIZ_SESSION_MAX = int(os.environ.get("QUIZ_SESSION_MAX", 10000))
+
+# how long the category map is served from memory, in seconds
+CATEGORY_CACHE_TTL = int(os.environ.get("CATEGORY_CACHE_TTL", 300))
+
+# question search: 'auto' picks full-text search on PostgreSQL and the
+# in-memory index elsewhere, 'postgres' or 'memory' force one of them
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "auto")
+
+# cached GET responses: number of entries and seconds each one is kept
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 1024))
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 60))
+
+# per-request timing and SQL instrumentation, exposed on /metrics
+INSTRUMENTATION_ENABLED = os.environ.get("INSTRUMENTATION_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# serve question reads from an in-process columnar copy of the table
+QUESTION_STORE_ENABLED = os.environ.get("QUESTION_STORE_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# directory (best on a tmpfs, e.g. /dev/shm/trivia) of a question image
+# shared by every worker of the host; set, it replaces the in-process copy
+QUESTION_STORE_SHARED_DIR = os.environ.get("QUESTION_STORE_SHARED_DIR", "")
+
+# JSON encoding of question pages and exports: 'auto' uses orjson when it
+# is installed, 'json' or 'orjson' force one of them
+JSON_SERIALIZER = os.environ.get("JSON_SERIALIZER", "auto")
+
+# response compression: encodings in order of preference ('br,gzip'),
+# empty turns it off. Bodies under the minimum size are sent as they are
+RESPONSE_COMPRESSION = os.environ.get("RESPONSE_COMPRESSION", "")
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.environ.get("RESPONSE_COMPRESSION_MIN_SIZE", 1024))
+RESPONSE_COMPRESSION_LEVEL = int(os.environ.get("RESPONSE_COMPRESSION_LEVEL", 6))
+
+# questions per page by default, and the largest ?per_page= accepted
+QUESTIONS_PER_PAGE = int(os.environ.get("QUESTIONS_PER_PAGE", 10))
+MAX_QUESTIONS_PER_PAGE = int(os.environ.get("MAX_QUESTIONS_PER_PAGE", 100))
+
+# questions in a quiz round by default, and the most a round or a
+# prefetch may ask for
+QUIZ_ROUND_SIZE = int(os.environ.get("QUIZ_ROUND_SIZE", 5))
+QUIZ_ROUND_MAX = int(os.environ.get("QUIZ_ROUND_MAX", 20))
+
+# read replicas, comma-separated SQLAlchemy URLs. Read-only routes are
+# spread over them, writes and anything else stay on the primary
+DB_REPLICA_URLS = [url.strip() for url in os.environ.get("DB_REPLICA_URLS", "").split(",") if url.strip()]
+# seconds between health checks of a replica
+DB_REPLICA_CHECK_INTERVAL = int(os.environ.get("DB_REPLICA_CHECK_INTERVAL", 10))
+# seconds a client reads from the primary after its own write
+DB_READ_YOUR_WRITES_WINDOW = int(os.environ.get("DB_READ_YOUR_WRITES_WINDOW", 5))
+
+# admission control of POST /quiz, /quiz/round and /questions/search: a
+# token bucket per client and route (tokens per second, bucket size), and
+# at most RATE_LIMIT_MAX_CONCURRENT of them running at once per worker,
+# with up to RATE_LIMIT_MAX_QUEUE more waiting RATE_LIMIT_QUEUE_TIMEOUT
+# seconds. Over the rate answers 429, a full queue 503
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "false").lower() in ("1", "true", "yes")
+RATE_LIMIT_RATE = float(os.environ.get("RATE_LIMIT_RATE", 5))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 20))
+RATE_LIMIT_MAX_CONCURRENT = int(os.environ.get("RATE_LIMIT_MAX_CONCURRENT", DB_POOL_SIZE))
+RATE_LIMIT_MAX_QUEUE = int(os.environ.get("RATE_LIMIT_MAX_QUEUE", 10))
+RATE_LIMIT_QUEUE_TIMEOUT = float(os.environ.get("RATE_LIMIT_QUEUE_TIMEOUT", 2))
+
+# statement timeouts in milliseconds, 0 for none: STATEMENT_TIMEOUT for
+# every route, STATEMENT_TIMEOUTS per route ("/quiz=2000,/questions/search=1000")
+STATEMENT_TIMEOUT = int(os.environ.get("STATEMENT_TIMEOUT", 0))
+STATEMENT_TIMEOUTS = {route.strip(): int(timeout) for route, timeout in (
+    entry.split("=", 1) for entry in os.environ.get("STATEMENT_TIMEOUTS", "").split(",") if "=" in entry)}
+
+# queries of at least SLOW_QUERY_THRESHOLD milliseconds are kept, with
+# their plan, in a log of SLOW_QUERY_LOG_SIZE entries (0 turns it off)
+SLOW_QUERY_THRESHOLD = float(os.environ.get("SLOW_QUERY_THRESHOLD", 250))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get("SLOW_QUERY_LOG_SIZE", 100))
+SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN", "true").lower() in ("1", "true", "yes")
+
+# quiz results are written behind in batches: every RESULTS_FLUSH_SIZE
+# results or RESULTS_FLUSH_INTERVAL seconds (0 writes from the request
+# that fills a batch), with at most RESULTS_MAX_PENDING waiting; past it
+# POST /quiz/results answers 503. The leaderboard keeps the best
+# LEADERBOARD_SIZE results in memory
+RESULTS_FLUSH_SIZE = int(os.environ.get("RESULTS_FLUSH_SIZE", 100))
+RESULTS_FLUSH_INTERVAL = float(os.environ.get("RESULTS_FLUSH_INTERVAL", 2))
+RESULTS_MAX_PENDING = int(os.environ.get("RESULTS_MAX_PENDING", 10000))
+LEADERBOARD_SIZE = int(os.environ.get("LEADERBOARD_SIZE", 100))
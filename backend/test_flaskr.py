@@ -1,11 +1,81 @@
 from settings import DB_NAME, DB_USER, DB_PASSWORD
+import asyncio
+import importlib.util
 import os
+import sqlite3
+import tempfile
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import gzip
+from sqlalchemy import create_engine, exc, inspect
+from sqlalchemy.pool import StaticPool
+
+import migrations
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.diagnostics import (SlowQueryLog, StatementTimeouts,
+                                is_statement_timeout)
+from models import db, Question, QuestionStat, QuizResult
+
+
+"""
+InMemoryDatabase
+    the in-memory SQLite database of a test run, one connection shared by
+    every app the tests create. The schema and starter content are built
+    once; each test then runs inside a transaction that tearDown rolls
+    back. Commits made by the app release a savepoint and rollbacks return
+    to it, so the app behaves as on a real database and no test sees the
+    rows of another.
+"""
+class InMemoryDatabase:
+
+    def __init__(self):
+        self.connection = sqlite3.connect(':memory:', check_same_thread=False,
+                                          isolation_level=None)
+        self.in_test = False
+
+    def engine_options(self):
+        return {'creator': lambda: self, 'poolclass': StaticPool}
+
+    def begin(self):
+        self.connection.execute('BEGIN')
+        self.connection.execute('SAVEPOINT app')
+        self.in_test = True
+
+    def end(self):
+        self.in_test = False
+        self.connection.execute('ROLLBACK')
+
+    def commit(self):
+        if self.in_test:
+            self.connection.execute('RELEASE app')
+            self.connection.execute('SAVEPOINT app')
+
+    def rollback(self):
+        if self.in_test:
+            self.connection.execute('ROLLBACK TO app')
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+test_database = None
+
+
+def setUpModule():
+    global test_database
+    test_database = InMemoryDatabase()
+    migrations.upgrade(create_engine('sqlite://', **test_database.engine_options()))
+
+
+# a migrated SQLite file, for tests that need a database of their own
+def migrated_database(name):
+    path = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), name)
+    migrations.upgrade(create_engine(path))
+    return path
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -13,22 +83,21 @@ class TriviaTestCase(unittest.TestCase):
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        test_database.begin()
+        self.app = self.create_app()
         self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.database_path = "postgres://{}/{}".format('localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-    
     def tearDown(self):
         """Executed after reach test"""
-        pass
+        db.session.remove()
+        test_database.end()
+
+    # an app on the test database, config added to the test config
+    def create_app(self, config=None):
+        return create_app(dict({'DATABASE_PATH': 'sqlite://',
+                                'DATABASE_ENGINE_OPTIONS':
+                                    test_database.engine_options()},
+                               **(config or {})))
 
   
 
@@ -58,6 +127,192 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'resource not found')
     
+    # Category Statistics Route - counts kept current on writes
+    def test_get_category_statistics(self):
+        res = self.client().get('/categories/statistics')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], Question.query.count())
+        self.assertEqual(data['categories']['5']['total'],
+                         Question.query.filter_by(category=5).count())
+        self.assertEqual(data['categories']['5']['difficulties']['4'],
+                         Question.query.filter_by(category=5, difficulty=4).count())
+
+        question = Question(question='stats question', answer='stats answer',
+                            difficulty=4, category=5)
+        question.insert()
+        updated = json.loads(self.client().get('/categories/statistics').data)
+        question.delete()
+
+        self.assertEqual(updated['total_questions'], data['total_questions'] + 1)
+        self.assertEqual(updated['categories']['5']['difficulties']['4'],
+                         data['categories']['5']['difficulties']['4'] + 1)
+        self.assertEqual(updated['difficulties']['4'], data['difficulties']['4'] + 1)
+
+    # Pool Metrics Route
+    def test_get_pool_metrics(self):
+        self.client().get('/questions')
+        res = self.client().get('/metrics/pool')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIn('checkouts', data['pool'])
+        self.assertIn('wait_time_max_ms', data['pool'])
+
+    # Metrics Route
+    def test_get_metrics(self):
+        resp = self.client().get('/questions')
+
+        self.assertIn('sql;dur=', resp.headers.get('Server-Timing'))
+
+        res = self.client().get('/metrics')
+        body = res.data.decode('utf-8')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_request_duration_seconds_count'
+                      '{method="GET",route="/questions"}', body)
+
+    # Question Route - keyset cursor
+    def test_get_questions_after_id_cursor(self):
+        resp = self.client().get('/questions?after_id=0')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(data['success'], True)
+        ids = [question['id'] for question in data['questions']]
+        self.assertEqual(ids, sorted(ids))
+
+        # the next page starts after the last id of this one
+        resp = self.client().get(f'/questions?after_id={ids[-1]}')
+        data = json.loads(resp.data)
+        if resp.status_code == 200:
+            self.assertTrue(all(question['id'] > ids[-1]
+                                for question in data['questions']))
+
+    # Question Route - cached responses are cleared by writes
+    def test_get_questions_cache_cleared_on_create(self):
+        res = self.client().get('/questions')
+        etag = res.headers.get('ETag')
+
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+        self.client().post('/question', json={
+            'question': 'new question', 'answer': 'new answer',
+            'difficulty': 1, 'category': 1})
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], Question.query.count())
+
+    # Question Route - served from the in-memory question store
+    def test_get_questions_from_question_store(self):
+        app = self.create_app({'QUESTION_STORE_ENABLED': True})
+        res = app.test_client().get('/categories/5/questions')
+        data = json.loads(res.data)
+        expected = self.client().get('/categories/5/questions')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['questions'], json.loads(expected.data)['questions'])
+
+        question = Question(question='store question', answer='store answer',
+                            difficulty=1, category=5)
+        question.insert()
+        res = app.test_client().get('/questions?after_id={}'.format(question.id - 1))
+        data = json.loads(res.data)
+        question.delete()
+
+        self.assertEqual(data['questions'][0]['question'], 'store question')
+
+    # Question Route - the question store sees updates made by another worker
+    def test_question_store_sees_updates_from_other_workers(self):
+        app = self.create_app({'QUESTION_STORE_ENABLED': True,
+                               'RESPONSE_CACHE_TTL': 0})
+        app.extensions['question_store'].check_interval = 0
+        listing = json.loads(app.test_client().get('/categories/6/questions').data)
+
+        writer = self.create_app({'QUESTION_STORE_ENABLED': True})
+        res = writer.test_client().patch('/questions/batch',
+                                         json={'filter': {'category': 1,
+                                                          'difficulty': 4},
+                                               'values': {'category': 6}})
+        updated = json.loads(res.data)['updated']
+        data = json.loads(app.test_client().get('/categories/6/questions').data)
+
+        self.assertTrue(updated)
+        self.assertEqual(data['total_questions'],
+                         listing['total_questions'] + len(updated))
+
+    # Question Route - served from the question image shared by the workers
+    def test_get_questions_from_shared_question_store(self):
+        directory = tempfile.mkdtemp()
+        app = self.create_app({'QUESTION_STORE_SHARED_DIR': directory})
+        res = app.test_client().get('/categories/5/questions')
+        data = json.loads(res.data)
+        expected = json.loads(self.client().get('/categories/5/questions').data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['questions'], expected['questions'])
+        self.assertEqual(data['current_category'], expected['current_category'])
+        self.assertEqual(json.loads(app.test_client().get('/categories').data),
+                         json.loads(self.client().get('/categories').data))
+
+        # a write made by another worker publishes an image this one maps,
+        # built in the background
+        writer = self.create_app({'QUESTION_STORE_SHARED_DIR': directory})
+        app.extensions['question_store'].check_interval = 0
+        question = Question(question='shared question', answer='shared answer',
+                            difficulty=1, category=5)
+        question.insert()
+        self.assertTrue(writer.extensions['question_store'].wait(10))
+        res = app.test_client().get('/questions?after_id={}'.format(question.id - 1))
+        data = json.loads(res.data)
+        quiz = json.loads(app.test_client().post('/quiz/round', json={
+            'quiz_category': {'id': 5}, 'count': 20}).data)
+        question.delete()
+        self.assertTrue(writer.extensions['question_store'].wait(10))
+
+        self.assertEqual(data['questions'][0]['question'], 'shared question')
+        self.assertIn(question.id, [drawn['id'] for drawn in quiz['questions']])
+        self.assertEqual(len([name for name in os.listdir(directory)
+                              if name.endswith('.snap')]), 1)
+
+    # Question Route - a shared store's writer drops its cached listings
+    def test_get_questions_after_write_to_shared_question_store(self):
+        app = self.create_app({'QUESTION_STORE_SHARED_DIR': tempfile.mkdtemp()})
+        total_before = json.loads(
+            app.test_client().get('/questions').data)['total_questions']
+
+        question = Question(question='shared question', answer='shared answer',
+                            difficulty=1, category=5)
+        question.insert()
+        # cached while the image is being built, dropped once it is mapped
+        app.test_client().get('/questions')
+        self.assertTrue(app.extensions['question_store'].wait(10))
+        total_after = json.loads(
+            app.test_client().get('/questions').data)['total_questions']
+        question.delete()
+        self.assertTrue(app.extensions['question_store'].wait(10))
+
+        self.assertEqual(total_after, total_before + 1)
+
+    # Question Route - compressed when the client accepts gzip
+    def test_get_questions_compressed(self):
+        app = self.create_app({'RESPONSE_COMPRESSION': 'gzip',
+                               'RESPONSE_COMPRESSION_MIN_SIZE': 0})
+        res = app.test_client().get('/questions',
+                                    headers={'Accept-Encoding': 'gzip'})
+        data = json.loads(gzip.decompress(res.data))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), 10)
+
     # Categories Route - success
     def test_get_all_categories(self):
         res = self.client().get('/categories')
@@ -67,6 +322,17 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['categories']))
 
+    # Categories Route - revalidation with the ETag
+    def test_get_categories_not_modified(self):
+        res = self.client().get('/categories')
+        etag = res.headers.get('ETag')
+
+        self.assertIsNotNone(etag)
+
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+
     # Categories Route - Error
     def test_404_sent_when_requesting_non_existing_category(self):
         res = self.client().get('/categories/9999')
@@ -87,9 +353,9 @@ class TriviaTestCase(unittest.TestCase):
         data = json.loads(res.data)
 
         question = Question.query.filter(
-            Question.id == question.id).one_or_none()
+            Question.id == question_id).one_or_none()
 
-        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertEqual(data['deleted'], str(question_id))
         self.assertEqual(question, None)
@@ -120,6 +386,163 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertEqual(total_questions_after, total_questions_before + 1)
 
+    # Batch Create Route
+    def test_create_questions_in_batch(self):
+        batch = {'questions': [
+            {'question': 'batch question 1', 'answer': 'answer',
+             'difficulty': 1, 'category': 1},
+            {'question': 'batch question 2', 'answer': 'answer',
+             'difficulty': 2, 'category': 2},
+        ]}
+        res = self.client().post('/questions/batch', json=batch)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['created']), 2)
+        self.assertEqual(data['total_questions'], Question.query.count())
+
+    # Batch Create Route - one bad row rejects the batch
+    def test_422_create_questions_in_batch(self):
+        total_questions_before = Question.query.count()
+        batch = {'questions': [
+            {'question': 'batch question', 'answer': 'answer',
+             'difficulty': 1, 'category': 1},
+            {'question': 'batch question', 'answer': 'answer',
+             'difficulty': 'hard', 'category': 1},
+            {'question': 'batch question', 'answer': 'answer',
+             'difficulty': 500, 'category': 1},
+        ]}
+        res = self.client().post('/questions/batch', json=batch)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual([error['index'] for error in data['errors']], [1, 2])
+        self.assertEqual(Question.query.count(), total_questions_before)
+
+    # Batch Delete Route - a result per id, missing ids reported
+    def test_delete_questions_in_batch(self):
+        questions = [Question(question=f'bad question {number}', answer='answer',
+                              difficulty=1, category=1) for number in range(3)]
+        for question in questions:
+            question.insert()
+        question_ids = [question.id for question in questions]
+        total_questions_before = Question.query.count()
+
+        res = self.client().delete('/questions/batch',
+                                   json={'ids': question_ids + [99999]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], question_ids)
+        self.assertEqual(data['results'][-1], {'id': 99999, 'status': 'not_found'})
+        self.assertEqual(data['total_questions'], total_questions_before - 3)
+        self.assertEqual(Question.query.filter(
+            Question.id.in_(question_ids)).count(), 0)
+
+    # Batch Update Route - by filter, the listings see the change
+    def test_update_questions_in_batch(self):
+        category_total = json.loads(
+            self.client().get('/categories/6/questions').data)['total_questions']
+        res = self.client().patch('/questions/batch',
+                                  json={'filter': {'category': 1, 'difficulty': 4},
+                                        'values': {'category': 6}})
+        data = json.loads(res.data)
+        listing = json.loads(self.client().get('/categories/6/questions').data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['updated'])
+        self.assertTrue(all(result['status'] == 'updated'
+                            for result in data['results']))
+        self.assertEqual(listing['total_questions'],
+                         category_total + len(data['updated']))
+        self.assertEqual(Question.query.filter(Question.category == 1,
+                                               Question.difficulty == 4).count(), 0)
+
+    # Batch Update Route - values are checked before anything is written
+    def test_422_update_questions_in_batch(self):
+        res = self.client().patch('/questions/batch',
+                                  json={'ids': [2, 4], 'values': {'category': 42}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['errors'][0]['message'], 'unknown category 42')
+        self.assertEqual(Question.query.get(2).category, 5)
+
+        res = self.client().patch('/questions/batch',
+                                  json={'ids': [2, 4], 'values': {'difficulty': 500}})
+        self.assertEqual(res.status_code, 422)
+        self.assertNotEqual(Question.query.get(2).difficulty, 500)
+
+    # Batch Update Route - a filter matching too many questions is refused
+    def test_422_update_questions_in_batch_filter_too_broad(self):
+        db.session.execute(Question.__table__.insert(), [
+            {'question': f'bulk question {n}', 'answer': 'bulk answer',
+             'category': 2, 'difficulty': 3} for n in range(1001)])
+        db.session.commit()
+        matching = Question.query.filter_by(category=2, difficulty=3).count()
+
+        res = self.client().patch('/questions/batch',
+                                  json={'filter': {'category': 2, 'difficulty': 3},
+                                        'values': {'difficulty': 4}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['errors'][0]['message'],
+                         'the filter matches more than 1000 questions')
+        self.assertEqual(Question.query.filter_by(category=2,
+                                                  difficulty=3).count(), matching)
+
+    # Bulk Import Route
+    def test_import_questions(self):
+        rows = '\n'.join([
+            json.dumps({'question': 'bulk question', 'answer': 'bulk answer',
+                        'difficulty': 1, 'category': 1}),
+            json.dumps({'question': 'bulk question', 'answer': '',
+                        'difficulty': 1, 'category': 1}),
+            json.dumps({'question': 5, 'answer': 'bulk answer',
+                        'difficulty': 1, 'category': 1}),
+        ])
+        res = self.client().post('/questions/import', data=rows,
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['rejected'], 2)
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3])
+
+    # Bulk Import Route - an import stopped by an error reports its count
+    def test_422_import_questions(self):
+        res = self.client().post('/questions/import', data=b'\xff\xfe\n',
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['inserted'], 0)
+
+    # Bulk Export Route
+    def test_export_questions(self):
+        res = self.client().get('/questions/export')
+        lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(lines), Question.query.count())
+        self.assertIn('question', json.loads(lines[0]))
+
+    # Question 422 Error - unknown category
+    def test_422_add_question_unknown_category(self):
+        total_questions_before = Question.query.count()
+        res = self.client().post('/question', json={
+            'question': 'new question', 'answer': 'new answer',
+            'difficulty': 1, 'category': 99})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(Question.query.count(), total_questions_before)
+
     # Question 422 Error
     def test_422_add_question(self):
         new_question = {
@@ -145,6 +568,41 @@ class TriviaTestCase(unittest.TestCase):
         self.assertIsNotNone(data['questions'])
         self.assertIsNotNone(data['total_questions'])
 
+    # Search Route - answers are searched too
+    def test_search_questions_matches_answer(self):
+        question = Question(question='new question', answer='Zanzibar',
+                            difficulty=1, category=1)
+        question.insert()
+
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'zanzi'})
+        data = json.loads(res.data)
+        question.delete()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(question.id, [q['id'] for q in data['questions']])
+
+    # Search - the in-memory index is built again to see other workers' writes
+    def test_search_questions_after_write_from_other_worker(self):
+        search = {'searchTerm': 'zyzzyva'}
+        res = self.client().post('/questions/search', json=search)
+        self.assertEqual(json.loads(res.data)['total_questions'], 0)
+
+        # written without the app's listeners, as another worker would
+        with self.app.app_context():
+            db.session.execute(Question.__table__.insert().values(
+                question='What is a zyzzyva?', answer='a weevil',
+                difficulty=1, category=1))
+            db.session.commit()
+
+        stale = self.client().post('/questions/search', json=search)
+        self.app.extensions['search_backend'].max_age = 0
+        res = self.client().post('/questions/search', json=search)
+
+        self.assertEqual(json.loads(stale.data)['total_questions'], 0)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['total_questions'], 1)
+
     # Search Not Found
     def test_404_search_question_not_found(self):
         new_search = {
@@ -168,6 +626,19 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertTrue(data['current_category'])
 
+    # Questions by Category - total of the category, page size
+    def test_get_questions_per_category_total_and_per_page(self):
+        res = self.client().get('/categories/1/questions?per_page=2')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 2)
+        self.assertEqual(data['total_questions'],
+                         Question.query.filter_by(category=1).count())
+
+        res = self.client().get('/categories/1/questions?per_page=1000')
+        self.assertEqual(res.status_code, 400)
+
     # Questions by Category Not Found
     def test_404_get_questions_per_category(self):
         res = self.client().get('/categories/b/questions')
@@ -185,8 +656,155 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().post('/quiz', json=new_quiz_round)
         data = json.loads(res.data)
 
-        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+
+    # Quiz Route - previous questions are never drawn again
+    def test_play_quiz_skips_previous_questions(self):
+        previous_questions = [question.id for question in
+                              Question.query.filter_by(category=5).all()][1:]
+        new_quiz_round = {'previous_questions': previous_questions,
+                          'quiz_category': {'type': 'Entertainment', 'id': 5}}
+
+        res = self.client().post('/quiz', json=new_quiz_round)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertNotIn(data['question']['id'], previous_questions)
+
+    # Quiz Route - the quiz session replaces previous_questions
+    def test_play_quiz_with_quiz_session(self):
+        new_quiz_round = {'previous_questions': [],
+                          'quiz_category': {'type': 'Entertainment', 'id': 5}}
+        res = self.client().post('/quiz', json=new_quiz_round)
+        data = json.loads(res.data)
+        first_question_id = data['question']['id']
+
+        next_quiz_round = {'quiz_session': data['quiz_session'],
+                           'quiz_category': {'type': 'Entertainment', 'id': 5}}
+        res = self.client().post('/quiz', json=next_quiz_round)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['quiz_session'], next_quiz_round['quiz_session'])
+        if data['question']:
+            self.assertNotEqual(data['question']['id'], first_question_id)
+
+    # Quiz Route - unknown previous_questions are not kept in the session
+    def test_play_quiz_ignores_unknown_previous_questions(self):
+        question_id = Question.query.first().id
+        new_quiz_round = {'previous_questions': [question_id, 2 ** 28, 2 ** 40],
+                          'quiz_category': {'type': 'ALL', 'id': 0}}
+        res = self.client().post('/quiz', json=new_quiz_round)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        quiz_sessions = self.app.extensions['quiz_sessions']
+        seen = quiz_sessions.get(data['quiz_session']).seen
+        self.assertIn(question_id, seen)
+        self.assertNotIn(2 ** 28, seen)
+        self.assertLess(len(seen.dump()), 64)
+
+        new_quiz_round['previous_questions'] = list(range(1, 2000))
+        res = self.client().post('/quiz', json=new_quiz_round)
+        self.assertEqual(res.status_code, 422)
+
+    # Quiz Route - a question written while the index loads is not lost
+    def test_question_index_keeps_writes_made_during_load(self):
+        question_index = self.app.extensions['question_index']
+        question = Question(question='late question', answer='late answer',
+                            difficulty=1, category=5)
+        loaded = question_index.loaded
+
+        # the rows are read, the insert lands before the index is swapped in
+        def insert_then_loaded():
+            question.insert()
+            loaded()
+
+        question_index.loaded = insert_then_loaded
+        with self.app.app_context():
+            known = question_index.known(question.id or -1)
+            question_index.loaded = loaded
+            self.assertTrue(question_index.known(question.id))
+            question.delete()
+            self.assertFalse(question_index.known(question.id))
+        self.assertFalse(known)
+
+    # Quiz Route - async serving mode, needs requirements-async.txt
+    @unittest.skipUnless(importlib.util.find_spec('databases'),
+                         'async packages not installed')
+    def test_play_quiz_async(self):
+        from flaskr.asgi import create_asgi_app
+
+        app = create_asgi_app({'DATABASE_PATH': migrated_database('async.db')})
+        body = json.dumps({'previous_questions': [],
+                           'quiz_category': {'id': 5, 'type': 'Entertainment'}})
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body.encode(),
+                    'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        async def play():
+            await app.router.startup()
+            await app({'type': 'http', 'method': 'POST', 'path': '/quiz',
+                       'root_path': '', 'query_string': b'',
+                       'headers': [(b'content-type', b'application/json')]},
+                      receive, send)
+            await app.router.shutdown()
+
+        asyncio.run(play())
+        data = json.loads(messages[1]['body'])
+
+        self.assertEqual(messages[0]['status'], 200)
         self.assertEqual(data['success'], True)
+        self.assertEqual(data['question']['category'], 5)
+        self.assertTrue(data['quiz_session'])
+
+    # Quiz Round - distinct questions of the category and difficulty
+    def test_play_quiz_round(self):
+        quiz_round = {'quiz_category': {'id': 0, 'type': 'click'},
+                      'difficulty': 4, 'count': 3}
+        res = self.client().post('/quiz/round', json=quiz_round)
+        data = json.loads(res.data)
+        question_ids = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(question_ids), 3)
+        self.assertEqual(len(set(question_ids)), 3)
+        self.assertTrue(all(question['difficulty'] == 4
+                            for question in data['questions']))
+
+        quiz_round = {'quiz_category': {'id': 0, 'type': 'click'},
+                      'quiz_session': data['quiz_session'], 'count': 20}
+        res = self.client().post('/quiz/round', json=quiz_round)
+        data = json.loads(res.data)
+        self.assertFalse(set(question_ids) & {question['id'] for question in data['questions']})
+
+    def test_400_play_quiz_round_too_large(self):
+        quiz_round = {'quiz_category': {'id': 0, 'type': 'click'}, 'count': 1000}
+        res = self.client().post('/quiz/round', json=quiz_round)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    # Quiz Route - prefetch
+    def test_play_quiz_with_prefetch(self):
+        new_quiz_round = {'previous_questions': [], 'prefetch': 2,
+                          'quiz_category': {'id': 2, 'type': 'Art'}}
+        res = self.client().post('/quiz', json=new_quiz_round)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['next_questions']), 2)
+        self.assertNotIn(data['question']['id'],
+                         [question['id'] for question in data['next_questions']])
 
     # Quiz Not Found
     def test_404_play_quiz(self):
@@ -197,6 +815,176 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "unprocessable")
+
+    # Read replicas - reads go to the replica, a writer reads the primary
+    def test_read_replica_routing(self):
+        primary = migrated_database('primary.db')
+        replica = migrated_database('replica.db')
+
+        app = create_app({'DATABASE_PATH': primary,
+                          'DATABASE_REPLICAS': [replica]})
+        writer = app.test_client()
+        res = writer.post('/question', json={'question': 'replica question',
+                                             'answer': 'primary answer',
+                                             'difficulty': 1, 'category': 1})
+        created = json.loads(res.data)['created']
+
+        own = json.loads(writer.get('/categories/1/questions').data)
+        other = json.loads(app.test_client().get('/categories/1/questions').data)
+        pool = json.loads(app.test_client().get('/metrics/pool').data)
+
+        self.assertIn('db_primary_until', res.headers['Set-Cookie'])
+        self.assertIn(created, [question['id'] for question in own['questions']])
+        self.assertNotIn(created, [question['id'] for question in other['questions']])
+        self.assertEqual(pool['replicas'][0]['healthy'], True)
+
+    # Rate limiting - a client over its rate gets 429 with Retry-After
+    def test_429_play_quiz_rate_limited(self):
+        app = self.create_app({'RATE_LIMIT_ENABLED': True,
+                               'RATE_LIMIT_RATE': 0.01, 'RATE_LIMIT_BURST': 2})
+        body = {'quiz_category': {'id': 0}, 'previous_questions': []}
+        statuses = [app.test_client().post('/quiz', json=body).status_code
+                    for _ in range(3)]
+        res = app.test_client().post('/quiz', json=body)
+        data = json.loads(res.data)
+        limits = json.loads(app.test_client().get('/metrics/ratelimit').data)
+
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(res.status_code, 429)
+        self.assertGreater(int(res.headers['Retry-After']), 0)
+        self.assertEqual(data['message'], 'too many requests')
+        self.assertEqual(limits['ratelimit']['rate_limited'], 2)
+
+    # Load shedding - no free slot and no room to queue gets 503
+    def test_503_search_questions_shed(self):
+        app = self.create_app({'RATE_LIMIT_ENABLED': True,
+                               'RATE_LIMIT_MAX_CONCURRENT': 1,
+                               'RATE_LIMIT_MAX_QUEUE': 0})
+        concurrency = app.extensions['rate_limiter'].concurrency
+        concurrency.acquire()
+        res = app.test_client().post('/questions/search',
+                                     json={'searchTerm': 'title'})
+        concurrency.release()
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data['message'], 'service unavailable')
+        self.assertEqual(app.test_client().post('/questions/search',
+                                                json={'searchTerm': 'title'}).status_code, 200)
+
+    # Diagnostics - slow queries are kept with their parameters and plan
+    def test_get_slow_queries(self):
+        app = self.create_app({'SLOW_QUERY_THRESHOLD': 0})
+        app.test_client().get('/categories/1/questions')
+        res = app.test_client().get('/diagnostics/slow-queries')
+        data = json.loads(res.data)
+        entry = next(entry for entry in data['slow_queries']
+                     if entry['route'] == '/categories/<int:id>/questions' and
+                     'FROM questions' in entry['statement'])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['threshold_ms'], 0)
+        self.assertIn(1, entry['parameters'])
+        self.assertTrue(entry['plan'])
+
+    # Diagnostics - schema changes are logged but never explained
+    def test_slow_queries_explain_only_queries(self):
+        engine = create_engine('sqlite://')
+        slow_queries = SlowQueryLog(threshold=0)
+        slow_queries.init_engine(engine)
+        with engine.begin() as connection:
+            connection.execute('CREATE TABLE slow (id INTEGER)')
+            connection.execute('SELECT id FROM slow')
+        plans = {entry['statement']: entry['plan']
+                 for entry in slow_queries.snapshot()}
+
+        self.assertIsNone(plans['CREATE TABLE slow (id INTEGER)'])
+        self.assertTrue(plans['SELECT id FROM slow'])
+
+    # Diagnostics - a query over its route's statement timeout is cancelled
+    def test_statement_timeout_cancels_query(self):
+        engine = create_engine('sqlite://')
+        StatementTimeouts(routes={'/questions': 50}).init_engine(engine)
+        endless = ('WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) '
+                   'SELECT COUNT(*) FROM n')
+
+        with self.app.test_request_context('/questions'):
+            with self.assertRaises(exc.OperationalError) as raised:
+                engine.execute(endless)
+
+        self.assertTrue(is_statement_timeout(raised.exception))
+        self.assertEqual(engine.execute('SELECT 1').scalar(), 1)
+
+    # Quiz Results Route - written in a batch once the batch is full
+    def test_record_quiz_results(self):
+        app = self.create_app({'RESULTS_FLUSH_SIZE': 2,
+                               'RESULTS_FLUSH_INTERVAL': 0})
+        client = app.test_client()
+        res = client.get('/leaderboard')
+        self.assertEqual(res.status_code, 200)
+        best = json.loads(res.data)['leaderboard']
+
+        res = client.post('/quiz/results', json={
+            'player': 'ada', 'quiz_category': {'type': 'Art', 'id': '2'},
+            'answers': [{'question_id': 16, 'correct': True},
+                        {'question_id': 17, 'correct': True}]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(data['score'], 2)
+        self.assertEqual(app.extensions['result_recorder'].stats()['pending'], 1)
+        self.assertEqual(QuizResult.query.count(), 0)
+
+        # pending answers already count in the question's stats
+        data = json.loads(client.get('/questions/16/stats').data)
+        self.assertEqual((data['answered'], data['correct']), (1, 1))
+
+        client.post('/quiz/results', json={
+            'player': 'bob', 'answers': [{'question_id': 16, 'correct': False}]})
+
+        self.assertEqual(QuizResult.query.count(), 2)
+        stat = QuestionStat.query.filter_by(question_id=16).one()
+        self.assertEqual((stat.answered, stat.correct), (2, 1))
+
+        leaderboard = json.loads(client.get('/leaderboard').data)['leaderboard']
+        self.assertEqual(len(leaderboard), len(best) + 2)
+        self.assertEqual(leaderboard[0]['player'], 'ada')
+        self.assertNotIn('quiz_session', leaderboard[0])
+
+    # Quiz Results Route - Expected Errors
+    def test_422_and_503_record_quiz_results(self):
+        app = self.create_app({'RESULTS_MAX_PENDING': 1,
+                               'RESULTS_FLUSH_INTERVAL': 0})
+        client = app.test_client()
+        res = client.post('/quiz/results', json={'player': 'ada', 'answers': []})
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(json.loads(res.data)['success'], False)
+
+        body = {'player': 'ada', 'answers': [{'question_id': 5, 'correct': True}]}
+        self.assertEqual(client.post('/quiz/results', json=body).status_code, 202)
+        res = client.post('/quiz/results', json=body)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertIn('Retry-After', res.headers)
+
+        # a close writes what is still queued
+        app.extensions['result_recorder'].close()
+        self.assertEqual(QuizResult.query.count(), 1)
+
+    # Migrations - a new database gets the schema and the starter content
+    def test_migrations_upgrade_new_database(self):
+        engine = create_engine('sqlite://')
+        version = migrations.upgrade(engine)
+        inspector = inspect(engine)
+
+        self.assertEqual(version, migrations.LATEST_VERSION)
+        self.assertEqual(migrations.upgrade(engine), version)
+        self.assertEqual(engine.execute('SELECT COUNT(*) FROM questions').scalar(), 19)
+        self.assertEqual(inspector.get_foreign_keys('questions')[0]['referred_table'],
+                         'categories')
+        self.assertTrue({'ix_questions_category_difficulty', 'ix_questions_category_id'} <=
+                        {index['name'] for index in inspector.get_indexes('questions')})
     
     
 # Make the tests conveniently executable
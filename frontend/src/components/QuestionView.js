@@ -12,14 +12,31 @@ class QuestionView extends Component {
       page: 1,
       totalQuestions: 0,
       categories: {},
+      statistics: {},
       currentCategory: null,
     };
   }
 
   componentDidMount() {
     this.getQuestions();
+    this.getStatistics();
   }
 
+  // question counts per category, shown next to the names
+  getStatistics = () => {
+    $.ajax({
+      url: '/categories/statistics',
+      type: 'GET',
+      success: (result) => {
+        this.setState({ statistics: result.categories });
+        return;
+      },
+      error: (error) => {
+        return;
+      },
+    });
+  };
+
   getQuestions = () => {
     $.ajax({
       url: `/questions?page=${this.state.page}`, 
@@ -146,6 +163,8 @@ class QuestionView extends Component {
                 }}
               >
                 {this.state.categories[id]}
+                {this.state.statistics[id] &&
+                  ` (${this.state.statistics[id].total})`}
                 <img
                   className='category'
                   alt={`${this.state.categories[id].toLowerCase()}`}
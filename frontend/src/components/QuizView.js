@@ -9,13 +9,19 @@ class QuizView extends Component {
     super();
     this.state = {
       quizCategory: null,
+      quizSession: null,
+      roundQuestions: [],
       previousQuestions: [],
       showAnswer: false,
       categories: {},
+      statistics: {},
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
       forceEnd: false,
+      player: '',
+      answers: [],
+      leaderboard: [],
     };
   }
 
@@ -32,47 +38,128 @@ class QuizView extends Component {
         return;
       },
     });
+    this.getStatistics();
   }
 
+  // how many questions each category holds, for the picker
+  getStatistics = () => {
+    $.ajax({
+      url: '/categories/statistics',
+      type: 'GET',
+      success: (result) => {
+        this.setState({ statistics: result.categories });
+        return;
+      },
+      error: (error) => {
+        return;
+      },
+    });
+  };
+
   selectCategory = ({ type, id = 0 }) => {
-    this.setState({ quizCategory: { type, id } }, this.getNextQuestion);
+    this.setState({ quizCategory: { type, id } }, this.getRound);
   };
 
   handleChange = (event) => {
     this.setState({ [event.target.name]: event.target.value });
   };
 
+  // one request fetches every question of the round
+  getRound = () => {
+    $.ajax({
+      url: '/quiz/round',
+      type: 'POST',
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        quiz_session: this.state.quizSession,
+        quiz_category: this.state.quizCategory,
+        count: questionsPerPlay,
+      }),
+      xhrFields: {
+        withCredentials: true,
+      },
+      crossDomain: true,
+      success: (result) => {
+        const [currentQuestion, ...roundQuestions] = result.questions;
+        this.setState({
+          showAnswer: false,
+          quizSession: result.quiz_session,
+          roundQuestions: roundQuestions,
+          currentQuestion: currentQuestion || {},
+          guess: '',
+          forceEnd: currentQuestion ? false : true,
+        });
+        return;
+      },
+      error: (error) => {
+        alert('Unable to load question. Please try your request again');
+        return;
+      },
+    });
+  };
+
   getNextQuestion = () => {
     const previousQuestions = [...this.state.previousQuestions];
     if (this.state.currentQuestion.id) {
       previousQuestions.push(this.state.currentQuestion.id);
     }
 
+    // the round's questions are already here, no request per question
+    const [currentQuestion, ...roundQuestions] = this.state.roundQuestions;
+    const ended =
+      !currentQuestion || previousQuestions.length === questionsPerPlay;
+    this.setState(
+      {
+        showAnswer: false,
+        previousQuestions: previousQuestions,
+        roundQuestions: roundQuestions,
+        currentQuestion: currentQuestion || {},
+        guess: '',
+        forceEnd: currentQuestion ? false : true,
+      },
+      ended ? this.sendResult : undefined
+    );
+  };
+
+  // the finished game is recorded, then the best scores are shown
+  sendResult = () => {
+    if (this.state.answers.length === 0) {
+      return;
+    }
+
     $.ajax({
-      url: '/quiz', 
+      url: '/quiz/results',
       type: 'POST',
       dataType: 'json',
       contentType: 'application/json',
       data: JSON.stringify({
-        previous_questions: previousQuestions,
+        player: this.state.player.trim() || 'Anonymous',
         quiz_category: this.state.quizCategory,
+        quiz_session: this.state.quizSession,
+        answers: this.state.answers,
       }),
       xhrFields: {
         withCredentials: true,
       },
       crossDomain: true,
+      success: this.getLeaderboard,
+      error: (error) => {
+        alert('Unable to save your score. Please try your request again');
+        return;
+      },
+    });
+  };
+
+  getLeaderboard = () => {
+    $.ajax({
+      url: '/leaderboard?limit=5',
+      type: 'GET',
       success: (result) => {
-        this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: '',
-          forceEnd: result.question ? false : true,
-        });
+        this.setState({ leaderboard: result.leaderboard });
         return;
       },
       error: (error) => {
-        alert('Unable to load question. Please try your request again');
         return;
       },
     });
@@ -84,24 +171,39 @@ class QuizView extends Component {
     this.setState({
       numCorrect: !evaluate ? this.state.numCorrect : this.state.numCorrect + 1,
       showAnswer: true,
+      answers: [
+        ...this.state.answers,
+        { question_id: this.state.currentQuestion.id, correct: evaluate },
+      ],
     });
   };
 
   restartGame = () => {
     this.setState({
       quizCategory: null,
+      quizSession: null,
+      roundQuestions: [],
       previousQuestions: [],
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
       forceEnd: false,
+      answers: [],
+      leaderboard: [],
     });
   };
 
   renderPrePlay() {
     return (
       <div className='quiz-play-holder'>
+        <input
+          type='text'
+          name='player'
+          placeholder='Your name'
+          value={this.state.player}
+          onChange={this.handleChange}
+        />
         <div className='choose-header'>Choose Category</div>
         <div className='category-holder'>
           <div className='play-category' onClick={this.selectCategory}>
@@ -118,6 +220,8 @@ class QuizView extends Component {
                 }
               >
                 {this.state.categories[id]}
+                {this.state.statistics[id] &&
+                  ` (${this.state.statistics[id].total})`}
               </div>
             );
           })}
@@ -132,6 +236,15 @@ class QuizView extends Component {
         <div className='final-header'>
           Your Final Score is {this.state.numCorrect}
         </div>
+        {this.state.leaderboard.length > 0 && (
+          <ol className='leaderboard'>
+            {this.state.leaderboard.map((result, index) => (
+              <li key={index}>
+                {result.player}: {result.score}/{result.questions}
+              </li>
+            ))}
+          </ol>
+        )}
         <div className='play-again button' onClick={this.restartGame}>
           Play Again?
         </div>